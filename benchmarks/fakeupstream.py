@@ -0,0 +1,270 @@
+# Local stand-ins for the services podcast-sponsor-block calls: the parts of the YouTube Data API it uses (playlists,
+# playlistItems, videos and channels), SponsorBlock, the iTunes lookup and the video downloads yt-dlp makes (served as
+# a direct link to synthetic audio). Point the service at them with the PODCAST_*_URL variables from
+# upstream_environment. Every playlist ID exists and has the configured number of episodes, plus any added with
+# add_episode
+import json
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
+
+PLAYLIST_PAGE_SIZE = 50
+FIRST_PUBLISHED_AT = datetime(2015, 1, 1, tzinfo=timezone.utc)
+THUMBNAILS = {"default": {"url": "https://example.com/thumbnail.jpg"}}
+# Every video has one sponsor segment here, so every download is cut
+SPONSOR_SEGMENT = (30.0, 60.0)
+
+
+def create_synthetic_audio(output_path: Path, duration_seconds: int) -> None:
+    # A sine tone encoded like the m4a audio YouTube serves, so ffprobe and ffmpeg treat it like the real thing
+    subprocess.run(
+        (
+            "ffmpeg",
+            "-y",
+            "-loglevel",
+            "error",
+            "-f",
+            "lavfi",
+            "-i",
+            f"sine=frequency=440:sample_rate=44100:duration={duration_seconds}",
+            "-c:a",
+            "aac",
+            "-b:a",
+            "128k",
+            str(output_path),
+        ),
+        check=True,
+    )
+
+
+def get_video_id(playlist_id: str, index: int) -> str:
+    return f"{playlist_id[-8:]}{index:06d}"
+
+
+def create_playlist_item(playlist_id: str, index: int) -> dict:
+    return {
+        "snippet": {
+            "resourceId": {"videoId": get_video_id(playlist_id, index)},
+            "title": f"Episode {index}: a title with <markup> & entities",
+            "description": "An episode description that is a few sentences long. " * 10,
+            "channelTitle": "Benchmark Channel",
+            "channelId": "UCbenchmark",
+            "thumbnails": THUMBNAILS,
+            "publishedAt": (FIRST_PUBLISHED_AT + timedelta(days=index)).isoformat(),
+        },
+        "status": {"privacyStatus": "public"},
+    }
+
+
+class FakeUpstream:
+    def __init__(
+        self, episode_count: int, audio_path: Path, latency_seconds: float = 0
+    ):
+        self.episode_count = episode_count
+        self.audio_path = audio_path
+        self.latency_seconds = latency_seconds
+        self.requests = Counter()
+        self._added_episodes: Counter = Counter()
+        self._lock = threading.Lock()
+        self._server: Optional[UpstreamServer] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def upstream_environment(self) -> dict[str, str]:
+        return {
+            "PODCAST_YOUTUBE_API_URL": f"{self.url}/",
+            "PODCAST_SPONSORBLOCK_API_URL": f"{self.url}/sponsorblock/api/skipSegments",
+            "PODCAST_ITUNES_LOOKUP_URL": f"{self.url}/itunes/lookup",
+            "PODCAST_YOUTUBE_VIDEO_URL_TEMPLATE": f"{self.url}/media/{{video_id}}.m4a",
+        }
+
+    def start(self) -> None:
+        upstream = self
+
+        class Handler(UpstreamRequestHandler):
+            fake_upstream = upstream
+
+        self._server = UpstreamServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(
+            target=self._server.serve_forever, name="fake-upstream", daemon=True
+        ).start()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset_requests(self) -> None:
+        with self._lock:
+            self.requests.clear()
+
+    def add_episode(self, playlist_id: str) -> str:
+        # Publishes a new episode at the top of the playlist and returns its video ID
+        with self._lock:
+            self._added_episodes[playlist_id] += 1
+            return get_video_id(playlist_id, self.count_episodes(playlist_id) - 1)
+
+    def count_episodes(self, playlist_id: str) -> int:
+        return self.episode_count + self._added_episodes[playlist_id]
+
+    def record_request(self, name: str) -> None:
+        with self._lock:
+            self.requests[name] += 1
+
+    def get_playlist_items_page(self, playlist_id: str, page_token: str) -> dict:
+        # Newest first, like the playlists podcasts are usually made from
+        episode_count = self.count_episodes(playlist_id)
+        page_index = int(page_token or 0)
+        newest_index = episode_count - 1 - page_index * PLAYLIST_PAGE_SIZE
+        page = {
+            "etag": f"{playlist_id}-{episode_count}-{page_index}",
+            "pageInfo": {
+                "totalResults": episode_count,
+                "resultsPerPage": PLAYLIST_PAGE_SIZE,
+            },
+            "items": [
+                create_playlist_item(playlist_id, index)
+                for index in range(
+                    newest_index, max(newest_index - PLAYLIST_PAGE_SIZE, -1), -1
+                )
+            ],
+        }
+        if newest_index - PLAYLIST_PAGE_SIZE >= 0:
+            page["nextPageToken"] = str(page_index + 1)
+        return page
+
+
+class UpstreamServer(ThreadingHTTPServer):
+    def handle_error(self, request, client_address) -> None:
+        # yt-dlp hangs up on the first response it gets for a direct link once it has sniffed the content type
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class UpstreamRequestHandler(BaseHTTPRequestHandler):
+    fake_upstream: FakeUpstream
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+    def send_json(self, body, status: int = 200, etag: Optional[str] = None) -> None:
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        if etag is not None:
+            self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def send_empty(self, status: int) -> None:
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def send_audio(self, include_body: bool) -> None:
+        audio = self.fake_upstream.audio_path.read_bytes()
+        self.send_response(200)
+        self.send_header("Content-Type", "audio/mp4")
+        self.send_header("Content-Length", str(len(audio)))
+        self.end_headers()
+        if include_body:
+            self.wfile.write(audio)
+
+    def do_HEAD(self) -> None:
+        path = urlparse(self.path).path
+        if path.startswith("/media/"):
+            self.send_audio(include_body=False)
+        else:
+            self.send_empty(405)
+
+    def do_GET(self) -> None:
+        upstream = self.fake_upstream
+        parsed_url = urlparse(self.path)
+        query = {name: values[0] for name, values in parse_qs(parsed_url.query).items()}
+        path = parsed_url.path
+        # Requests are counted by API (e.g. playlistItems, sponsorblock or media)
+        upstream.record_request(
+            path.split("/")[-1] if "/v3/" in path else path.split("/")[1]
+        )
+        time.sleep(upstream.latency_seconds)
+        if path == "/youtube/v3/playlists":
+            self.send_json(
+                {
+                    "items": [
+                        {
+                            "id": query["id"],
+                            "snippet": {
+                                "title": f"Benchmark Podcast {query['id']}",
+                                "description": "A synthetic playlist",
+                                "channelTitle": "Benchmark Channel",
+                                "channelId": "UCbenchmark",
+                                "thumbnails": THUMBNAILS,
+                            },
+                        }
+                    ]
+                }
+            )
+        elif path == "/youtube/v3/playlistItems":
+            page = upstream.get_playlist_items_page(
+                query["playlistId"], query.get("pageToken")
+            )
+            if self.headers.get("If-None-Match") == page["etag"]:
+                self.send_empty(304)
+            else:
+                self.send_json(page, etag=page["etag"])
+        elif path == "/youtube/v3/videos":
+            self.send_json(
+                {"items": [{"id": video_id} for video_id in query["id"].split(",")]}
+            )
+        elif path == "/youtube/v3/channels":
+            self.send_json(
+                {
+                    "items": [
+                        {
+                            "id": query["id"],
+                            "snippet": {
+                                "title": "Benchmark Channel",
+                                "description": "A synthetic channel",
+                                "thumbnails": THUMBNAILS,
+                            },
+                        }
+                    ]
+                }
+            )
+        elif path == "/itunes/lookup":
+            self.send_json(
+                {
+                    "resultCount": 1,
+                    "results": [
+                        {
+                            "artworkUrl600": "https://is1-ssl.mzstatic.com/image/thumb/benchmark/600x600bb.jpg"
+                        }
+                    ],
+                }
+            )
+        elif path == "/sponsorblock/api/skipSegments":
+            self.send_json(
+                [
+                    {
+                        "segment": list(SPONSOR_SEGMENT),
+                        "category": "sponsor",
+                        "actionType": "skip",
+                    }
+                ]
+            )
+        elif path.startswith("/media/"):
+            self.send_audio(include_body=True)
+        else:
+            self.send_empty(404)
@@ -0,0 +1,360 @@
+# Load tests the whole service (create_app, served by werkzeug's threaded server in its own process) against the local
+# stand-ins in fakeupstream.py, so it runs offline and only measures this service. Every scenario starts the service
+# with an empty data path and reports throughput, p50/p99 latency, peak RSS (on Linux) and the upstream calls it made,
+# so runs can be compared between versions. ffmpeg and ffprobe must be installed, like for the service itself.
+# Run from the repository root with: python benchmarks/loadtest.py [scenario ...] (see --help for the options)
+import argparse
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Optional, Sequence
+
+import requests
+
+from fakeupstream import FakeUpstream, create_synthetic_audio
+
+SOURCE_PATH = Path(__file__).resolve().parent.parent / "src"
+APP_START_TIMEOUT_SECONDS = 60
+REQUEST_TIMEOUT_SECONDS = 300
+RANGE_REQUEST_BYTES = 256 * 1024
+
+
+@dataclass
+class ScenarioResult:
+    request_count: int
+    concurrency: int
+    error_count: int
+    elapsed_seconds: float
+    latencies: Sequence[float]
+
+
+@dataclass
+class Scenario:
+    description: str
+    request_count: int
+    concurrency: int
+    # Runs against the app's base URL and returns the requests to time, as (path, headers)
+    prepare: Callable[["AppProcess", FakeUpstream, int], Sequence[tuple[str, dict]]]
+
+
+def find_free_port() -> int:
+    with socket.socket() as free_socket:
+        free_socket.bind(("127.0.0.1", 0))
+        return free_socket.getsockname()[1]
+
+
+def serve_app(port: int) -> None:
+    # Runs in the child process
+    sys.path.insert(0, str(SOURCE_PATH))
+    from werkzeug.serving import make_server
+    from podcastsponsorblock import create_app
+
+    make_server("127.0.0.1", port, create_app(), threaded=True).serve_forever()
+
+
+def get_peak_rss(pid: int) -> Optional[int]:
+    # The high water mark of the process's resident memory, in bytes
+    try:
+        with open(f"/proc/{pid}/status") as status_file:
+            for line in status_file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+class AppProcess:
+    def __init__(self, data_path: Path, environment: dict[str, str]):
+        self.data_path = data_path
+        data_path.mkdir()
+        self.port = find_free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.log_path = data_path.parent / f"{data_path.name}.log"
+        with open(self.log_path, "w") as log_file:
+            self._process = subprocess.Popen(
+                (sys.executable, __file__, "--serve", str(self.port)),
+                env={
+                    **os.environ,
+                    "PODCAST_YOUTUBE_API_KEY": "benchmark",
+                    "PODCAST_DATA_PATH": str(data_path),
+                    # Background work would compete with the load being measured
+                    "PODCAST_FEED_REFRESH_INTERVAL_MINUTES": "0",
+                    "PODCAST_SLOW_REQUEST_THRESHOLD_SECONDS": "0",
+                    # Requests for new episodes wait for the download instead of being asked to retry
+                    "PODCAST_DOWNLOAD_WAIT_SECONDS": "120",
+                    **environment,
+                },
+                stdout=log_file,
+                stderr=subprocess.STDOUT,
+            )
+        self._wait_until_ready()
+
+    def _wait_until_ready(self) -> None:
+        started_at = time.monotonic()
+        while time.monotonic() - started_at < APP_START_TIMEOUT_SECONDS:
+            if self._process.poll() is not None:
+                break
+            try:
+                requests.get(f"{self.url}/metrics", timeout=1)
+                return
+            except requests.ConnectionError:
+                time.sleep(0.1)
+        self.stop()
+        raise RuntimeError(f"The app didn't start, see {self.log_path}")
+
+    def get(self, path: str, headers: Optional[dict] = None) -> requests.Response:
+        return requests.get(
+            f"{self.url}{path}", headers=headers, timeout=REQUEST_TIMEOUT_SECONDS
+        )
+
+    @property
+    def peak_rss(self) -> Optional[int]:
+        return get_peak_rss(self._process.pid)
+
+    def stop(self) -> None:
+        self._process.terminate()
+        self._process.wait()
+
+
+def run_load(
+    app: AppProcess, timed_requests: Sequence[tuple[str, dict]], concurrency: int
+) -> ScenarioResult:
+    # Every client thread keeps its connection open between requests, like a podcast app would
+    thread_local = threading.local()
+
+    def send(timed_request: tuple[str, dict]) -> tuple[float, bool]:
+        session = getattr(thread_local, "session", None)
+        if session is None:
+            session = thread_local.session = requests.Session()
+        path, headers = timed_request
+        started_at = time.perf_counter()
+        try:
+            response = session.get(
+                f"{app.url}{path}", headers=headers, timeout=REQUEST_TIMEOUT_SECONDS
+            )
+            # Reading the body is part of the request, since feeds are written while they're sent
+            _ = response.content
+            succeeded = response.status_code in (200, 206, 304)
+        except requests.RequestException:
+            succeeded = False
+        return time.perf_counter() - started_at, succeeded
+
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = tuple(executor.map(send, timed_requests))
+    return ScenarioResult(
+        request_count=len(timed_requests),
+        concurrency=concurrency,
+        error_count=sum(1 for _, succeeded in outcomes if not succeeded),
+        elapsed_seconds=time.perf_counter() - started_at,
+        latencies=tuple(latency for latency, _ in outcomes),
+    )
+
+
+def prepare_warm_feed(
+    app: AppProcess, upstream: FakeUpstream, request_count: int
+) -> Sequence[tuple[str, dict]]:
+    # Every request after the first is answered from the rendered feed cache
+    app.get("/rss/youtube/PLwarmfeed").raise_for_status()
+    return (("/rss/youtube/PLwarmfeed", dict()),) * request_count
+
+
+def prepare_conditional_feed(
+    app: AppProcess, upstream: FakeUpstream, request_count: int
+) -> Sequence[tuple[str, dict]]:
+    # Pollers that already have the current feed, which is how most feed requests arrive
+    etag = app.get("/rss/youtube/PLconditionalfeed").headers["ETag"]
+    return (
+        ("/rss/youtube/PLconditionalfeed", {"If-None-Match": etag}),
+    ) * request_count
+
+
+def prepare_cold_feed(
+    app: AppProcess, upstream: FakeUpstream, request_count: int
+) -> Sequence[tuple[str, dict]]:
+    # Every request is for a playlist the service hasn't seen, so it's crawled and rendered from scratch
+    return tuple(
+        (f"/rss/youtube/PLcoldfeed{index:06d}", dict())
+        for index in range(request_count)
+    )
+
+
+def prepare_media_ranges(
+    app: AppProcess, upstream: FakeUpstream, request_count: int
+) -> Sequence[tuple[str, dict]]:
+    # A podcast app seeking through an episode that's already downloaded and cut
+    media_path = f"/media/youtube/{upstream.add_episode('PLmediarange')}.m4a"
+    audio_size = len(app.get(media_path).content)
+    random_ranges = random.Random(0)
+    timed_requests = []
+    for _ in range(request_count):
+        range_start = random_ranges.randrange(max(audio_size - RANGE_REQUEST_BYTES, 1))
+        range_header = f"bytes={range_start}-{range_start + RANGE_REQUEST_BYTES - 1}"
+        timed_requests.append((media_path, {"Range": range_header}))
+    return timed_requests
+
+
+def prepare_thundering_herd(
+    app: AppProcess, upstream: FakeUpstream, request_count: int
+) -> Sequence[tuple[str, dict]]:
+    # Every subscriber's app downloads a new episode as soon as it shows up in the feed, so they all ask for it while
+    # it's still being downloaded and cut
+    app.get("/rss/youtube/PLthunderingherd").raise_for_status()
+    media_path = f"/media/youtube/{upstream.add_episode('PLthunderingherd')}.m4a"
+    return ((media_path, dict()),) * request_count
+
+
+SCENARIOS = {
+    "warm-feed": Scenario("Polls of a cached feed", 500, 16, prepare_warm_feed),
+    "conditional-feed": Scenario(
+        "Polls answered with 304 Not Modified", 2000, 16, prepare_conditional_feed
+    ),
+    "cold-feed": Scenario(
+        "Feeds crawled and rendered from scratch", 20, 4, prepare_cold_feed
+    ),
+    "media-range": Scenario(
+        "Concurrent range requests for a cached episode", 100, 100, prepare_media_ranges
+    ),
+    "thundering-herd": Scenario(
+        "Concurrent requests for a new episode", 50, 50, prepare_thundering_herd
+    ),
+}
+
+
+def get_percentile(latencies: Sequence[float], percentile: float) -> float:
+    # Nearest rank, so it's always one of the measured latencies
+    sorted_latencies = sorted(latencies)
+    rank = max(round(percentile / 100 * len(sorted_latencies)) - 1, 0)
+    return sorted_latencies[min(rank, len(sorted_latencies) - 1)]
+
+
+def format_upstream_requests(upstream: FakeUpstream) -> str:
+    return (
+        ", ".join(
+            f"{name}={count}" for name, count in sorted(upstream.requests.items())
+        )
+        or "none"
+    )
+
+
+def run_scenario(
+    scenario: Scenario,
+    upstream: FakeUpstream,
+    work_path: Path,
+    scenario_name: str,
+    request_count: Optional[int],
+    concurrency: Optional[int],
+) -> None:
+    request_count = request_count or scenario.request_count
+    concurrency = concurrency or scenario.concurrency
+    app = AppProcess(work_path / scenario_name, upstream.upstream_environment())
+    try:
+        timed_requests = scenario.prepare(app, upstream, request_count)
+        # Only the calls made while the load runs are reported
+        upstream.reset_requests()
+        result = run_load(app, timed_requests, concurrency)
+        peak_rss = app.peak_rss
+    finally:
+        app.stop()
+    peak_rss_text = "n/a" if peak_rss is None else f"{peak_rss / 1024 / 1024:.1f}"
+    print(
+        f"{scenario_name:>17} {result.request_count:>8} {result.concurrency:>11} "
+        f"{result.error_count:>6} {result.request_count / result.elapsed_seconds:>10.1f} "
+        f"{get_percentile(result.latencies, 50) * 1000:>9.1f} "
+        f"{get_percentile(result.latencies, 99) * 1000:>9.1f} {peak_rss_text:>13}  "
+        f"{format_upstream_requests(upstream)}"
+    )
+
+
+def run_benchmark(arguments: argparse.Namespace) -> None:
+    with tempfile.TemporaryDirectory(prefix="podcast-loadtest-") as work_directory:
+        work_path = Path(work_directory)
+        audio_path = work_path / "synthetic.m4a"
+        create_synthetic_audio(audio_path, arguments.audio_seconds)
+        upstream = FakeUpstream(
+            arguments.episodes, audio_path, arguments.upstream_latency_ms / 1000
+        )
+        upstream.start()
+        print(
+            f"{'scenario':>17} {'requests':>8} {'concurrency':>11} {'errors':>6} {'requests/s':>10} "
+            f"{'p50 (ms)':>9} {'p99 (ms)':>9} {'peak RSS (MiB)':>13}  upstream calls"
+        )
+        try:
+            for scenario_name in arguments.scenarios or SCENARIOS:
+                run_scenario(
+                    SCENARIOS[scenario_name],
+                    upstream,
+                    work_path,
+                    scenario_name,
+                    arguments.requests,
+                    arguments.concurrency,
+                )
+        finally:
+            upstream.stop()
+
+
+def parse_arguments() -> argparse.Namespace:
+    argument_parser = argparse.ArgumentParser(
+        description="Load tests podcast-sponsor-block against local stand-ins for the APIs it calls",
+        epilog="scenarios: "
+        + "; ".join(
+            f"{scenario_name} ({scenario.description})"
+            for scenario_name, scenario in SCENARIOS.items()
+        ),
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    argument_parser.add_argument(
+        "scenarios",
+        nargs="*",
+        metavar="scenario",
+        help="The scenarios to run (default: all)",
+    )
+    argument_parser.add_argument(
+        "--episodes",
+        type=int,
+        default=2000,
+        help="Episodes in every playlist (default: 2000)",
+    )
+    argument_parser.add_argument(
+        "--requests", type=int, help="Overrides each scenario's request count"
+    )
+    argument_parser.add_argument(
+        "--concurrency", type=int, help="Overrides each scenario's concurrency"
+    )
+    argument_parser.add_argument(
+        "--audio-seconds",
+        type=int,
+        default=600,
+        help="Length of the synthetic episode audio (default: 600)",
+    )
+    argument_parser.add_argument(
+        "--upstream-latency-ms",
+        type=float,
+        default=0,
+        help="Added to every upstream response, to simulate the network (default: 0)",
+    )
+    argument_parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    arguments = argument_parser.parse_args()
+    unknown_scenarios = set(arguments.scenarios) - set(SCENARIOS)
+    if len(unknown_scenarios) > 0:
+        argument_parser.error(
+            f"unknown scenarios: {', '.join(sorted(unknown_scenarios))}"
+        )
+    return arguments
+
+
+if __name__ == "__main__":
+    parsed_arguments = parse_arguments()
+    if parsed_arguments.serve is not None:
+        serve_app(parsed_arguments.serve)
+    else:
+        run_benchmark(parsed_arguments)
@@ -0,0 +1,149 @@
+# Compares the time and peak memory of rendering a feed with feedgen (generate_rss_feed) against the streaming
+# serializer (stream_rss_feed). Run from the repository root with: python benchmarks/rssserializer.py [episode counts]
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Callable, Iterable, Sequence
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from flask import Flask
+
+from podcastsponsorblock.models import (
+    Author,
+    EpisodeDetails,
+    EpisodeWindow,
+    FeedOptions,
+    ItemDetails,
+    PodcastConfig,
+)
+from podcastsponsorblock.main import populate_service_config
+from podcastsponsorblock.views import youtuberssview
+
+DEFAULT_EPISODE_COUNTS = (100, 1000, 5000)
+# Each renderer stamps the feed with the time it was rendered
+LAST_BUILD_DATE_PATTERN = re.compile(rb"<lastBuildDate>[^<]*</lastBuildDate>")
+
+
+class SyntheticEpisodeFeed:
+    def __init__(self, episode_count: int):
+        author = Author("Benchmark Channel", "UCbenchmark")
+        self.playlist_details = ItemDetails(
+            "PLbenchmark",
+            "Benchmark Podcast",
+            "A synthetic playlist",
+            author,
+            "https://example.com/logo.jpg",
+        )
+        self.logo = "https://example.com/logo.jpg"
+        first_published_at = datetime(2015, 1, 1, tzinfo=timezone.utc)
+        self.episodes = tuple(
+            EpisodeDetails(
+                f"video{index:07d}",
+                f"Episode {index}: a title with <markup> & entities",
+                "An episode description that is a few sentences long. " * 10,
+                author,
+                "https://example.com/thumbnail.jpg",
+                first_published_at + timedelta(days=index),
+            )
+            for index in range(episode_count)
+        )
+
+    def get_episodes(
+        self, window: EpisodeWindow = EpisodeWindow()
+    ) -> Sequence[EpisodeDetails]:
+        newest_episodes = tuple(reversed(self.episodes))[window.offset :]
+        return (
+            newest_episodes if window.limit is None else newest_episodes[: window.limit]
+        )
+
+    def __iter__(self) -> Iterable[EpisodeDetails]:
+        return iter(self.episodes)
+
+
+def create_feed_options() -> FeedOptions:
+    service_config = populate_service_config(
+        {
+            "PODCAST_YOUTUBE_API_KEY": "unused",
+            "PODCAST_DATA_PATH": tempfile.mkdtemp(),
+            "PODCAST_TRUSTED_HOSTS": "https://podcasts.example.com",
+        }
+    )
+    podcast_config = PodcastConfig(
+        id="PLbenchmark",
+        language="en",
+        description="Benchmark feed",
+        itunes_category="Technology",
+        explicit=False,
+        itunes_id=None,
+        prefetch_episodes=None,
+        episode_limit=None,
+        episode_window_days=None,
+        categories_to_remove=None,
+    )
+    return FeedOptions(service_config, podcast_config, "podcasts.example.com")
+
+
+def measure(render: Callable[[], int]) -> tuple[float, int, int]:
+    tracemalloc.start()
+    started_at = time.perf_counter()
+    output_size = render()
+    elapsed_seconds = time.perf_counter() - started_at
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed_seconds, peak_memory, output_size
+
+
+def consume_stream(chunks: Iterable[bytes]) -> int:
+    # Counts bytes without holding on to them, like a WSGI server writing chunks to a socket
+    return sum(len(chunk) for chunk in chunks)
+
+
+def check_renderers_match(
+    episode_feed: SyntheticEpisodeFeed, feed_options: FeedOptions
+) -> None:
+    # The timings only mean something if both renderers produce the same feed
+    feedgen_output = youtuberssview.generate_rss_feed(episode_feed, feed_options)
+    streaming_output = b"".join(
+        youtuberssview.stream_rss_feed(episode_feed, feed_options)
+    )
+    assert LAST_BUILD_DATE_PATTERN.sub(b"", feedgen_output) == (
+        LAST_BUILD_DATE_PATTERN.sub(b"", streaming_output)
+    ), "The streaming serializer's output differs from feedgen's"
+
+
+def run_benchmark(episode_counts: Sequence[int]) -> None:
+    app = Flask(__name__)
+    app.add_url_rule("/media/youtube/<string:video_id>", endpoint="youtube_media_view")
+    feed_options = create_feed_options()
+    print(
+        f"{'episodes':>9} {'renderer':>10} {'time (ms)':>10} {'peak memory (KiB)':>18}"
+    )
+    for episode_count in episode_counts:
+        episode_feed = SyntheticEpisodeFeed(episode_count)
+        renderers = {
+            "feedgen": lambda: len(
+                youtuberssview.generate_rss_feed(episode_feed, feed_options)
+            ),
+            "streaming": lambda: consume_stream(
+                youtuberssview.stream_rss_feed(episode_feed, feed_options)
+            ),
+        }
+        with app.test_request_context(base_url="https://podcasts.example.com"):
+            check_renderers_match(episode_feed, feed_options)
+            for renderer_name, render in renderers.items():
+                elapsed_seconds, peak_memory, _ = measure(render)
+                print(
+                    f"{episode_count:>9} {renderer_name:>10} {elapsed_seconds * 1000:>10.1f} "
+                    f"{peak_memory / 1024:>18.1f}"
+                )
+
+
+if __name__ == "__main__":
+    run_benchmark(
+        tuple(int(argument) for argument in sys.argv[1:]) or DEFAULT_EPISODE_COUNTS
+    )
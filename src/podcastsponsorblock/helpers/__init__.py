@@ -1,14 +1,85 @@
 import re
 from datetime import timedelta
+from typing import Optional
 from urllib.parse import urlparse
 from xml.sax.saxutils import escape
 
 import requests
-from cachetools import cached, TTLCache
+from flask import request
 
-from .youtubeplaylistepisodefeed import YoutubePlaylistEpisodeFeed
+from .apiurls import configure_api_urls, get_api_urls
+from .metrics import (
+    configure_metrics,
+    increment_counter,
+    observe_histogram,
+    time_histogram,
+    get_metric_values,
+    render_metrics,
+    format_labels,
+    REQUEST_DURATION_BUCKETS,
+    DOWNLOAD_DURATION_BUCKETS,
+)
+from .requesttiming import (
+    timing_span,
+    get_timing_spans,
+    format_server_timing,
+    log_slow_request,
+    time_until_response_headers,
+    is_timed_until_response_headers,
+)
+from .sharedcache import (
+    SharedTTLCache,
+    configure_shared_cache,
+    shared_cached,
+    get_shared_cache_statistics,
+)
+from .youtubeplaylistepisodefeed import YoutubePlaylistEpisodeFeed, refresh_playlist
+from .downloadcoordinator import DownloadCoordinator, LeaderFailedError
+from .downloadqueue import (
+    DownloadQueue,
+    JOB_QUEUED,
+    JOB_RUNNING,
+    JOB_COMPLETE,
+    JOB_FAILED,
+    FINISHED_JOB_STATES,
+    PRIORITY_BACKGROUND,
+    PRIORITY_LISTENER,
+)
+from .periodictask import start_periodic_task
+from .videovalidator import VideoValidator
+from .youtubeclientpool import get_youtube_client
+from .episodeprefetcher import (
+    prefetch_new_episodes,
+    is_prefetch_enabled,
+    get_configured_playlist_ids,
+)
+from .sponsorblock import (
+    get_sponsor_segments,
+    get_unknown_categories,
+    normalize_categories,
+)
+from .appliedsegmentstore import AppliedSegmentStore, hash_segments
+from .mediametadatastore import MediaMetadataStore
+from .audiocache import AudioCache, EVICTION_INTERVAL
+from .thumbnailindex import get_thumbnail_index
+from .thumbnailvariants import (
+    get_thumbnail_variant,
+    get_thumbnail_fingerprint,
+    get_thumbnail_size,
+    get_thumbnail_etag,
+    THUMBNAIL_FORMATS,
+    DEFAULT_THUMBNAIL_FORMAT,
+)
+from .fileserving import send_cached_file, FILE_SERVING_MODES, FILE_SERVING_DIRECT
 
 _LENIENT_YOUTUBE_ID_PATTERN = re.compile("^[A-Za-z0-9_-]{1,50}$")
+_INVALID_XML_CHARACTER_PATTERN = re.compile(
+    "[\x00-\x08\x0b\x0c\x0e-\x1f\ud800-\udfff\ufffe\uffff]"
+)
+
+
+# The largest artwork iTunes accepts
+MAX_ARTWORK_SIZE = 3000
 
 
 def transform_artwork_url(artwork_url: str, new_height: int, new_width: int) -> str:
@@ -19,10 +90,14 @@ def transform_artwork_url(artwork_url: str, new_height: int, new_width: int) ->
     return parsed_url._replace(path=new_size_path).geturl()
 
 
-@cached(cache=TTLCache(ttl=timedelta(minutes=60).total_seconds(), maxsize=1024))
-def get_itunes_artwork(itunes_id: str) -> str:
+@shared_cached(
+    SharedTTLCache(
+        "itunes_artwork", ttl=timedelta(minutes=60), max_stale=timedelta(days=1)
+    )
+)
+def get_itunes_artwork(itunes_id: str, artwork_size: int = MAX_ARTWORK_SIZE) -> str:
     itunes_response = requests.get(
-        "https://itunes.apple.com/lookup?id=", params={"id": itunes_id}
+        get_api_urls().itunes_lookup_url, params={"id": itunes_id}
     )
     if itunes_response.status_code != 200:
         raise ValueError(f"Invalid iTunes ID: {itunes_id}")
@@ -37,10 +112,10 @@ def get_itunes_artwork(itunes_id: str) -> str:
     )
     if artwork_key is None:
         raise ValueError(f"iTunes ID missing artwork: {itunes_id}")
-    # even if a 3000x3000 artwork isn't available, it will return the highest available resolution. 3000x3000 is the max
-    # allowed
+    # even if artwork of this size isn't available, it will return the highest available resolution. 3000x3000 is the
+    # max allowed
     return transform_artwork_url(
-        matching_podcast[artwork_key], new_height=3000, new_width=3000
+        matching_podcast[artwork_key], new_height=artwork_size, new_width=artwork_size
     )
 
 
@@ -48,6 +123,16 @@ def leniently_validate_youtube_id(potential_youtube_id: str) -> bool:
     return _LENIENT_YOUTUBE_ID_PATTERN.match(potential_youtube_id) is not None
 
 
+def parse_positive_int_arg(name: str) -> Optional[int]:
+    value = request.args.get(name)
+    if value is None:
+        return None
+    parsed_value = int(value)
+    if parsed_value < 1:
+        raise ValueError(f"{name} must be at least one")
+    return parsed_value
+
+
 def escape_for_xml(unescaped_string: str):
     return escape(
         unescaped_string,
@@ -61,9 +146,87 @@ def escape_for_xml(unescaped_string: str):
     )
 
 
+def remove_invalid_xml_characters(unsafe_string: str) -> str:
+    return _INVALID_XML_CHARACTER_PATTERN.sub("", unsafe_string)
+
+
+# These match how lxml serializes text and attribute values, so hand-written XML is identical to what feedgen generates
+def escape_xml_text(unescaped_string: str) -> str:
+    return escape(
+        remove_invalid_xml_characters(unescaped_string), entities={"\r": "&#13;"}
+    )
+
+
+def escape_xml_attribute(unescaped_string: str) -> str:
+    return escape(
+        remove_invalid_xml_characters(unescaped_string),
+        entities={'"': "&quot;", "\n": "&#10;", "\r": "&#13;", "\t": "&#9;"},
+    )
+
+
 __all__ = [
     "YoutubePlaylistEpisodeFeed",
+    "refresh_playlist",
     "leniently_validate_youtube_id",
+    "parse_positive_int_arg",
     "escape_for_xml",
+    "escape_xml_text",
+    "escape_xml_attribute",
     "get_itunes_artwork",
+    "DownloadCoordinator",
+    "LeaderFailedError",
+    "DownloadQueue",
+    "JOB_QUEUED",
+    "JOB_RUNNING",
+    "JOB_COMPLETE",
+    "JOB_FAILED",
+    "FINISHED_JOB_STATES",
+    "PRIORITY_BACKGROUND",
+    "PRIORITY_LISTENER",
+    "start_periodic_task",
+    "VideoValidator",
+    "get_youtube_client",
+    "configure_api_urls",
+    "get_api_urls",
+    "configure_metrics",
+    "increment_counter",
+    "observe_histogram",
+    "time_histogram",
+    "get_metric_values",
+    "render_metrics",
+    "format_labels",
+    "REQUEST_DURATION_BUCKETS",
+    "DOWNLOAD_DURATION_BUCKETS",
+    "timing_span",
+    "get_timing_spans",
+    "format_server_timing",
+    "log_slow_request",
+    "time_until_response_headers",
+    "is_timed_until_response_headers",
+    "SharedTTLCache",
+    "configure_shared_cache",
+    "shared_cached",
+    "get_shared_cache_statistics",
+    "prefetch_new_episodes",
+    "is_prefetch_enabled",
+    "get_configured_playlist_ids",
+    "get_sponsor_segments",
+    "normalize_categories",
+    "get_unknown_categories",
+    "AppliedSegmentStore",
+    "hash_segments",
+    "MediaMetadataStore",
+    "AudioCache",
+    "EVICTION_INTERVAL",
+    "get_thumbnail_index",
+    "get_thumbnail_variant",
+    "get_thumbnail_fingerprint",
+    "get_thumbnail_size",
+    "get_thumbnail_etag",
+    "THUMBNAIL_FORMATS",
+    "DEFAULT_THUMBNAIL_FORMAT",
+    "MAX_ARTWORK_SIZE",
+    "send_cached_file",
+    "FILE_SERVING_MODES",
+    "FILE_SERVING_DIRECT",
 ]
@@ -0,0 +1,14 @@
+from ..models import ApiUrls
+
+# The API URLs are used deep inside helpers that don't get the service config (like the shared caches' loaders), so
+# create_app sets them for the whole process
+_api_urls = ApiUrls()
+
+
+def configure_api_urls(api_urls: ApiUrls) -> None:
+    global _api_urls
+    _api_urls = api_urls
+
+
+def get_api_urls() -> ApiUrls:
+    return _api_urls
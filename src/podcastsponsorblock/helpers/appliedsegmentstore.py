@@ -0,0 +1,104 @@
+import hashlib
+import time
+from pathlib import Path
+from typing import Optional, Sequence
+
+from .database import get_database_connection, transaction
+from ..models import SponsorSegment
+
+# Stores are created for every download and segment check, so the schema is only set up the first time each process
+# sees a data path
+_initialized_data_paths: set[Path] = set()
+
+
+def hash_segments(segments: Sequence[SponsorSegment]) -> str:
+    return hashlib.sha256(
+        repr(tuple((segment.start, segment.end) for segment in segments)).encode()
+    ).hexdigest()
+
+
+# Records which SponsorBlock segments were cut out of each variant (a video cut for a set of categories) of each
+# downloaded video, so variants can be re-cut from their source audio when the segments change
+class AppliedSegmentStore:
+    def __init__(self, data_path: Path):
+        self.data_path = data_path
+        if data_path in _initialized_data_paths:
+            return
+        self._connection().execute("""
+            CREATE TABLE IF NOT EXISTS applied_segments (
+                video_id TEXT NOT NULL,
+                categories TEXT NOT NULL,
+                segments_hash TEXT NOT NULL,
+                downloaded_at REAL NOT NULL,
+                checked_at REAL NOT NULL,
+                PRIMARY KEY (video_id, categories)
+            )
+            """)
+        _initialized_data_paths.add(data_path)
+
+    def _connection(self):
+        return get_database_connection(self.data_path)
+
+    @staticmethod
+    def _serialize_categories(categories: Sequence[str]) -> str:
+        return ",".join(categories)
+
+    def get_segments_hash(
+        self, video_id: str, categories: Sequence[str]
+    ) -> Optional[str]:
+        row = (
+            self._connection()
+            .execute(
+                "SELECT segments_hash FROM applied_segments WHERE video_id = ? AND categories = ?",
+                (video_id, self._serialize_categories(categories)),
+            )
+            .fetchone()
+        )
+        return None if row is None else row["segments_hash"]
+
+    def record_applied_segments(
+        self,
+        video_id: str,
+        categories: Sequence[str],
+        segments: Sequence[SponsorSegment],
+    ) -> None:
+        now = time.time()
+        with transaction(self._connection()) as connection:
+            connection.execute(
+                "INSERT INTO applied_segments (video_id, categories, segments_hash, downloaded_at, checked_at) "
+                "VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (video_id, categories) DO UPDATE SET segments_hash = excluded.segments_hash, "
+                "checked_at = excluded.checked_at",
+                (
+                    video_id,
+                    self._serialize_categories(categories),
+                    hash_segments(segments),
+                    now,
+                    now,
+                ),
+            )
+
+    def mark_checked(self, video_id: str, categories: Sequence[str]) -> None:
+        self._connection().execute(
+            "UPDATE applied_segments SET checked_at = ? WHERE video_id = ? AND categories = ?",
+            (time.time(), video_id, self._serialize_categories(categories)),
+        )
+
+    def remove(self, video_id: str, categories: Sequence[str]) -> None:
+        self._connection().execute(
+            "DELETE FROM applied_segments WHERE video_id = ? AND categories = ?",
+            (video_id, self._serialize_categories(categories)),
+        )
+
+    def get_variants_to_check(
+        self, downloaded_after: float, checked_before: float
+    ) -> Sequence[tuple[str, Sequence[str]]]:
+        rows = self._connection().execute(
+            "SELECT video_id, categories FROM applied_segments WHERE downloaded_at > ? AND checked_at < ? "
+            "ORDER BY checked_at",
+            (downloaded_after, checked_before),
+        )
+        return tuple(
+            (row["video_id"], tuple(filter(None, row["categories"].split(","))))
+            for row in rows
+        )
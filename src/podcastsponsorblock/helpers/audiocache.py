@@ -0,0 +1,232 @@
+import fcntl
+import logging
+import os
+import time
+from datetime import timedelta
+from pathlib import Path
+from typing import BinaryIO, Optional, Sequence
+
+from .database import get_database_connection, transaction
+from .downloadcoordinator import DownloadCoordinator
+from ..models import AudioCacheStatistics
+
+# The directories under the data path that hold cached audio. Sources count towards the budget too, since every
+# downloaded video has one
+AUDIO_CACHE_DIRECTORIES = ("audio", "source")
+# Files that are still being written (streaming downloads, cuts and yt-dlp downloads) aren't part of the cache yet
+TEMPORARY_FILE_MARKERS = (
+    ".streaming.",
+    ".cutting.",
+    ".downloading.",
+    ".part",
+    ".ytdl",
+    ".ffconcat",
+)
+# Files accessed this recently are never evicted, since a client may still be working through them with range requests
+RECENT_ACCESS_GRACE_PERIOD = timedelta(minutes=10)
+# Access times are only written this often per file, so every range request doesn't write to the database
+ACCESS_RECORD_INTERVAL = timedelta(minutes=1)
+EVICTION_INTERVAL = timedelta(minutes=5)
+# Lock files and failure markers of downloads, cuts and cached feeds are removed by the eviction pass after this long
+STALE_LOCK_FILE_AGE = timedelta(hours=1)
+
+# Caches are created by every request that serves audio, so the schema is only set up the first time each process
+# sees a data path
+_initialized_data_paths: set[Path] = set()
+
+
+def is_temporary_file(file_name: str) -> bool:
+    return any(marker in file_name for marker in TEMPORARY_FILE_MARKERS)
+
+
+def get_lock_keys(cache_path: str) -> Sequence[str]:
+    # Downloads hold the video's lock and cuts hold the variant's lock (a variant is named <video id>.<categories>)
+    variant = Path(cache_path).name.removesuffix(".m4a")
+    return tuple(dict.fromkeys((variant.split(".")[0], variant)))
+
+
+# Tracks the size and last access time of every cached audio file in the shared sqlite database, and evicts the least
+# recently used files when the cache is over its byte budget or files are older than its max age. Files being served
+# hold a shared flock on themselves, which eviction (taking an exclusive one) never waits for
+class AudioCache:
+    def __init__(self, data_path: Path):
+        self.data_path = data_path
+        if data_path in _initialized_data_paths:
+            return
+        connection = self._connection()
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS audio_cache_entries (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                last_accessed_at REAL NOT NULL
+            )
+            """)
+        connection.execute(
+            "CREATE INDEX IF NOT EXISTS audio_cache_entries_by_access "
+            "ON audio_cache_entries (last_accessed_at)"
+        )
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS audio_cache_counters (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            )
+            """)
+        _initialized_data_paths.add(data_path)
+
+    def _connection(self):
+        return get_database_connection(self.data_path)
+
+    def _get_cache_path(self, path: Path) -> str:
+        return path.relative_to(self.data_path).as_posix()
+
+    def record_access(self, path: Path) -> None:
+        now = time.time()
+        try:
+            size = path.stat().st_size
+        except FileNotFoundError:
+            return
+        self._connection().execute(
+            "INSERT INTO audio_cache_entries (path, size, last_accessed_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (path) DO UPDATE SET size = excluded.size, last_accessed_at = excluded.last_accessed_at "
+            "WHERE last_accessed_at < ?",
+            (
+                self._get_cache_path(path),
+                size,
+                now,
+                now - ACCESS_RECORD_INTERVAL.total_seconds(),
+            ),
+        )
+
+    def open_for_serving(self, path: Path) -> Optional[BinaryIO]:
+        # Returns the file with a shared lock that keeps it from being evicted until it's closed, or None if it's gone
+        try:
+            serving_file = open(path, "rb")
+        except FileNotFoundError:
+            return None
+        fcntl.flock(serving_file.fileno(), fcntl.LOCK_SH)
+        # The file may have been evicted between opening and locking it
+        if not path.exists():
+            serving_file.close()
+            return None
+        self.record_access(path)
+        return serving_file
+
+    def _scan(self) -> None:
+        # Brings the index in line with the files on disk. Files that appeared without being served (downloads,
+        # prefetches and cuts) start out as accessed when they were last modified
+        files = dict()
+        for directory_name in AUDIO_CACHE_DIRECTORIES:
+            directory = self.data_path / directory_name
+            if not directory.is_dir():
+                continue
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_file() and not is_temporary_file(entry.name):
+                        stat = entry.stat()
+                        files[f"{directory_name}/{entry.name}"] = stat
+        with transaction(self._connection()) as connection:
+            indexed_paths = {
+                row["path"]
+                for row in connection.execute("SELECT path FROM audio_cache_entries")
+            }
+            connection.executemany(
+                "DELETE FROM audio_cache_entries WHERE path = ?",
+                ((path,) for path in indexed_paths - files.keys()),
+            )
+            connection.executemany(
+                "INSERT INTO audio_cache_entries (path, size, last_accessed_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (path) DO UPDATE SET size = excluded.size, "
+                "last_accessed_at = max(last_accessed_at, excluded.last_accessed_at)",
+                ((path, stat.st_size, stat.st_mtime) for path, stat in files.items()),
+            )
+
+    def _increment_counter(self, name: str, amount: int) -> None:
+        self._connection().execute(
+            "INSERT INTO audio_cache_counters (name, value) VALUES (?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET value = value + excluded.value",
+            (name, amount),
+        )
+
+    def _is_busy(self, cache_path: str, coordinator: DownloadCoordinator) -> bool:
+        return any(
+            coordinator.is_locked(lock_key) for lock_key in get_lock_keys(cache_path)
+        )
+
+    def _evict(self, cache_path: str, size: int) -> bool:
+        path = self.data_path / cache_path
+        try:
+            evicted_file = open(path, "rb")
+        except FileNotFoundError:
+            return False
+        with evicted_file:
+            try:
+                fcntl.flock(evicted_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # The file is being served
+                return False
+            path.unlink(missing_ok=True)
+        self._connection().execute(
+            "DELETE FROM audio_cache_entries WHERE path = ?", (cache_path,)
+        )
+        self._increment_counter("evicted_files", 1)
+        self._increment_counter("evicted_bytes", size)
+        logging.info(f"Evicted {cache_path} ({size} bytes) from the audio cache")
+        return True
+
+    def evict(
+        self,
+        coordinator: DownloadCoordinator,
+        max_bytes: Optional[int],
+        max_age: Optional[timedelta],
+    ) -> None:
+        # Runs whether or not the cache has limits, since its usage (in /status/cache and /metrics) is read from the
+        # index and only the scan picks up files that weren't served through it
+        self._scan()
+        coordinator.remove_stale_files(STALE_LOCK_FILE_AGE)
+        if max_bytes is None and max_age is None:
+            return
+        now = time.time()
+        total_bytes = self.get_statistics(max_bytes).total_bytes
+        # Least recently used first
+        rows = self._connection().execute(
+            "SELECT path, size, last_accessed_at FROM audio_cache_entries WHERE last_accessed_at < ? "
+            "ORDER BY last_accessed_at",
+            (now - RECENT_ACCESS_GRACE_PERIOD.total_seconds(),),
+        )
+        for row in tuple(rows):
+            is_expired = (
+                max_age is not None
+                and row["last_accessed_at"] < now - max_age.total_seconds()
+            )
+            is_over_budget = max_bytes is not None and total_bytes > max_bytes
+            if not is_expired and not is_over_budget:
+                # Rows are ordered by access time, so every row after this one is newer and the cache is within budget
+                break
+            if self._is_busy(row["path"], coordinator):
+                continue
+            if self._evict(row["path"], row["size"]):
+                total_bytes -= row["size"]
+        if max_bytes is not None and total_bytes > max_bytes:
+            logging.warning(
+                f"The audio cache is using {total_bytes} bytes, which is over its budget of {max_bytes} bytes, but "
+                f"every remaining file is in use or was accessed recently"
+            )
+
+    def get_statistics(self, max_bytes: Optional[int]) -> AudioCacheStatistics:
+        connection = self._connection()
+        usage_row = connection.execute(
+            "SELECT COUNT(*) AS file_count, COALESCE(SUM(size), 0) AS total_bytes FROM audio_cache_entries"
+        ).fetchone()
+        counters = {
+            row["name"]: row["value"]
+            for row in connection.execute(
+                "SELECT name, value FROM audio_cache_counters"
+            )
+        }
+        return AudioCacheStatistics(
+            file_count=usage_row["file_count"],
+            total_bytes=usage_row["total_bytes"],
+            max_bytes=max_bytes,
+            evicted_files=counters.get("evicted_files", 0),
+            evicted_bytes=counters.get("evicted_bytes", 0),
+        )
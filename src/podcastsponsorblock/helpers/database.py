@@ -0,0 +1,41 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+_thread_local_connections = threading.local()
+
+
+def get_database_path(data_path: Path) -> Path:
+    return data_path / "state.sqlite3"
+
+
+def get_database_connection(data_path: Path) -> sqlite3.Connection:
+    # sqlite connections can't be shared between threads, so every thread gets its own connection. WAL mode lets the
+    # gunicorn workers read while another worker is writing
+    connections = getattr(_thread_local_connections, "connections", None)
+    if connections is None:
+        connections = _thread_local_connections.connections = dict()
+    database_path = get_database_path(data_path)
+    connection = connections.get(database_path)
+    if connection is None:
+        connection = sqlite3.connect(database_path, timeout=30, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connections[database_path] = connection
+    return connection
+
+
+@contextmanager
+def transaction(connection: sqlite3.Connection) -> Iterator[sqlite3.Connection]:
+    # BEGIN IMMEDIATE takes the write lock up front so read-then-write sequences can't interleave between workers
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        yield connection
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+    else:
+        connection.execute("COMMIT")
@@ -0,0 +1,117 @@
+import fcntl
+import os
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from pathlib import Path
+from typing import Callable, Iterator, Optional
+
+
+class LeaderFailedError(Exception):
+    pass
+
+
+# Coordinates work on a key (e.g. a video ID) between threads and gunicorn worker processes using lock files under the
+# data path. The locks are flock locks, so the kernel releases them when the holding process dies and a crashed worker
+# can never leave a stale lock behind
+class DownloadCoordinator:
+    def __init__(self, data_path: Path):
+        self.lock_directory = data_path / "locks"
+        self.lock_directory.mkdir(parents=True, exist_ok=True)
+
+    def _lock_path(self, key: str) -> Path:
+        return self.lock_directory / f"{key}.lock"
+
+    def _failure_path(self, key: str) -> Path:
+        return self.lock_directory / f"{key}.failed"
+
+    def _acquire(self, lock_path: Path, blocking: bool) -> Optional[int]:
+        while True:
+            lock_file_descriptor = os.open(lock_path, os.O_RDWR | os.O_CREAT)
+            try:
+                fcntl.flock(
+                    lock_file_descriptor,
+                    fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB,
+                )
+            except BlockingIOError:
+                os.close(lock_file_descriptor)
+                return None
+            except BaseException:
+                os.close(lock_file_descriptor)
+                raise
+            # The lock file may have been removed (see remove_stale_files) while we were waiting on it, leaving us holding
+            # a lock nobody else can see. The lock is then taken again on the file that's there now
+            try:
+                is_current = (
+                    os.fstat(lock_file_descriptor).st_ino == os.stat(lock_path).st_ino
+                )
+            except FileNotFoundError:
+                is_current = False
+            if is_current:
+                return lock_file_descriptor
+            os.close(lock_file_descriptor)
+
+    @contextmanager
+    def lock(self, key: str, blocking: bool = True) -> Iterator[bool]:
+        lock_file_descriptor = self._acquire(self._lock_path(key), blocking)
+        if lock_file_descriptor is None:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file_descriptor, fcntl.LOCK_UN)
+            os.close(lock_file_descriptor)
+
+    def is_locked(self, key: str) -> bool:
+        with self.lock(key, blocking=False) as acquired:
+            return not acquired
+
+    def run_once(
+        self,
+        key: str,
+        is_complete: Callable[[], bool],
+        produce: Callable[[], None],
+    ) -> bool:
+        # Only one caller (the leader) runs produce, everyone else waits on the lock and then reuses its result. If the
+        # leader fails, the callers that were waiting on it get its error instead of immediately retrying
+        if is_complete():
+            return False
+        wait_started_at = time.time()
+        with self.lock(key):
+            if is_complete():
+                return False
+            failure_path = self._failure_path(key)
+            if (
+                failure_path.exists()
+                and failure_path.stat().st_mtime >= wait_started_at
+            ):
+                raise LeaderFailedError(failure_path.read_text())
+            failure_path.unlink(missing_ok=True)
+            try:
+                produce()
+            except Exception as exception:
+                failure_path.write_text(str(exception))
+                raise
+            return True
+
+    def remove_stale_files(self, max_age: timedelta) -> None:
+        # Every key ever locked (each video, variant and cached feed) leaves a lock file behind, and every failed one a
+        # failure marker. Files that haven't changed in a while are removed while holding their lock, so nobody is using
+        # them, and anyone still waiting on a removed file retakes the lock on its replacement (see _acquire)
+        modified_before = time.time() - max_age.total_seconds()
+        for lock_path in self.lock_directory.glob("*.lock"):
+            key = lock_path.name.removesuffix(".lock")
+            failure_path = self._failure_path(key)
+            try:
+                if lock_path.stat().st_mtime >= modified_before or (
+                    failure_path.exists()
+                    and failure_path.stat().st_mtime >= modified_before
+                ):
+                    continue
+            except FileNotFoundError:
+                continue
+            with self.lock(key, blocking=False) as acquired:
+                if acquired:
+                    failure_path.unlink(missing_ok=True)
+                    lock_path.unlink(missing_ok=True)
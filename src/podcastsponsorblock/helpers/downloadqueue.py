@@ -0,0 +1,264 @@
+import logging
+import threading
+import time
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+from typing import Callable, Optional
+
+from .database import get_database_connection, transaction
+from .downloadcoordinator import DownloadCoordinator
+from .periodictask import start_periodic_task
+from ..models import DownloadJob
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETE = "complete"
+JOB_FAILED = "failed"
+
+FINISHED_JOB_STATES = (JOB_COMPLETE, JOB_FAILED)
+
+# Jobs requested by a listener are claimed before jobs queued in the background
+PRIORITY_BACKGROUND = 0
+PRIORITY_LISTENER = 10
+
+# A running job whose worker no longer holds the video's lock after this long belongs to a worker that died
+STALE_RUNNING_JOB_AGE = timedelta(seconds=30)
+FAILED_JOB_RETRY_DELAY = timedelta(minutes=10)
+# Idle workers poll for jobs queued by other gunicorn workers, backing off from the shorter interval to the longer one
+# while there's nothing to do. Jobs queued by their own worker wake them straight away
+IDLE_POLL_INTERVAL_SECONDS = 1.0
+MAX_IDLE_POLL_INTERVAL_SECONDS = 10.0
+
+
+def create_download_job(row) -> DownloadJob:
+    return DownloadJob(
+        video_id=row["video_id"],
+        state=row["state"],
+        attempts=row["attempts"],
+        error=row["error"],
+        created_at=datetime.fromtimestamp(row["created_at"], timezone.utc),
+        updated_at=datetime.fromtimestamp(row["updated_at"], timezone.utc),
+    )
+
+
+# Download jobs are persisted in the shared sqlite database so they survive restarts and are visible to every gunicorn
+# worker. Each worker runs its own pool of download threads, but a job is only claimed while fewer than
+# max_concurrent_downloads jobs are running across all workers
+class DownloadQueue:
+    def __init__(self, data_path: Path, max_concurrent_downloads: int):
+        self.data_path = data_path
+        self.max_concurrent_downloads = max_concurrent_downloads
+        self.coordinator = DownloadCoordinator(data_path)
+        self._job_added = threading.Event()
+        self._connection().execute("""
+            CREATE TABLE IF NOT EXISTS download_jobs (
+                video_id TEXT PRIMARY KEY,
+                state TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                priority INTEGER NOT NULL DEFAULT 10,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """)
+
+    def _connection(self):
+        return get_database_connection(self.data_path)
+
+    def get_job(self, video_id: str) -> Optional[DownloadJob]:
+        row = (
+            self._connection()
+            .execute("SELECT * FROM download_jobs WHERE video_id = ?", (video_id,))
+            .fetchone()
+        )
+        return None if row is None else create_download_job(row)
+
+    def count_jobs(self, state: str) -> int:
+        return (
+            self._connection()
+            .execute("SELECT COUNT(*) FROM download_jobs WHERE state = ?", (state,))
+            .fetchone()[0]
+        )
+
+    def count_pending_jobs(self, priority: int) -> int:
+        return (
+            self._connection()
+            .execute(
+                "SELECT COUNT(*) FROM download_jobs WHERE state IN (?, ?) AND priority = ?",
+                (JOB_QUEUED, JOB_RUNNING, priority),
+            )
+            .fetchone()[0]
+        )
+
+    def enqueue(self, video_id: str, priority: int = PRIORITY_LISTENER) -> DownloadJob:
+        now = time.time()
+        with transaction(self._connection()) as connection:
+            row = connection.execute(
+                "SELECT * FROM download_jobs WHERE video_id = ?", (video_id,)
+            ).fetchone()
+            if row is None:
+                connection.execute(
+                    "INSERT INTO download_jobs (video_id, state, priority, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (video_id, JOB_QUEUED, priority, now, now),
+                )
+            elif row["state"] == JOB_QUEUED and row["priority"] < priority:
+                connection.execute(
+                    "UPDATE download_jobs SET priority = ? WHERE video_id = ?",
+                    (priority, video_id),
+                )
+            elif row["state"] == JOB_COMPLETE or (
+                row["state"] == JOB_FAILED
+                and now - row["updated_at"] >= FAILED_JOB_RETRY_DELAY.total_seconds()
+            ):
+                # Jobs are only re-enqueued once their previous result is unusable (the file was removed or the
+                # download failed long enough ago to be worth retrying)
+                connection.execute(
+                    "UPDATE download_jobs SET state = ?, priority = ?, error = NULL, updated_at = ? "
+                    "WHERE video_id = ?",
+                    (JOB_QUEUED, priority, now, video_id),
+                )
+        self._job_added.set()
+        return self.get_job(video_id)
+
+    def requeue_stale_jobs(self) -> None:
+        # Runs periodically in one gunicorn worker. Jobs are only written to if one looks abandoned
+        stale_before = time.time() - STALE_RUNNING_JOB_AGE.total_seconds()
+        running_rows = (
+            self._connection()
+            .execute(
+                "SELECT video_id FROM download_jobs WHERE state = ? AND updated_at < ?",
+                (JOB_RUNNING, stale_before),
+            )
+            .fetchall()
+        )
+        for row in running_rows:
+            if self.coordinator.is_locked(row["video_id"]):
+                continue
+            with transaction(self._connection()) as connection:
+                cursor = connection.execute(
+                    "UPDATE download_jobs SET state = ?, updated_at = ? WHERE video_id = ? AND state = ? "
+                    "AND updated_at < ?",
+                    (
+                        JOB_QUEUED,
+                        time.time(),
+                        row["video_id"],
+                        JOB_RUNNING,
+                        stale_before,
+                    ),
+                )
+            if cursor.rowcount > 0:
+                logging.warning(f"Re-queueing abandoned download of {row['video_id']}")
+                self._job_added.set()
+
+    def claim_next_job(self) -> Optional[str]:
+        # Checked without taking the database's write lock, which idle workers would otherwise take every poll
+        queued_row = (
+            self._connection()
+            .execute(
+                "SELECT 1 FROM download_jobs WHERE state = ? LIMIT 1", (JOB_QUEUED,)
+            )
+            .fetchone()
+        )
+        if queued_row is None:
+            return None
+        with transaction(self._connection()) as connection:
+            running_count = connection.execute(
+                "SELECT COUNT(*) FROM download_jobs WHERE state = ?", (JOB_RUNNING,)
+            ).fetchone()[0]
+            if running_count >= self.max_concurrent_downloads:
+                return None
+            row = connection.execute(
+                "SELECT video_id FROM download_jobs WHERE state = ? ORDER BY priority DESC, created_at LIMIT 1",
+                (JOB_QUEUED,),
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute(
+                "UPDATE download_jobs SET state = ?, attempts = attempts + 1, updated_at = ? WHERE video_id = ?",
+                (JOB_RUNNING, time.time(), row["video_id"]),
+            )
+            return row["video_id"]
+
+    def finish_job(self, video_id: str, error: Optional[str] = None) -> None:
+        with transaction(self._connection()) as connection:
+            connection.execute(
+                "UPDATE download_jobs SET state = ?, error = ?, updated_at = ? WHERE video_id = ?",
+                (
+                    JOB_COMPLETE if error is None else JOB_FAILED,
+                    error,
+                    time.time(),
+                    video_id,
+                ),
+            )
+
+    def wait_for_job(
+        self, video_id: str, timeout_seconds: float
+    ) -> Optional[DownloadJob]:
+        deadline = time.monotonic() + timeout_seconds
+        job = self.get_job(video_id)
+        while (
+            job is not None
+            and job.state not in FINISHED_JOB_STATES
+            and time.monotonic() < deadline
+        ):
+            time.sleep(min(0.5, max(deadline - time.monotonic(), 0)))
+            job = self.get_job(video_id)
+        return job
+
+    def _run_worker(
+        self,
+        is_downloaded: Callable[[str], bool],
+        download: Callable[[str], None],
+    ) -> None:
+        idle_poll_interval = IDLE_POLL_INTERVAL_SECONDS
+        while True:
+            try:
+                video_id = self.claim_next_job()
+            except Exception:
+                logging.exception("Failed to claim a download job")
+                video_id = None
+            if video_id is None:
+                if self._job_added.wait(idle_poll_interval):
+                    idle_poll_interval = IDLE_POLL_INTERVAL_SECONDS
+                else:
+                    idle_poll_interval = min(
+                        idle_poll_interval * 2, MAX_IDLE_POLL_INTERVAL_SECONDS
+                    )
+                self._job_added.clear()
+                continue
+            idle_poll_interval = IDLE_POLL_INTERVAL_SECONDS
+            try:
+                self.coordinator.run_once(
+                    video_id,
+                    lambda: is_downloaded(video_id),
+                    lambda: download(video_id),
+                )
+            except Exception as exception:
+                logging.exception(f"Download job for {video_id} failed")
+                self.finish_job(
+                    video_id, error=str(exception) or type(exception).__name__
+                )
+            else:
+                self.finish_job(video_id)
+            # A slot has opened up for jobs that were waiting on the concurrency limit
+            self._job_added.set()
+
+    def start_workers(
+        self,
+        is_downloaded: Callable[[str], bool],
+        download: Callable[[str], None],
+    ) -> None:
+        for worker_index in range(self.max_concurrent_downloads):
+            threading.Thread(
+                target=self._run_worker,
+                args=(is_downloaded, download),
+                name=f"download-worker-{worker_index}",
+                daemon=True,
+            ).start()
+        start_periodic_task(
+            "requeue-stale-download-jobs",
+            self.data_path,
+            STALE_RUNNING_JOB_AGE.total_seconds(),
+            self.requeue_stale_jobs,
+        )
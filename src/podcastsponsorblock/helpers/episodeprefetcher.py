@@ -0,0 +1,58 @@
+import logging
+from typing import Callable, Sequence
+
+from .downloadqueue import DownloadQueue, PRIORITY_BACKGROUND
+from .youtubeplaylistepisodefeed import YoutubePlaylistEpisodeFeed
+from ..models import ServiceConfig, FeedOptions, EpisodeWindow
+
+
+def get_configured_playlist_ids(config: ServiceConfig) -> Sequence[str]:
+    # dict.fromkeys de-duplicates while keeping the configuration order
+    return tuple(
+        dict.fromkeys((*config.aliases.values(), *config.podcast_configs.keys()))
+    )
+
+
+def get_prefetch_episode_count(playlist_id: str, config: ServiceConfig) -> int:
+    podcast_config = config.podcast_configs.get(playlist_id)
+    if podcast_config is not None and podcast_config.prefetch_episodes is not None:
+        return podcast_config.prefetch_episodes
+    return config.prefetch_episodes
+
+
+def is_prefetch_enabled(config: ServiceConfig) -> bool:
+    return any(
+        get_prefetch_episode_count(playlist_id, config) > 0
+        for playlist_id in get_configured_playlist_ids(config)
+    )
+
+
+def prefetch_new_episodes(
+    config: ServiceConfig,
+    download_queue: DownloadQueue,
+    is_downloaded: Callable[[str], bool],
+) -> None:
+    for playlist_id in get_configured_playlist_ids(config):
+        episode_count = get_prefetch_episode_count(playlist_id, config)
+        if episode_count < 1:
+            continue
+        try:
+            episode_feed = YoutubePlaylistEpisodeFeed(
+                playlist_id,
+                FeedOptions(config, config.podcast_configs.get(playlist_id), ""),
+            )
+        except ValueError:
+            logging.warning(f"Skipping prefetch of missing playlist {playlist_id}")
+            continue
+        for episode in episode_feed.get_episodes(EpisodeWindow(limit=episode_count)):
+            if is_downloaded(episode.id):
+                continue
+            # The prefetcher only keeps a few jobs pending at a time so it can't crowd out downloads that a listener is
+            # waiting on. Anything it couldn't queue now is picked up on the next run
+            if (
+                download_queue.count_pending_jobs(PRIORITY_BACKGROUND)
+                >= config.prefetch_concurrency
+            ):
+                return
+            logging.info(f"Prefetching episode {episode.id} of playlist {playlist_id}")
+            download_queue.enqueue(episode.id, priority=PRIORITY_BACKGROUND)
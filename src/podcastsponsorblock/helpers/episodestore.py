@@ -0,0 +1,88 @@
+import pickle
+from pathlib import Path
+from typing import Iterable, Sequence
+
+from .database import get_database_connection, transaction
+from ..models import EpisodeDetails, EpisodeWindow
+
+# Stores are created for every feed, so the schema is only set up the first time each process sees a data path
+_initialized_data_paths: set[Path] = set()
+
+
+# Keeps each playlist's episodes in the shared sqlite database, indexed by publish date, so feeds can load just the
+# episodes they show instead of the whole back catalog
+class EpisodeStore:
+    def __init__(self, data_path: Path):
+        self.data_path = data_path
+        if data_path in _initialized_data_paths:
+            return
+        connection = self._connection()
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS playlist_episodes (
+                playlist_id TEXT NOT NULL,
+                video_id TEXT NOT NULL,
+                published_at REAL NOT NULL,
+                details BLOB NOT NULL,
+                PRIMARY KEY (playlist_id, video_id)
+            )
+            """)
+        connection.execute(
+            "CREATE INDEX IF NOT EXISTS playlist_episodes_by_date "
+            "ON playlist_episodes (playlist_id, published_at)"
+        )
+        _initialized_data_paths.add(data_path)
+
+    def _connection(self):
+        return get_database_connection(self.data_path)
+
+    def replace_episodes(
+        self, playlist_id: str, episodes: Iterable[EpisodeDetails]
+    ) -> None:
+        with transaction(self._connection()) as connection:
+            connection.execute(
+                "DELETE FROM playlist_episodes WHERE playlist_id = ?", (playlist_id,)
+            )
+            connection.executemany(
+                "INSERT INTO playlist_episodes (playlist_id, video_id, published_at, details) VALUES (?, ?, ?, ?)",
+                (
+                    (
+                        playlist_id,
+                        episode.id,
+                        episode.published_at.timestamp(),
+                        pickle.dumps(episode),
+                    )
+                    for episode in episodes
+                ),
+            )
+
+    @staticmethod
+    def _get_published_after(window: EpisodeWindow) -> float:
+        if window.published_after is None:
+            return float("-inf")
+        return window.published_after.timestamp()
+
+    def count_episodes(self, playlist_id: str, window: EpisodeWindow) -> int:
+        return (
+            self._connection()
+            .execute(
+                "SELECT COUNT(*) FROM playlist_episodes WHERE playlist_id = ? AND published_at >= ?",
+                (playlist_id, self._get_published_after(window)),
+            )
+            .fetchone()[0]
+        )
+
+    def get_episodes(
+        self, playlist_id: str, window: EpisodeWindow
+    ) -> Sequence[EpisodeDetails]:
+        # Newest first. A limit of -1 means no limit to sqlite
+        rows = self._connection().execute(
+            "SELECT details FROM playlist_episodes WHERE playlist_id = ? AND published_at >= ? "
+            "ORDER BY published_at DESC, video_id DESC LIMIT ? OFFSET ?",
+            (
+                playlist_id,
+                self._get_published_after(window),
+                -1 if window.limit is None else window.limit,
+                window.offset,
+            ),
+        )
+        return tuple(pickle.loads(row["details"]) for row in rows)
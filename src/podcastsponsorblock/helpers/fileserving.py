@@ -0,0 +1,34 @@
+import mimetypes
+from pathlib import Path
+from urllib.parse import quote
+
+from flask import Response, send_file
+
+from ..models import ServiceConfig
+
+FILE_SERVING_DIRECT = "direct"
+# nginx serves the file from an internal location that maps file_serving_prefix to the data path
+FILE_SERVING_X_ACCEL_REDIRECT = "x-accel-redirect"
+# Apache (mod_xsendfile) and lighttpd serve the file from its absolute path
+FILE_SERVING_X_SENDFILE = "x-sendfile"
+FILE_SERVING_MODES = (
+    FILE_SERVING_DIRECT,
+    FILE_SERVING_X_ACCEL_REDIRECT,
+    FILE_SERVING_X_SENDFILE,
+)
+
+
+def send_cached_file(path: Path, config: ServiceConfig) -> Response:
+    # Files under the data path can be handed off to the reverse proxy, which sends them (including range requests)
+    # without tying up a gunicorn worker for the whole transfer
+    if config.file_serving_mode == FILE_SERVING_DIRECT:
+        return send_file(path)
+    response = Response(mimetype=mimetypes.guess_type(path.name)[0])
+    if config.file_serving_mode == FILE_SERVING_X_ACCEL_REDIRECT:
+        relative_path = path.relative_to(config.data_path).as_posix()
+        response.headers["X-Accel-Redirect"] = (
+            f"{config.file_serving_prefix.rstrip('/')}/{quote(relative_path)}"
+        )
+    else:
+        response.headers["X-Sendfile"] = str(path.absolute())
+    return response
@@ -0,0 +1,92 @@
+import json
+import time
+from pathlib import Path
+from typing import Iterable, Sequence
+
+from .database import get_database_connection
+from ..models import MediaMetadata, SponsorSegment
+
+# SQLite limits how many parameters a statement can have, so large lookups are split into batches of this size
+LOOKUP_BATCH_SIZE = 500
+
+# Stores are created for every feed, so the schema is only set up the first time each process sees a data path
+_initialized_data_paths: set[Path] = set()
+
+
+# Records the size, duration and cut segments of each variant (a video cut for a set of categories) when it's written,
+# so feeds can describe the audio without touching the files. Rows outlive evictions from the audio cache, since a
+# variant that's cut again from the same source and segments comes out the same
+class MediaMetadataStore:
+    def __init__(self, data_path: Path):
+        self.data_path = data_path
+        if data_path in _initialized_data_paths:
+            return
+        self._connection().execute("""
+            CREATE TABLE IF NOT EXISTS media_metadata (
+                video_id TEXT NOT NULL,
+                categories TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                duration REAL,
+                segments TEXT NOT NULL,
+                written_at REAL NOT NULL,
+                PRIMARY KEY (video_id, categories)
+            )
+            """)
+        _initialized_data_paths.add(data_path)
+
+    def _connection(self):
+        return get_database_connection(self.data_path)
+
+    @staticmethod
+    def _serialize_categories(categories: Sequence[str]) -> str:
+        return ",".join(categories)
+
+    def record_media_metadata(
+        self,
+        video_id: str,
+        categories: Sequence[str],
+        media_metadata: MediaMetadata,
+    ) -> None:
+        self._connection().execute(
+            "INSERT INTO media_metadata (video_id, categories, size, duration, segments, written_at) "
+            "VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (video_id, categories) DO UPDATE SET size = excluded.size, "
+            "duration = excluded.duration, segments = excluded.segments, written_at = excluded.written_at",
+            (
+                video_id,
+                self._serialize_categories(categories),
+                media_metadata.size,
+                media_metadata.duration,
+                json.dumps(
+                    [
+                        [segment.start, segment.end]
+                        for segment in media_metadata.segments
+                    ]
+                ),
+                time.time(),
+            ),
+        )
+
+    def get_media_metadata(
+        self, video_ids: Iterable[str], categories: Sequence[str]
+    ) -> dict[str, MediaMetadata]:
+        # Videos that haven't been written for these categories are left out
+        video_ids = tuple(video_ids)
+        media_metadata = dict()
+        for batch_start in range(0, len(video_ids), LOOKUP_BATCH_SIZE):
+            batch = video_ids[batch_start : batch_start + LOOKUP_BATCH_SIZE]
+            rows = self._connection().execute(
+                "SELECT video_id, size, duration, segments FROM media_metadata "
+                f"WHERE categories = ? AND video_id IN ({', '.join('?' * len(batch))})",
+                (self._serialize_categories(categories), *batch),
+            )
+            for row in rows:
+                media_metadata[row["video_id"]] = MediaMetadata(
+                    size=row["size"],
+                    duration=row["duration"],
+                    segments=tuple(
+                        SponsorSegment(start, end)
+                        for start, end in json.loads(row["segments"])
+                    ),
+                )
+        return media_metadata
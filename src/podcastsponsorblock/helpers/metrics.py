@@ -0,0 +1,261 @@
+import atexit
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from pathlib import Path
+from typing import Iterator, Optional, Sequence
+
+from .database import get_database_connection, transaction
+
+# Metrics are kept in memory and added to the shared sqlite database at most this often, so recording one never writes
+# to it. Every gunicorn worker adds its own, so /metrics reports the totals of all of them
+METRICS_FLUSH_INTERVAL = timedelta(seconds=10)
+
+REQUEST_DURATION_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+)
+DOWNLOAD_DURATION_BUCKETS = (0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+COUNTER = "counter"
+GAUGE = "gauge"
+HISTOGRAM = "histogram"
+HISTOGRAM_SERIES_SUFFIXES = ("_bucket", "_sum", "_count")
+# Names to the type and help text of every metric
+METRIC_DESCRIPTIONS = {
+    "podcast_request_duration_seconds": (
+        HISTOGRAM,
+        "Time taken to answer requests, including streaming the response",
+    ),
+    "podcast_response_bytes_total": (COUNTER, "Bytes of response bodies sent"),
+    "podcast_youtube_api_calls_total": (
+        COUNTER,
+        "YouTube Data API calls, for tracking quota use",
+    ),
+    "podcast_youtube_client_builds_total": (
+        COUNTER,
+        "YouTube API clients built, one per thread and API key",
+    ),
+    "podcast_youtube_client_reuses_total": (
+        COUNTER,
+        "Times a thread reused its YouTube API client instead of building one",
+    ),
+    "podcast_youtube_client_build_seconds_total": (
+        COUNTER,
+        "Time spent building YouTube API clients",
+    ),
+    "podcast_download_phase_duration_seconds": (
+        HISTOGRAM,
+        "Time taken by each phase of downloading and cutting audio",
+    ),
+    "podcast_cache_requests_total": (
+        COUNTER,
+        "Cache lookups by result (hit, miss or stale)",
+    ),
+    "podcast_cache_refreshes_total": (
+        COUNTER,
+        "Cache entries refreshed by result (success or failure)",
+    ),
+    "podcast_download_jobs": (GAUGE, "Download jobs by state"),
+    "podcast_audio_cache_bytes": (
+        GAUGE,
+        "Disk space used by cached audio, as of the last download or cache scan",
+    ),
+    "podcast_audio_cache_max_bytes": (GAUGE, "The audio cache's size budget"),
+    "podcast_audio_cache_files": (
+        GAUGE,
+        "Files in the audio cache, as of the last download or cache scan",
+    ),
+}
+
+_metrics_data_path: Optional[Path] = None
+# (name, labels) to the amount added since the last flush. Histograms are stored as their _bucket, _sum and _count series
+_pending_values: dict[tuple[str, str], float] = dict()
+_pending_values_lock = threading.Lock()
+_flush_thread_started = False
+
+
+def format_labels(labels: dict[str, str]) -> str:
+    escaped_labels = (
+        (
+            name,
+            str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"),
+        )
+        for name, value in sorted(labels.items())
+    )
+    return ",".join(f'{name}="{value}"' for name, value in escaped_labels)
+
+
+def format_bucket_bound(bound: float) -> str:
+    return "+Inf" if math.isinf(bound) else repr(float(bound))
+
+
+def flush_metrics() -> None:
+    with _pending_values_lock:
+        if _metrics_data_path is None:
+            return
+        pending_values = tuple(_pending_values.items())
+        _pending_values.clear()
+    if len(pending_values) == 0:
+        return
+    with transaction(get_database_connection(_metrics_data_path)) as connection:
+        connection.executemany(
+            "INSERT INTO metric_values (name, labels, value) VALUES (?, ?, ?) "
+            "ON CONFLICT (name, labels) DO UPDATE SET value = value + excluded.value",
+            ((name, labels, value) for (name, labels), value in pending_values),
+        )
+
+
+def _flush_metrics_periodically() -> None:
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL.total_seconds())
+        try:
+            flush_metrics()
+        except Exception:
+            logging.exception("Failed to flush metrics")
+
+
+def configure_metrics(data_path: Path) -> None:
+    global _metrics_data_path, _flush_thread_started
+    get_database_connection(data_path).execute("""
+        CREATE TABLE IF NOT EXISTS metric_values (
+            name TEXT NOT NULL,
+            labels TEXT NOT NULL,
+            value REAL NOT NULL,
+            PRIMARY KEY (name, labels)
+        )
+        """)
+    _metrics_data_path = data_path
+    if not _flush_thread_started:
+        _flush_thread_started = True
+        threading.Thread(
+            target=_flush_metrics_periodically, name="metrics-flush", daemon=True
+        ).start()
+        # Workers that exit (e.g. when gunicorn restarts them) write what they recorded since their last flush
+        atexit.register(flush_metrics)
+
+
+def _add(name: str, labels: dict[str, str], amount: float) -> None:
+    key = (name, format_labels(labels))
+    with _pending_values_lock:
+        _pending_values[key] = _pending_values.get(key, 0) + amount
+
+
+def increment_counter(
+    name: str, labels: Optional[dict[str, str]] = None, amount: float = 1
+) -> None:
+    _add(name, labels or dict(), amount)
+
+
+def observe_histogram(
+    name: str, labels: dict[str, str], value: float, buckets: Sequence[float]
+) -> None:
+    # Buckets are cumulative, so a value counts towards every bucket it fits in. The others are added to as well, so
+    # every bucket is listed from the first observation
+    for bound in (*buckets, math.inf):
+        _add(
+            f"{name}_bucket",
+            {**labels, "le": format_bucket_bound(bound)},
+            1 if value <= bound else 0,
+        )
+    _add(f"{name}_sum", labels, value)
+    _add(f"{name}_count", labels, 1)
+
+
+@contextmanager
+def time_histogram(
+    name: str, labels: dict[str, str], buckets: Sequence[float]
+) -> Iterator[None]:
+    # Attempts that fail are timed too
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_histogram(name, labels, time.perf_counter() - started_at, buckets)
+
+
+def get_metric_values() -> dict[tuple[str, str], float]:
+    # Totals from every worker once metrics are configured, otherwise just this process's
+    flush_metrics()
+    if _metrics_data_path is None:
+        with _pending_values_lock:
+            return dict(_pending_values)
+    return {
+        (row["name"], row["labels"]): row["value"]
+        for row in get_database_connection(_metrics_data_path).execute(
+            "SELECT name, labels, value FROM metric_values"
+        )
+    }
+
+
+def get_base_metric_name(series_name: str) -> str:
+    for suffix in HISTOGRAM_SERIES_SUFFIXES:
+        base_name = series_name.removesuffix(suffix)
+        if (
+            base_name != series_name
+            and METRIC_DESCRIPTIONS.get(base_name, (None,))[0] == HISTOGRAM
+        ):
+            return base_name
+    return series_name
+
+
+def format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _get_series_sort_key(series: tuple[str, str, float]) -> tuple:
+    # Series are grouped by their labels, with a histogram's buckets listed from the smallest bound up (which sorting
+    # the labels as text wouldn't do) followed by its sum and count
+    series_name, labels, _ = series
+    other_labels = []
+    bucket_bound = math.inf
+    for label in labels.split(","):
+        if label.startswith('le="'):
+            bucket_bound = float(label[len('le="') : -1])
+        else:
+            other_labels.append(label)
+    suffix_order = next(
+        (
+            order
+            for order, suffix in enumerate(HISTOGRAM_SERIES_SUFFIXES)
+            if series_name.endswith(suffix)
+        ),
+        -1,
+    )
+    return ",".join(other_labels), suffix_order, bucket_bound
+
+
+def render_metrics(metric_values: dict[tuple[str, str], float]) -> str:
+    # Writes the values in the Prometheus text exposition format, grouped by metric
+    series_by_metric: dict[str, list[tuple[str, str, float]]] = dict()
+    for (series_name, labels), value in metric_values.items():
+        series_by_metric.setdefault(get_base_metric_name(series_name), []).append(
+            (series_name, labels, value)
+        )
+    lines = []
+    for metric_name in sorted(series_by_metric):
+        metric_type, metric_help = METRIC_DESCRIPTIONS.get(
+            metric_name, ("untyped", metric_name)
+        )
+        lines.append(f"# HELP {metric_name} {metric_help}")
+        lines.append(f"# TYPE {metric_name} {metric_type}")
+        for series_name, labels, value in sorted(
+            series_by_metric[metric_name], key=_get_series_sort_key
+        ):
+            series = f"{series_name}{{{labels}}}" if labels != "" else series_name
+            lines.append(f"{series} {format_value(value)}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,42 @@
+import logging
+import random
+import threading
+import time
+from pathlib import Path
+from typing import Callable
+
+from .downloadcoordinator import DownloadCoordinator
+
+
+def _run_periodic_task(
+    name: str,
+    data_path: Path,
+    interval_seconds: float,
+    task: Callable[[], None],
+    jitter_seconds: float,
+) -> None:
+    # Every gunicorn worker starts the task, but only the worker holding the task's lock runs it. The others block on
+    # the lock and take over if that worker exits
+    with DownloadCoordinator(data_path).lock(f"task-{name}"):
+        logging.info(f"Running periodic task {name} in this worker")
+        while True:
+            try:
+                task()
+            except Exception:
+                logging.exception(f"Periodic task {name} failed")
+            time.sleep(interval_seconds + random.uniform(0, jitter_seconds))
+
+
+def start_periodic_task(
+    name: str,
+    data_path: Path,
+    interval_seconds: float,
+    task: Callable[[], None],
+    jitter_seconds: float = 0,
+) -> None:
+    threading.Thread(
+        target=_run_periodic_task,
+        args=(name, data_path, interval_seconds, task, jitter_seconds),
+        name=f"periodic-task-{name}",
+        daemon=True,
+    ).start()
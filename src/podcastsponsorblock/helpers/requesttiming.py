@@ -0,0 +1,77 @@
+import json
+import logging
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from flask import g, has_request_context
+
+# Slow requests are logged here as one JSON object per line, so they can be filtered out of the rest of the log
+slow_request_logger = logging.getLogger("podcastsponsorblock.slowrequests")
+
+
+@contextmanager
+def timing_span(name: str) -> Iterator[None]:
+    # Adds the time spent in the block to the current request's span of this name. Spans entered more than once (e.g.
+    # per episode) add up. Outside of a request (e.g. background refreshes) nothing is recorded
+    if not has_request_context():
+        yield
+        return
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing_spans = get_timing_spans()
+        timing_spans[name] = (
+            timing_spans.get(name, 0) + time.perf_counter() - started_at
+        )
+
+
+def get_timing_spans() -> dict[str, float]:
+    # The current request's span names to their duration in seconds, in the order they were first finished. Spans
+    # finished later (e.g. while a response is streamed) are added to the same dictionary
+    return g.setdefault("timing_spans", dict())
+
+
+def format_server_timing(timing_spans: dict[str, float]) -> str:
+    # Durations are in milliseconds, as the Server-Timing header expects
+    return ", ".join(
+        f"{name};dur={duration * 1000:.1f}" for name, duration in timing_spans.items()
+    )
+
+
+def log_slow_request(
+    method: str,
+    path: str,
+    view: Optional[str],
+    status: int,
+    duration: float,
+    timing_spans: dict[str, float],
+) -> None:
+    # Only the path is logged, since the query string may hold the auth key
+    slow_request_logger.warning(
+        json.dumps(
+            {
+                "event": "slow_request",
+                "method": method,
+                "path": path,
+                "view": view,
+                "status": status,
+                "duration_ms": round(duration * 1000, 1),
+                "spans_ms": {
+                    name: round(span_duration * 1000, 1)
+                    for name, span_duration in timing_spans.items()
+                },
+            }
+        )
+    )
+
+
+def time_until_response_headers() -> None:
+    # Marks the current request as one whose body is a file transfer, which takes as long as the client takes to
+    # download it. Such requests are timed until their headers are sent rather than until their body is
+    g.timed_until_response_headers = True
+
+
+def is_timed_until_response_headers() -> bool:
+    return g.get("timed_until_response_headers", False)
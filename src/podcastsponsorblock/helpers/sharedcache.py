@@ -0,0 +1,352 @@
+import functools
+import hashlib
+import logging
+import pickle
+import threading
+import time
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+from datetime import timedelta
+from pathlib import Path
+from typing import Any, Callable, Hashable, Iterator, Optional, Sequence
+
+from cachetools import TTLCache
+from cachetools.keys import hashkey
+from flask import copy_current_request_context, has_request_context
+
+from .database import get_database_connection, transaction
+from .downloadcoordinator import DownloadCoordinator
+from ..models import SharedCacheStatistics
+
+# Usage counters are kept in memory and written to the database at most this often, so cache hits don't write to it
+METRICS_FLUSH_INTERVAL = timedelta(seconds=10)
+
+_shared_cache_data_path: Optional[Path] = None
+_pending_event_counts: dict[tuple[str, str], int] = dict()
+_pending_event_counts_lock = threading.Lock()
+_event_counts_flushed_at = time.monotonic()
+# Keys being refreshed in the background by this process, so a burst of stale hits starts one refresh
+_refreshing_keys: set[tuple[str, str]] = set()
+_refreshing_keys_lock = threading.Lock()
+# Loads are coordinated with lock files once the cache is configured. Until then, they only need to be coordinated
+# between this process's threads
+_local_locks: dict[str, threading.Lock] = dict()
+_local_locks_lock = threading.Lock()
+
+
+def configure_shared_cache(data_path: Path) -> None:
+    global _shared_cache_data_path
+    connection = get_database_connection(data_path)
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS cache_entries (
+            namespace TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value BLOB NOT NULL,
+            expires_at REAL NOT NULL,
+            PRIMARY KEY (namespace, key)
+        )
+        """)
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS cache_counters (
+            namespace TEXT NOT NULL,
+            name TEXT NOT NULL,
+            value INTEGER NOT NULL,
+            PRIMARY KEY (namespace, name)
+        )
+        """)
+    _shared_cache_data_path = data_path
+
+
+def _flush_event_counts() -> None:
+    global _event_counts_flushed_at
+    with _pending_event_counts_lock:
+        if _shared_cache_data_path is None:
+            return
+        event_counts = tuple(_pending_event_counts.items())
+        _pending_event_counts.clear()
+        _event_counts_flushed_at = time.monotonic()
+    with transaction(get_database_connection(_shared_cache_data_path)) as connection:
+        connection.executemany(
+            "INSERT INTO cache_counters (namespace, name, value) VALUES (?, ?, ?) "
+            "ON CONFLICT (namespace, name) DO UPDATE SET value = value + excluded.value",
+            ((namespace, name, count) for (namespace, name), count in event_counts),
+        )
+
+
+def record_cache_event(namespace: str, name: str) -> None:
+    with _pending_event_counts_lock:
+        _pending_event_counts[(namespace, name)] = (
+            _pending_event_counts.get((namespace, name), 0) + 1
+        )
+        is_flush_due = (
+            time.monotonic() - _event_counts_flushed_at
+            >= METRICS_FLUSH_INTERVAL.total_seconds()
+        )
+    if is_flush_due:
+        _flush_event_counts()
+
+
+def get_shared_cache_statistics() -> Sequence[SharedCacheStatistics]:
+    # Counts from every worker once the cache is configured, otherwise just this process's
+    _flush_event_counts()
+    if _shared_cache_data_path is None:
+        with _pending_event_counts_lock:
+            event_counts = dict(_pending_event_counts)
+    else:
+        event_counts = {
+            (row["namespace"], row["name"]): row["value"]
+            for row in get_database_connection(_shared_cache_data_path).execute(
+                "SELECT namespace, name, value FROM cache_counters"
+            )
+        }
+    return tuple(
+        SharedCacheStatistics(
+            namespace=namespace,
+            hits=event_counts.get((namespace, "hits"), 0),
+            misses=event_counts.get((namespace, "misses"), 0),
+            stale_serves=event_counts.get((namespace, "stale_serves"), 0),
+            refreshes=event_counts.get((namespace, "refreshes"), 0),
+            refresh_failures=event_counts.get((namespace, "refresh_failures"), 0),
+        )
+        for namespace in sorted({namespace for namespace, _ in event_counts})
+    )
+
+
+# A cachetools-compatible cache stored in the shared sqlite database, so every gunicorn worker shares one copy of each
+# entry and entries survive restarts. Until configure_shared_cache is called (e.g. when the helpers are used outside
+# of create_app), it behaves like a regular per-process TTLCache. Entries are kept for max_stale after they expire,
+# which get_entry returns (e.g. for shared_cached to serve them while they're refreshed); the mapping interface only
+# sees fresh entries
+class SharedTTLCache(MutableMapping):
+    def __init__(
+        self,
+        namespace: str,
+        ttl: timedelta,
+        maxsize: int = 1024,
+        max_stale: timedelta = timedelta(0),
+    ):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_stale = max_stale
+        # Holds (value, expires at) pairs. cachetools caches aren't thread-safe, so they're only used under the lock
+        self._fallback_cache = TTLCache(
+            maxsize=maxsize, ttl=(ttl + max_stale).total_seconds()
+        )
+        self._fallback_lock = threading.Lock()
+
+    @staticmethod
+    def _serialize_key(key: Hashable) -> str:
+        return repr(key)
+
+    @property
+    def _is_configured(self) -> bool:
+        return _shared_cache_data_path is not None
+
+    def _connection(self):
+        return get_database_connection(_shared_cache_data_path)
+
+    def get_entry(self, key: Hashable) -> Optional[tuple[Any, bool]]:
+        # Returns the value and whether it's still fresh, or None if there's no entry or it's past max_stale
+        now = time.time()
+        if not self._is_configured:
+            with self._fallback_lock:
+                fallback_entry = self._fallback_cache.get(key)
+            if fallback_entry is None:
+                return None
+            value, expires_at = fallback_entry
+            return value, expires_at > now
+        row = (
+            self._connection()
+            .execute(
+                "SELECT value, expires_at FROM cache_entries WHERE namespace = ? AND key = ? AND expires_at > ?",
+                (
+                    self.namespace,
+                    self._serialize_key(key),
+                    now - self.max_stale.total_seconds(),
+                ),
+            )
+            .fetchone()
+        )
+        if row is None:
+            return None
+        return pickle.loads(row["value"]), row["expires_at"] > now
+
+    def __getitem__(self, key: Hashable) -> Any:
+        entry = self.get_entry(key)
+        if entry is None or not entry[1]:
+            record_cache_event(self.namespace, "misses")
+            raise KeyError(key)
+        record_cache_event(self.namespace, "hits")
+        return entry[0]
+
+    def __setitem__(self, key: Hashable, value: Any) -> None:
+        now = time.time()
+        if not self._is_configured:
+            with self._fallback_lock:
+                self._fallback_cache[key] = (value, now + self.ttl.total_seconds())
+            return
+        with transaction(self._connection()) as connection:
+            connection.execute(
+                "DELETE FROM cache_entries WHERE namespace = ? AND expires_at <= ?",
+                (self.namespace, now - self.max_stale.total_seconds()),
+            )
+            connection.execute(
+                "INSERT OR REPLACE INTO cache_entries (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (
+                    self.namespace,
+                    self._serialize_key(key),
+                    pickle.dumps(value),
+                    now + self.ttl.total_seconds(),
+                ),
+            )
+
+    def __delitem__(self, key: Hashable) -> None:
+        if not self._is_configured:
+            with self._fallback_lock:
+                del self._fallback_cache[key]
+            return
+        cursor = self._connection().execute(
+            "DELETE FROM cache_entries WHERE namespace = ? AND key = ?",
+            (self.namespace, self._serialize_key(key)),
+        )
+        if cursor.rowcount == 0:
+            raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        now = time.time()
+        if not self._is_configured:
+            with self._fallback_lock:
+                return iter(
+                    tuple(
+                        key
+                        for key, (_, expires_at) in self._fallback_cache.items()
+                        if expires_at > now
+                    )
+                )
+        rows = self._connection().execute(
+            "SELECT key FROM cache_entries WHERE namespace = ? AND expires_at > ?",
+            (self.namespace, now),
+        )
+        return iter(tuple(row["key"] for row in rows))
+
+    def __len__(self) -> int:
+        if not self._is_configured:
+            return len(tuple(iter(self)))
+        return (
+            self._connection()
+            .execute(
+                "SELECT COUNT(*) FROM cache_entries WHERE namespace = ? AND expires_at > ?",
+                (self.namespace, time.time()),
+            )
+            .fetchone()[0]
+        )
+
+
+@contextmanager
+def _load_lock(lock_key: str, blocking: bool) -> Iterator[bool]:
+    if _shared_cache_data_path is not None:
+        with DownloadCoordinator(_shared_cache_data_path).lock(
+            lock_key, blocking
+        ) as acquired:
+            yield acquired
+        return
+    with _local_locks_lock:
+        local_lock = _local_locks.setdefault(lock_key, threading.Lock())
+    if not local_lock.acquire(blocking):
+        yield False
+        return
+    try:
+        yield True
+    finally:
+        local_lock.release()
+
+
+def _refresh_in_background(
+    cache: SharedTTLCache, cache_key: Hashable, lock_key: str, load: Callable[[], Any]
+) -> None:
+    refreshing_key = (cache.namespace, lock_key)
+    with _refreshing_keys_lock:
+        if refreshing_key in _refreshing_keys:
+            return
+        _refreshing_keys.add(refreshing_key)
+
+    def refresh() -> None:
+        try:
+            # Another worker holding the lock is already refreshing (or loading) the entry
+            with _load_lock(lock_key, blocking=False) as acquired:
+                if not acquired:
+                    return
+                entry = cache.get_entry(cache_key)
+                if entry is not None and entry[1]:
+                    return
+                try:
+                    cache[cache_key] = load()
+                except Exception:
+                    record_cache_event(cache.namespace, "refresh_failures")
+                    logging.exception(
+                        f"Failed to refresh {cache.namespace} cache entry {cache_key}"
+                    )
+                    return
+                record_cache_event(cache.namespace, "refreshes")
+        finally:
+            with _refreshing_keys_lock:
+                _refreshing_keys.discard(refreshing_key)
+
+    threading.Thread(
+        target=refresh, name=f"cache-refresh-{cache.namespace}", daemon=True
+    ).start()
+
+
+def _get_load_lock_key(cache: SharedTTLCache, cache_key: Hashable) -> str:
+    return f"cache-{cache.namespace}-{hashlib.sha256(repr(cache_key).encode()).hexdigest()[:32]}"
+
+
+# Like cachetools' cached, but only one caller (across threads and gunicorn workers) loads a missing entry while the
+# others wait for it, and expired entries are served for up to the cache's max_stale while one caller refreshes them in
+# the background. Past max_stale, callers wait for a fresh value like on a miss. The decorated function's refresh
+# attribute loads a fresh value whether or not the entry has expired, to refresh it ahead of demand
+def shared_cached(
+    cache: SharedTTLCache, key: Callable[..., Hashable] = hashkey
+) -> Callable[[Callable], Callable]:
+    def decorator(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs) -> Any:
+            cache_key = key(*args, **kwargs)
+            entry = cache.get_entry(cache_key)
+            if entry is not None and entry[1]:
+                record_cache_event(cache.namespace, "hits")
+                return entry[0]
+            lock_key = _get_load_lock_key(cache, cache_key)
+            # Stale entries are reloaded on another thread with these arguments, so they mustn't be tied to this thread
+            # (e.g. YouTube clients)
+            load = functools.partial(function, *args, **kwargs)
+            if entry is not None:
+                record_cache_event(cache.namespace, "stale_serves")
+                # Loads that build URLs need the request they were started from
+                if has_request_context():
+                    load = copy_current_request_context(load)
+                _refresh_in_background(cache, cache_key, lock_key, load)
+                return entry[0]
+            record_cache_event(cache.namespace, "misses")
+            with _load_lock(lock_key, blocking=True):
+                # The caller that held the lock before this one has probably loaded it already
+                entry = cache.get_entry(cache_key)
+                if entry is not None and entry[1]:
+                    return entry[0]
+                value = load()
+                cache[cache_key] = value
+                return value
+
+        def refresh(*args, **kwargs) -> Any:
+            cache_key = key(*args, **kwargs)
+            with _load_lock(_get_load_lock_key(cache, cache_key), blocking=True):
+                value = function(*args, **kwargs)
+                cache[cache_key] = value
+            record_cache_event(cache.namespace, "refreshes")
+            return value
+
+        wrapper.cache = cache
+        wrapper.refresh = refresh
+        return wrapper
+
+    return decorator
@@ -0,0 +1,81 @@
+import json
+import logging
+from typing import Sequence
+
+import requests
+
+from .apiurls import get_api_urls
+from ..models import SponsorSegment
+
+SPONSORBLOCK_TIMEOUT_SECONDS = 10
+# The categories whose segments are skipped (rather than e.g. highlighted)
+SPONSORBLOCK_CATEGORIES = (
+    "sponsor",
+    "selfpromo",
+    "interaction",
+    "intro",
+    "outro",
+    "preview",
+    "hook",
+    "filler",
+    "music_offtopic",
+)
+
+
+def get_unknown_categories(categories: Sequence[str]) -> Sequence[str]:
+    return tuple(
+        category
+        for category in categories
+        if category not in SPONSORBLOCK_CATEGORIES and category != "all"
+    )
+
+
+def normalize_categories(categories: Sequence[str]) -> Sequence[str]:
+    # Gives every spelling of a set of categories (order, duplicates, whitespace) the same cache key
+    stripped_categories = {category.strip() for category in categories} - {""}
+    # Unknown categories (a typo, or one SponsorBlock has since removed) in the configuration shouldn't stop the service
+    # from starting, so they're left out instead
+    for category in sorted(get_unknown_categories(stripped_categories)):
+        logging.warning(f"Ignoring unknown SponsorBlock category: {category}")
+        stripped_categories.remove(category)
+    if "all" in stripped_categories:
+        stripped_categories = (stripped_categories - {"all"}) | set(
+            SPONSORBLOCK_CATEGORIES
+        )
+    return tuple(sorted(stripped_categories))
+
+
+def merge_segments(segments: Sequence[SponsorSegment]) -> Sequence[SponsorSegment]:
+    # Segments submitted for different categories often overlap
+    merged_segments = []
+    for segment in sorted(segments, key=lambda segment: segment.start):
+        if len(merged_segments) > 0 and segment.start <= merged_segments[-1].end:
+            merged_segments[-1] = SponsorSegment(
+                merged_segments[-1].start, max(merged_segments[-1].end, segment.end)
+            )
+        else:
+            merged_segments.append(segment)
+    return tuple(merged_segments)
+
+
+def get_sponsor_segments(
+    video_id: str, categories: Sequence[str]
+) -> Sequence[SponsorSegment]:
+    if len(categories) == 0:
+        return tuple()
+    sponsorblock_response = requests.get(
+        get_api_urls().sponsorblock_api_url,
+        params={"videoID": video_id, "categories": json.dumps(list(categories))},
+        timeout=SPONSORBLOCK_TIMEOUT_SECONDS,
+    )
+    # SponsorBlock answers 404 when a video has no segments in the requested categories
+    if sponsorblock_response.status_code == 404:
+        return tuple()
+    sponsorblock_response.raise_for_status()
+    return merge_segments(
+        tuple(
+            SponsorSegment(*segment_object["segment"])
+            for segment_object in sponsorblock_response.json()
+            if segment_object.get("actionType", "skip") == "skip"
+        )
+    )
@@ -0,0 +1,72 @@
+import os
+import threading
+from pathlib import Path
+from typing import Optional
+
+# One index per thumbnail directory and set of aliases, shared by every request in the process
+_thumbnail_indexes: dict[tuple, "ThumbnailIndex"] = dict()
+_thumbnail_indexes_lock = threading.Lock()
+
+
+# Maps casefolded thumbnail keys to the thumbnail files in a directory. A file is found by its own stem and, through
+# the aliases, by the alias or playlist ID it's paired with. The directory is only scanned again when its mtime changes
+# (adding, removing or renaming a file), so lookups don't touch the directory otherwise
+class ThumbnailIndex:
+    def __init__(self, thumbnail_directory: Path, aliases: dict[str, str]):
+        self.thumbnail_directory = thumbnail_directory
+        self.aliases = aliases
+        self._paths: dict[str, Path] = dict()
+        self._directory_mtime: Optional[int] = None
+        self._is_built = False
+        self._refresh_lock = threading.Lock()
+
+    def _get_directory_mtime(self) -> Optional[int]:
+        try:
+            return self.thumbnail_directory.stat().st_mtime_ns
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+
+    def _scan(self) -> dict[str, Path]:
+        files = dict()
+        if self.thumbnail_directory.is_dir():
+            with os.scandir(self.thumbnail_directory) as entries:
+                # Sorted so the same file wins every time when several share a stem
+                for entry in sorted(entries, key=lambda entry: entry.name):
+                    if entry.is_file():
+                        files.setdefault(
+                            Path(entry.name).stem.casefold(), Path(entry.path)
+                        )
+        paths = dict(files)
+        # A key's own file takes precedence over its alias's (or playlist's) file
+        for alias, target in self.aliases.items():
+            alias_key, target_key = alias.casefold(), target.casefold()
+            if alias_key not in paths and target_key in files:
+                paths[alias_key] = files[target_key]
+            if target_key not in paths and alias_key in files:
+                paths[target_key] = files[alias_key]
+        return paths
+
+    def refresh(self) -> None:
+        with self._refresh_lock:
+            # The mtime is read before scanning, so a change made during the scan triggers another one
+            directory_mtime = self._get_directory_mtime()
+            if self._is_built and directory_mtime == self._directory_mtime:
+                return
+            self._paths = self._scan()
+            self._directory_mtime = directory_mtime
+            self._is_built = True
+
+    def get(self, thumbnail_key: str) -> Optional[Path]:
+        if not self._is_built or self._get_directory_mtime() != self._directory_mtime:
+            self.refresh()
+        return self._paths.get(thumbnail_key.casefold())
+
+
+def get_thumbnail_index(data_path: Path, aliases: dict[str, str]) -> ThumbnailIndex:
+    index_key = (data_path, tuple(sorted(aliases.items())))
+    with _thumbnail_indexes_lock:
+        thumbnail_index = _thumbnail_indexes.get(index_key)
+        if thumbnail_index is None:
+            thumbnail_index = ThumbnailIndex(data_path / "thumbnails", aliases)
+            _thumbnail_indexes[index_key] = thumbnail_index
+    return thumbnail_index
@@ -0,0 +1,94 @@
+import hashlib
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Optional
+
+from PIL import Image, ImageOps
+
+# Formats to the file extension and mimetype of their variants
+THUMBNAIL_FORMATS = {"jpeg": ("jpg", "image/jpeg"), "webp": ("webp", "image/webp")}
+DEFAULT_THUMBNAIL_FORMAT = "jpeg"
+# Requested sizes are rounded up to one of these (or the configured artwork size), so there are only a handful of
+# variants of each thumbnail on disk no matter what sizes clients ask for
+THUMBNAIL_SIZES = (150, 300, 600, 1400, 3000)
+JPEG_QUALITY = 85
+WEBP_QUALITY = 80
+# JPEG has no transparency, so transparent artwork is flattened onto this
+JPEG_BACKGROUND_COLOR = (255, 255, 255)
+
+
+def get_thumbnail_fingerprint(thumbnail_path: Path) -> str:
+    # Changes whenever the thumbnail is replaced, so it's part of variant names, ETags and versioned thumbnail URLs
+    stat = thumbnail_path.stat()
+    return hashlib.sha256(
+        f"{thumbnail_path.name}:{stat.st_size}:{stat.st_mtime_ns}".encode()
+    ).hexdigest()[:16]
+
+
+def get_thumbnail_size(requested_size: int, artwork_size: int) -> int:
+    sizes = sorted({*THUMBNAIL_SIZES, artwork_size})
+    return next((size for size in sizes if size >= requested_size), sizes[-1])
+
+
+def get_thumbnail_etag(fingerprint: str, size: int, thumbnail_format: str) -> str:
+    return f"{fingerprint}-{size}-{thumbnail_format}"
+
+
+def encode_thumbnail(
+    thumbnail_path: Path, output_path: Path, size: int, thumbnail_format: str
+) -> None:
+    with Image.open(thumbnail_path) as image:
+        # Phones often save the orientation separately from the pixels, and it's lost when re-encoding
+        image = ImageOps.exif_transpose(image)
+        # Thumbnails are only ever shrunk, keeping their aspect ratio
+        image.thumbnail((size, size), Image.Resampling.LANCZOS)
+        if thumbnail_format == "jpeg":
+            if image.mode in ("RGBA", "LA", "P"):
+                image = image.convert("RGBA")
+                background = Image.new("RGB", image.size, JPEG_BACKGROUND_COLOR)
+                background.paste(image, mask=image.getchannel("A"))
+                image = background
+            image.convert("RGB").save(
+                output_path,
+                format="JPEG",
+                quality=JPEG_QUALITY,
+                optimize=True,
+                progressive=True,
+            )
+        else:
+            image.save(output_path, format="WEBP", quality=WEBP_QUALITY)
+
+
+def get_thumbnail_variant(
+    thumbnail_path: Path, data_path: Path, size: int, thumbnail_format: str
+) -> Optional[Path]:
+    # Returns the thumbnail resized to fit in size x size and re-encoded, creating it the first time it's requested.
+    # Returns None if the thumbnail isn't an image Pillow can read, in which case it's served as it is
+    variant_directory = (
+        data_path / "thumbnail-variants" / thumbnail_path.stem.casefold()
+    )
+    fingerprint = get_thumbnail_fingerprint(thumbnail_path)
+    extension, _ = THUMBNAIL_FORMATS[thumbnail_format]
+    variant_path = variant_directory / f"{fingerprint}.{size}.{extension}"
+    if variant_path.exists():
+        return variant_path
+    variant_directory.mkdir(parents=True, exist_ok=True)
+    # Workers that create the same variant at the same time each write their own file, and the last one to finish wins
+    encoding_path = variant_path.with_name(
+        f"{variant_path.name}.{os.getpid()}-{threading.get_ident()}.tmp"
+    )
+    try:
+        encode_thumbnail(thumbnail_path, encoding_path, size, thumbnail_format)
+        os.replace(encoding_path, variant_path)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        logging.exception(f"Failed to resize thumbnail {thumbnail_path.name}")
+        return None
+    finally:
+        encoding_path.unlink(missing_ok=True)
+    # Variants of an earlier version of the thumbnail are never requested again
+    for stale_variant_path in variant_directory.iterdir():
+        if not stale_variant_path.name.startswith(f"{fingerprint}."):
+            stale_variant_path.unlink(missing_ok=True)
+    return variant_path
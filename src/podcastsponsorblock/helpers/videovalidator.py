@@ -0,0 +1,122 @@
+import threading
+import time
+from concurrent.futures import Future
+from datetime import timedelta
+from pathlib import Path
+from typing import Iterable, Optional
+
+from .database import get_database_connection, transaction
+from .youtubeclientpool import get_youtube_client
+
+VALID_VIDEO_TTL = timedelta(days=1)
+INVALID_VIDEO_TTL = timedelta(minutes=10)
+# How long the first request of a batch waits for other requests to join it
+BATCH_WINDOW_SECONDS = 0.05
+# The most IDs videos.list accepts in one call
+MAX_BATCH_SIZE = 50
+VALIDATION_TIMEOUT_SECONDS = 30
+
+
+# Checks that video IDs exist on YouTube. Results are cached in the shared sqlite database (so every gunicorn worker
+# benefits from them), IDs that were part of a generated feed are trusted without asking YouTube, and IDs that do need
+# checking are grouped into a single videos.list call
+class VideoValidator:
+    def __init__(self, data_path: Path, youtube_api_key: str):
+        self.data_path = data_path
+        self.youtube_api_key = youtube_api_key
+        self._pending_validations: dict[str, Future] = dict()
+        self._pending_validations_lock = threading.Lock()
+        self._batch_scheduled = False
+        self._connection().execute("""
+            CREATE TABLE IF NOT EXISTS video_validations (
+                video_id TEXT PRIMARY KEY,
+                is_valid INTEGER NOT NULL,
+                expires_at REAL NOT NULL
+            )
+            """)
+
+    def _connection(self):
+        return get_database_connection(self.data_path)
+
+    def _store_results(self, results: dict[str, bool]) -> None:
+        now = time.time()
+        with transaction(self._connection()) as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO video_validations (video_id, is_valid, expires_at) VALUES (?, ?, ?)",
+                (
+                    (
+                        video_id,
+                        is_valid,
+                        now
+                        + (
+                            VALID_VIDEO_TTL if is_valid else INVALID_VIDEO_TTL
+                        ).total_seconds(),
+                    )
+                    for video_id, is_valid in results.items()
+                ),
+            )
+
+    def _get_cached_result(self, video_id: str) -> Optional[bool]:
+        row = (
+            self._connection()
+            .execute(
+                "SELECT is_valid FROM video_validations WHERE video_id = ? AND expires_at > ?",
+                (video_id, time.time()),
+            )
+            .fetchone()
+        )
+        return None if row is None else bool(row["is_valid"])
+
+    def remember_valid_video_ids(self, video_ids: Iterable[str]) -> None:
+        self._store_results({video_id: True for video_id in video_ids})
+
+    def _request_existing_video_ids(self, video_ids: Iterable[str]) -> set[str]:
+        youtube_client = get_youtube_client(self.youtube_api_key)
+        # noinspection PyUnresolvedReferences
+        video_request = youtube_client.videos().list(
+            part="id", id=",".join(video_ids), maxResults=MAX_BATCH_SIZE
+        )
+        video_response = video_request.execute()
+        return {video_object["id"] for video_object in video_response["items"]}
+
+    def _take_batch(self) -> dict[str, Future]:
+        with self._pending_validations_lock:
+            batch = dict()
+            for video_id in tuple(self._pending_validations.keys())[:MAX_BATCH_SIZE]:
+                batch[video_id] = self._pending_validations.pop(video_id)
+            if len(batch) == 0:
+                self._batch_scheduled = False
+            return batch
+
+    def _run_batches(self) -> None:
+        batch = self._take_batch()
+        while len(batch) > 0:
+            try:
+                existing_video_ids = self._request_existing_video_ids(batch.keys())
+                results = {
+                    video_id: video_id in existing_video_ids for video_id in batch
+                }
+                self._store_results(results)
+            except Exception as exception:
+                for future in batch.values():
+                    future.set_exception(exception)
+            else:
+                for video_id, future in batch.items():
+                    future.set_result(results[video_id])
+            batch = self._take_batch()
+
+    def validate(self, video_id: str) -> Optional[str]:
+        is_valid = self._get_cached_result(video_id)
+        if is_valid is None:
+            with self._pending_validations_lock:
+                future = self._pending_validations.get(video_id)
+                if future is None:
+                    future = self._pending_validations[video_id] = Future()
+                run_batches = not self._batch_scheduled
+                self._batch_scheduled = True
+            # The first request to need validation runs the batches for everyone that joins while it waits
+            if run_batches:
+                time.sleep(BATCH_WINDOW_SECONDS)
+                self._run_batches()
+            is_valid = future.result(timeout=VALIDATION_TIMEOUT_SECONDS)
+        return video_id if is_valid else None
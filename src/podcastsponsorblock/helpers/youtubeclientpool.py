@@ -0,0 +1,64 @@
+import logging
+import threading
+import time
+from typing import TYPE_CHECKING
+
+import httplib2
+from googleapiclient.discovery import build as build_google_api_client
+from googleapiclient.http import HttpRequest
+
+from .apiurls import get_api_urls
+from .metrics import increment_counter
+
+if TYPE_CHECKING:
+    import googleapiclient
+
+    YoutubeClient = googleapiclient.discovery.Resource
+
+HTTP_TIMEOUT_SECONDS = 30
+
+# httplib2 (and so the clients built on it) isn't thread-safe, so every thread gets its own client. Each client keeps
+# its connection to the API open between requests
+_thread_local_clients = threading.local()
+
+
+# Counts every API call by its method (e.g. youtube.playlistItems.list), since each one uses up some of the API key's
+# daily quota. Calls are counted when they're made, whether or not they succeed
+class CountedHttpRequest(HttpRequest):
+    def execute(self, *args, **kwargs):
+        increment_counter("podcast_youtube_api_calls_total", {"method": self.methodId})
+        return super().execute(*args, **kwargs)
+
+
+def get_youtube_client(youtube_api_key: str) -> "YoutubeClient":
+    clients = getattr(_thread_local_clients, "clients", None)
+    if clients is None:
+        clients = _thread_local_clients.clients = dict()
+    youtube_client = clients.get(youtube_api_key)
+    # Every reuse skips a build, so reuses times the average build time is roughly the time the pool has saved
+    if youtube_client is not None:
+        increment_counter("podcast_youtube_client_reuses_total")
+        return youtube_client
+    build_started_at = time.perf_counter()
+    youtube_api_url = get_api_urls().youtube_api_url
+    youtube_client = build_google_api_client(
+        "youtube",
+        "v3",
+        developerKey=youtube_api_key,
+        cache_discovery=False,
+        http=httplib2.Http(timeout=HTTP_TIMEOUT_SECONDS),
+        requestBuilder=CountedHttpRequest,
+        client_options=(
+            {"api_endpoint": youtube_api_url} if youtube_api_url is not None else None
+        ),
+    )
+    build_seconds = time.perf_counter() - build_started_at
+    increment_counter("podcast_youtube_client_builds_total")
+    increment_counter(
+        "podcast_youtube_client_build_seconds_total", amount=build_seconds
+    )
+    logging.debug(
+        f"Built YouTube client for {threading.current_thread().name} in {build_seconds * 1000:.1f}ms"
+    )
+    clients[youtube_api_key] = youtube_client
+    return youtube_client
@@ -1,22 +1,30 @@
 import logging
+import time
 from datetime import timedelta
-from operator import attrgetter
-from typing import Iterable, Optional, Sequence, TYPE_CHECKING, Any, Callable, Hashable
+from typing import Iterable, Optional, Sequence, TYPE_CHECKING
 
-from cachetools import cached, TTLCache
 from cachetools.keys import hashkey
 from dateutil.parser import isoparse as parse_iso_date
 from flask import url_for
+from googleapiclient.errors import HttpError
 
 from .. import views
-from ..models import ItemDetails, EpisodeDetails, Author, FeedOptions
-
-from googleapiclient.discovery import build as build_google_api_client
+from ..models import (
+    ItemDetails,
+    EpisodeDetails,
+    Author,
+    FeedOptions,
+    PlaylistSyncState,
+    EpisodeWindow,
+)
+from .youtubeclientpool import get_youtube_client
+from .requesttiming import timing_span
+from .sharedcache import SharedTTLCache, shared_cached
+from .episodestore import EpisodeStore
+from .thumbnailvariants import get_thumbnail_fingerprint
 
 if TYPE_CHECKING:
-    import googleapiclient
-
-    YoutubeClient = googleapiclient.discovery.Resource
+    from .youtubeclientpool import YoutubeClient
 
 
 def get_best_thumbnail_url(thumbnails: dict) -> str:
@@ -67,6 +75,22 @@ def get_playlist_details(
     )
 
 
+@shared_cached(
+    SharedTTLCache(
+        "playlist_details", ttl=timedelta(minutes=60), max_stale=timedelta(days=1)
+    ),
+    key=lambda _, playlist_id: hashkey(playlist_id),
+)
+def get_playlist_details_cached(youtube_api_key: str, playlist_id: str) -> ItemDetails:
+    playlist_details = get_playlist_details(
+        get_youtube_client(youtube_api_key), playlist_id
+    )
+    # Missing playlists raise instead of returning None so that they aren't cached
+    if playlist_details is None:
+        raise ValueError("Playlist does not exist")
+    return playlist_details
+
+
 def create_episode_details(playlist_item: dict) -> "EpisodeDetails":
     video_details = playlist_item["snippet"]
     return EpisodeDetails(
@@ -82,97 +106,280 @@ def create_episode_details(playlist_item: dict) -> "EpisodeDetails":
 UNAVAILABLE_STATUSES = ("private", "privacyStatusUnspecified")
 
 
-def remove_unavailable_items(playlist_items: Sequence[dict]) -> Sequence[dict]:
-    return tuple(
-        item
-        for item in playlist_items
-        if item["status"]["privacyStatus"] not in UNAVAILABLE_STATUSES
-    )
+PLAYLIST_PAGE_SIZE = 50
+FULL_SYNC_INTERVAL = timedelta(days=1)
+_playlist_sync_states = SharedTTLCache("playlist_sync_states", ttl=timedelta(days=30))
 
 
-def remove_duplicates(
-    objects: Sequence[Any], key_getter: Callable[[Any], Hashable]
-) -> Sequence[Any]:
-    unique_object_dict = {key_getter(obj): obj for obj in objects}
-    return tuple(unique_object_dict.values())
+def is_available(playlist_item: dict) -> bool:
+    return playlist_item["status"]["privacyStatus"] not in UNAVAILABLE_STATUSES
 
 
-@cached(
-    TTLCache(maxsize=1024, ttl=timedelta(minutes=60).total_seconds()),
-    key=lambda _, playlist_details: hashkey(playlist_details.id),
-)
-def get_episodes_cached(
-    youtube_client: "YoutubeClient", playlist_details: ItemDetails
-) -> Sequence[EpisodeDetails]:
-    logging.info(f"Grabbing episodes from YouTube playlist {playlist_details.id}")
-    all_playlist_items = []
+def request_playlist_items_page(
+    youtube_client: "YoutubeClient",
+    playlist_id: str,
+    page_token: Optional[str],
+    etag: Optional[str] = None,
+) -> Optional[dict]:
     # noinspection PyUnresolvedReferences
-    playlist_items_endpoint = youtube_client.playlistItems()
-    playlist_items_request = playlist_items_endpoint.list(
-        part="snippet,status", playlistId=playlist_details.id, maxResults=50
+    playlist_items_request = youtube_client.playlistItems().list(
+        part="snippet,status",
+        playlistId=playlist_id,
+        maxResults=PLAYLIST_PAGE_SIZE,
+        pageToken=page_token,
     )
-    continue_requesting_playlist_items = True
-    while continue_requesting_playlist_items:
+    if etag is not None:
+        playlist_items_request.headers["If-None-Match"] = etag
+    try:
         playlist_items_response = playlist_items_request.execute()
-        all_playlist_items += playlist_items_response["items"]
-        playlist_items_request = playlist_items_endpoint.list_next(
-            playlist_items_request, playlist_items_response
+    except HttpError as exception:
+        if exception.resp.status == 304:
+            return None
+        raise
+    if etag is not None and playlist_items_response.get("etag") == etag:
+        return None
+    return playlist_items_response
+
+
+def merge_playlist_items(
+    sync_state: PlaylistSyncState, playlist_items: Sequence[dict]
+) -> None:
+    for playlist_item in playlist_items:
+        video_id = playlist_item["snippet"]["resourceId"]["videoId"]
+        sync_state.known_video_ids.add(video_id)
+        if is_available(playlist_item):
+            sync_state.episodes[video_id] = create_episode_details(playlist_item)
+        else:
+            sync_state.episodes.pop(video_id, None)
+
+
+def request_remaining_pages(
+    youtube_client: "YoutubeClient",
+    sync_state: PlaylistSyncState,
+    first_page_index: int,
+    first_page_response: dict,
+) -> Sequence[dict]:
+    playlist_items = list(first_page_response["items"])
+    page_index = first_page_index
+    next_page_token = first_page_response.get("nextPageToken")
+    while next_page_token is not None:
+        page_index += 1
+        del sync_state.page_tokens[page_index:]
+        sync_state.page_tokens.append(next_page_token)
+        playlist_items_response = request_playlist_items_page(
+            youtube_client, sync_state.playlist_id, next_page_token
         )
-        continue_requesting_playlist_items = playlist_items_request is not None
-    sorted_playlist_episodes = sorted(
-        map(create_episode_details, remove_unavailable_items(all_playlist_items)),
-        key=attrgetter("published_at"),
+        playlist_items += playlist_items_response["items"]
+        next_page_token = playlist_items_response.get("nextPageToken")
+    return playlist_items
+
+
+def sync_playlist_fully(
+    youtube_client: "YoutubeClient", playlist_id: str
+) -> PlaylistSyncState:
+    logging.info(f"Grabbing all episodes from YouTube playlist {playlist_id}")
+    first_page_response = request_playlist_items_page(youtube_client, playlist_id, None)
+    sync_state = PlaylistSyncState(
+        playlist_id=playlist_id,
+        total_results=first_page_response["pageInfo"]["totalResults"],
+        first_page_etag=first_page_response["etag"],
+        page_tokens=[None],
+        known_video_ids=set(),
+        episodes=dict(),
+        full_synced_at=time.time(),
+    )
+    merge_playlist_items(
+        sync_state,
+        request_remaining_pages(youtube_client, sync_state, 0, first_page_response),
     )
-    return remove_duplicates(sorted_playlist_episodes, attrgetter("id"))
+    return sync_state
 
 
-@cached(
-    TTLCache(maxsize=1024, ttl=timedelta(minutes=60).total_seconds()),
+def sync_playlist_incrementally(
+    youtube_client: "YoutubeClient", sync_state: PlaylistSyncState
+) -> bool:
+    # The first page's ETag covers the playlist's total item count, so it only matches when nothing was added or
+    # removed and the newest page is unchanged. Items added at either end of the playlist are fetched and merged in.
+    # Anything else (removals or reordering) needs a full sync, which returns False. Changes that leave the total and
+    # the first page as they were (e.g. an item removed further down and another added at the end) aren't noticed
+    # until the next full sync, at most FULL_SYNC_INTERVAL later
+    first_page_response = request_playlist_items_page(
+        youtube_client,
+        sync_state.playlist_id,
+        None,
+        etag=sync_state.first_page_etag,
+    )
+    if first_page_response is None:
+        logging.info(f"YouTube playlist {sync_state.playlist_id} is unchanged")
+        return True
+    added_item_count = (
+        first_page_response["pageInfo"]["totalResults"] - sync_state.total_results
+    )
+    if added_item_count < 0:
+        return False
+    first_page_new_items = tuple(
+        playlist_item
+        for playlist_item in first_page_response["items"]
+        if playlist_item["snippet"]["resourceId"]["videoId"]
+        not in sync_state.known_video_ids
+    )
+    if len(first_page_new_items) == added_item_count:
+        new_items = first_page_response["items"]
+    elif len(first_page_new_items) == 0:
+        last_page_index = max(sync_state.total_results - 1, 0) // PLAYLIST_PAGE_SIZE
+        if last_page_index >= len(sync_state.page_tokens):
+            return False
+        last_page_response = request_playlist_items_page(
+            youtube_client,
+            sync_state.playlist_id,
+            sync_state.page_tokens[last_page_index],
+        )
+        new_items = (
+            *first_page_response["items"],
+            *request_remaining_pages(
+                youtube_client, sync_state, last_page_index, last_page_response
+            ),
+        )
+        if (
+            len(
+                {
+                    playlist_item["snippet"]["resourceId"]["videoId"]
+                    for playlist_item in new_items
+                }
+                - sync_state.known_video_ids
+            )
+            != added_item_count
+        ):
+            return False
+    else:
+        return False
+    logging.info(
+        f"Merging {added_item_count} new items into YouTube playlist {sync_state.playlist_id}"
+    )
+    merge_playlist_items(sync_state, new_items)
+    sync_state.total_results = first_page_response["pageInfo"]["totalResults"]
+    sync_state.first_page_etag = first_page_response["etag"]
+    return True
+
+
+def sync_playlist(
+    youtube_client: "YoutubeClient", playlist_id: str
+) -> PlaylistSyncState:
+    sync_state = _playlist_sync_states.get(hashkey(playlist_id))
+    if (
+        sync_state is None
+        or time.time() - sync_state.full_synced_at >= FULL_SYNC_INTERVAL.total_seconds()
+        or not sync_playlist_incrementally(youtube_client, sync_state)
+    ):
+        sync_state = sync_playlist_fully(youtube_client, playlist_id)
+    _playlist_sync_states[hashkey(playlist_id)] = sync_state
+    return sync_state
+
+
+# Pollers keep getting the episodes from the last sync while an expired sync is redone in the background, unless it's
+# been out of date for longer than max_stale
+@shared_cached(
+    SharedTTLCache(
+        "episode_syncs", ttl=timedelta(minutes=60), max_stale=timedelta(hours=6)
+    ),
+    key=lambda _, __, playlist_details: hashkey(playlist_details.id),
+)
+def sync_episodes_cached(
+    youtube_api_key: str,
+    episode_store: EpisodeStore,
+    playlist_details: ItemDetails,
+) -> int:
+    # The episodes themselves live in the episode store, so only the episode count is cached. Expired syncs are redone
+    # on another thread, so the client is looked up here rather than passed in: clients can't be shared between threads
+    sync_state = sync_playlist(get_youtube_client(youtube_api_key), playlist_details.id)
+    episode_store.replace_episodes(playlist_details.id, sync_state.episodes.values())
+    return len(sync_state.episodes)
+
+
+@shared_cached(
+    SharedTTLCache("logos", ttl=timedelta(minutes=60), max_stale=timedelta(days=1)),
     key=lambda _, __, playlist_details: hashkey(playlist_details.id),
 )
 def get_logo_cached(
-    youtube_client: "YoutubeClient",
+    youtube_api_key: str,
     feed_options: FeedOptions,
     playlist_details: ItemDetails,
 ) -> str:
     thumbnail_path = views.get_thumbnail_path(playlist_details.id, feed_options)
     if thumbnail_path is None:
         channel_details = get_channel_details(
-            youtube_client, playlist_details.author.id
+            get_youtube_client(youtube_api_key), playlist_details.author.id
         )
         return channel_details.icon_url
     else:
+        # The resized variant is versioned with the thumbnail's fingerprint, so podcast apps can cache it for good and
+        # still pick up a replaced thumbnail when the feed next changes
+        url_args = {
+            "size": feed_options.service_config.artwork_size,
+            "v": get_thumbnail_fingerprint(thumbnail_path),
+        }
         if feed_options.service_config.append_auth_param_to_resource_links:
-            return url_for(
-                "thumbnail_view",
-                thumbnail_key=playlist_details.id,
-                key=feed_options.service_config.auth_key,
-            )
-        return url_for("thumbnail_view", thumbnail_key=playlist_details.id)
+            url_args["key"] = feed_options.service_config.auth_key
+        return url_for("thumbnail_view", thumbnail_key=playlist_details.id, **url_args)
+
+
+def refresh_playlist(playlist_id: str, feed_options: FeedOptions) -> None:
+    # Reloads everything a playlist's feed needs from YouTube into the shared caches, even if it hasn't expired yet.
+    # Building the logo URL needs a request context
+    youtube_api_key = feed_options.service_config.youtube_api_key
+    playlist_details = get_playlist_details_cached.refresh(youtube_api_key, playlist_id)
+    sync_episodes_cached.refresh(
+        youtube_api_key,
+        EpisodeStore(feed_options.service_config.data_path),
+        playlist_details,
+    )
+    get_logo_cached.refresh(youtube_api_key, feed_options, playlist_details)
 
 
 class YoutubePlaylistEpisodeFeed:
     def __init__(self, playlist_id: str, feed_options: FeedOptions):
         self.feed_options = feed_options
-        self.youtube_client = build_google_api_client(
-            "youtube",
-            "v3",
-            developerKey=self.feed_options.service_config.youtube_api_key,
-            cache_discovery=False,
-        )
-        self.playlist_details = get_playlist_details(self.youtube_client, playlist_id)
-        if self.playlist_details is None:
-            raise ValueError("Playlist does not exist")
+        with timing_span("playlist"):
+            self.playlist_details = get_playlist_details_cached(
+                self.feed_options.service_config.youtube_api_key, playlist_id
+            )
 
     @property
     def logo(self) -> str:
-        return get_logo_cached(
-            self.youtube_client, self.feed_options, self.playlist_details
-        )
+        with timing_span("logo"):
+            return get_logo_cached(
+                self.feed_options.service_config.youtube_api_key,
+                self.feed_options,
+                self.playlist_details,
+            )
+
+    @property
+    def episode_store(self) -> EpisodeStore:
+        return EpisodeStore(self.feed_options.service_config.data_path)
+
+    def sync_episodes(self) -> None:
+        with timing_span("episode-sync"):
+            sync_episodes_cached(
+                self.feed_options.service_config.youtube_api_key,
+                self.episode_store,
+                self.playlist_details,
+            )
+
+    def get_episodes(
+        self, window: EpisodeWindow = EpisodeWindow()
+    ) -> Sequence[EpisodeDetails]:
+        # Newest first
+        self.sync_episodes()
+        return self.episode_store.get_episodes(self.playlist_details.id, window)
+
+    def count_episodes(self, window: EpisodeWindow = EpisodeWindow()) -> int:
+        self.sync_episodes()
+        return self.episode_store.count_episodes(self.playlist_details.id, window)
 
     @property
     def episodes(self) -> Sequence[EpisodeDetails]:
-        return get_episodes_cached(self.youtube_client, self.playlist_details)
+        # Oldest first
+        return tuple(reversed(self.get_episodes()))
 
     def __iter__(self) -> Iterable[EpisodeDetails]:
         return iter(self.episodes)
@@ -1,14 +1,53 @@
 import json
 import logging
 import os
+import time
 from configparser import ConfigParser
+from datetime import timedelta
 from pathlib import Path
-from typing import Optional, MutableMapping, Sequence
+from typing import Iterable, Iterator, Optional, MutableMapping, Sequence
 
-from flask import Flask, request, Response, Request
+from flask import Flask, request, Response, Request, current_app, g
 
-from .models import ServiceConfig, PodcastConfig
-from .views import YoutubeMediaView, YoutubeRSSView, ThumbnailView
+from .models import ServiceConfig, PodcastConfig, ApiUrls
+from .views import (
+    YoutubeMediaView,
+    YoutubeRSSView,
+    ThumbnailView,
+    DownloadStatusView,
+    is_audio_downloaded,
+    download_audio,
+    check_sponsor_segments,
+    is_download_complete,
+    clean_up_partial_files,
+    CacheStatusView,
+    refresh_configured_feeds,
+    MetricsView,
+)
+from .helpers import (
+    DownloadQueue,
+    start_periodic_task,
+    prefetch_new_episodes,
+    is_prefetch_enabled,
+    VideoValidator,
+    configure_shared_cache,
+    normalize_categories,
+    AudioCache,
+    EVICTION_INTERVAL,
+    FILE_SERVING_MODES,
+    FILE_SERVING_DIRECT,
+    get_thumbnail_index,
+    MAX_ARTWORK_SIZE,
+    configure_metrics,
+    configure_api_urls,
+    increment_counter,
+    observe_histogram,
+    REQUEST_DURATION_BUCKETS,
+    get_timing_spans,
+    format_server_timing,
+    log_slow_request,
+    is_timed_until_response_headers,
+)
 
 
 def initialize_authorization(
@@ -34,6 +73,89 @@ def initialize_authorization(
             )
 
 
+def count_sent_bytes(
+    chunks: Iterable[bytes], labels: dict[str, str]
+) -> Iterator[bytes]:
+    sent_bytes = 0
+    try:
+        for chunk in chunks:
+            sent_bytes += len(chunk)
+            yield chunk
+    finally:
+        increment_counter("podcast_response_bytes_total", labels, sent_bytes)
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+
+def get_view_name() -> Optional[str]:
+    view_function = current_app.view_functions.get(request.endpoint)
+    view_class = getattr(view_function, "view_class", None)
+    return view_class.__name__ if view_class is not None else None
+
+
+def initialize_request_metrics(app: Flask) -> None:
+    # Registered before authentication, so rejected requests are measured too
+    @app.before_request
+    def start_request_timer():
+        g.request_started_at = time.perf_counter()
+
+    @app.after_request
+    def record_request_metrics(response: Response) -> Response:
+        started_at = g.get("request_started_at", time.perf_counter())
+        labels = {"view": get_view_name() or "none"}
+        if request.method != "HEAD":
+            # Feeds and streaming downloads are counted as they're written. Files have a known length (which the
+            # reverse proxy sends instead when it's handed off)
+            if response.is_streamed and not response.direct_passthrough:
+                response.response = count_sent_bytes(response.response, labels)
+            elif response.content_length is not None:
+                increment_counter(
+                    "podcast_response_bytes_total", labels, response.content_length
+                )
+        # Streamed responses are only finished once the server closes them
+        response.call_on_close(
+            lambda: observe_histogram(
+                "podcast_request_duration_seconds",
+                labels,
+                time.perf_counter() - started_at,
+                REQUEST_DURATION_BUCKETS,
+            )
+        )
+        return response
+
+
+def initialize_request_timing(app: Flask, slow_request_threshold: float) -> None:
+    # Registered after initialize_request_metrics, whose timer it shares
+    @app.after_request
+    def report_request_timing(response: Response) -> Response:
+        started_at = g.get("request_started_at", time.perf_counter())
+        # Spans recorded while a streamed response is written are added to this after the header is sent, so they
+        # only show up in the slow request log
+        timing_spans = get_timing_spans()
+        response.headers["Server-Timing"] = format_server_timing(
+            {**timing_spans, "app": time.perf_counter() - started_at}
+        )
+        if slow_request_threshold == 0:
+            return response
+        method, path, view, status = (
+            request.method,
+            request.path,
+            get_view_name(),
+            response.status_code,
+        )
+
+        def log_if_slow(finished_at: float) -> None:
+            duration = finished_at - started_at
+            if duration >= slow_request_threshold:
+                log_slow_request(method, path, view, status, duration, timing_spans)
+
+        if is_timed_until_response_headers():
+            log_if_slow(time.perf_counter())
+        else:
+            response.call_on_close(lambda: log_if_slow(time.perf_counter()))
+        return response
+
+
 def is_true(value: Optional[str]) -> bool:
     return value is not None and value.casefold() == "true".casefold()
 
@@ -47,6 +169,12 @@ def parse_aliases(source: MutableMapping) -> dict[str, str]:
     return aliases
 
 
+def parse_optional_float(value: Optional[str]) -> Optional[float]:
+    if value is not None and value != "":
+        return float(value)
+    return None
+
+
 def parse_comma_seperated_value(hostname_str: Optional[str]) -> Sequence[str]:
     if hostname_str is not None:
         return hostname_str.split(",")
@@ -68,12 +196,44 @@ def parse_podcast_configs(config_path: Path) -> dict[str, PodcastConfig]:
             itunes_category=section_values.get("itunes_category"),
             explicit=section_values.getboolean("explicit"),
             itunes_id=section_values.get("itunes_id"),
+            prefetch_episodes=section_values.getint("prefetch_episodes"),
+            episode_limit=section_values.getint("episode_limit"),
+            episode_window_days=section_values.getint("episode_window_days"),
+            categories_to_remove=(
+                normalize_categories(
+                    parse_comma_seperated_value(section_values["categories_to_remove"])
+                )
+                if "categories_to_remove" in section_values
+                else None
+            ),
         )
     return podcast_configs
 
 
+# Environment variables to the ApiUrls fields they override
+API_URL_VARIABLES = {
+    "PODCAST_YOUTUBE_API_URL": "youtube_api_url",
+    "PODCAST_SPONSORBLOCK_API_URL": "sponsorblock_api_url",
+    "PODCAST_ITUNES_LOOKUP_URL": "itunes_lookup_url",
+    "PODCAST_YOUTUBE_VIDEO_URL_TEMPLATE": "youtube_video_url_template",
+}
+
+
+def parse_api_urls(source: MutableMapping) -> ApiUrls:
+    return ApiUrls(
+        **{
+            field_name: source[variable]
+            for variable, field_name in API_URL_VARIABLES.items()
+            if source.get(variable, "") != ""
+        }
+    )
+
+
 def populate_service_config(source: MutableMapping) -> ServiceConfig:
     data_path = Path(source["PODCAST_DATA_PATH"]).absolute().resolve()
+    audio_cache_max_size_mb = parse_optional_float(
+        source.get("PODCAST_AUDIO_CACHE_MAX_SIZE_MB", None)
+    )
     try:
         return ServiceConfig(
             youtube_api_key=source.pop("PODCAST_YOUTUBE_API_KEY"),
@@ -86,19 +246,67 @@ def populate_service_config(source: MutableMapping) -> ServiceConfig:
                 source.get("PODCAST_APPEND_AUTH_PARAM_TO_RESOURCE_LINKS", None)
             ),
             aliases=parse_aliases(source),
-            categories_to_remove=parse_comma_seperated_value(
-                source.get("PODCAST_CATEGORIES_TO_REMOVE", "sponsor")
+            categories_to_remove=normalize_categories(
+                parse_comma_seperated_value(
+                    source.get("PODCAST_CATEGORIES_TO_REMOVE", "sponsor")
+                )
             ),
             trusted_hosts=parse_comma_seperated_value(
                 source.get("PODCAST_TRUSTED_HOSTS", None)
             ),
             podcast_configs=parse_podcast_configs(data_path / "podcasts.ini"),
+            download_workers=int(source.get("PODCAST_DOWNLOAD_WORKERS", 2)),
+            download_wait_seconds=float(
+                source.get("PODCAST_DOWNLOAD_WAIT_SECONDS", 20)
+            ),
+            prefetch_episodes=int(source.get("PODCAST_PREFETCH_EPISODES", 0)),
+            prefetch_interval_minutes=float(
+                source.get("PODCAST_PREFETCH_INTERVAL_MINUTES", 30)
+            ),
+            prefetch_concurrency=int(source.get("PODCAST_PREFETCH_CONCURRENCY", 1)),
+            feed_max_age_seconds=int(source.get("PODCAST_FEED_MAX_AGE_SECONDS", 300)),
+            streaming_downloads=is_true(
+                source.get("PODCAST_STREAMING_DOWNLOADS", None)
+            ),
+            segment_check_interval_minutes=float(
+                source.get("PODCAST_SEGMENT_CHECK_INTERVAL_MINUTES", 60)
+            ),
+            segment_check_days=float(source.get("PODCAST_SEGMENT_CHECK_DAYS", 7)),
+            audio_cache_max_bytes=(
+                int(audio_cache_max_size_mb * 1024 * 1024)
+                if audio_cache_max_size_mb is not None
+                else None
+            ),
+            audio_cache_max_age_days=parse_optional_float(
+                source.get("PODCAST_AUDIO_CACHE_MAX_AGE_DAYS", None)
+            ),
+            file_serving_mode=source.get(
+                "PODCAST_FILE_SERVING_MODE", FILE_SERVING_DIRECT
+            ).lower(),
+            file_serving_prefix=source.get(
+                "PODCAST_FILE_SERVING_PREFIX", "/podcast-sponsor-block-data"
+            ),
+            artwork_size=int(source.get("PODCAST_ARTWORK_SIZE", 1400)),
+            feed_refresh_interval_minutes=float(
+                source.get("PODCAST_FEED_REFRESH_INTERVAL_MINUTES", 30)
+            ),
+            feed_refresh_concurrency=int(
+                source.get("PODCAST_FEED_REFRESH_CONCURRENCY", 2)
+            ),
+            slow_request_threshold_seconds=float(
+                source.get("PODCAST_SLOW_REQUEST_THRESHOLD_SECONDS", 5)
+            ),
+            api_urls=parse_api_urls(source),
         )
     except KeyError as exception:
         # noinspection PyUnresolvedReferences
         raise ValueError(f"Missing configuration value: {exception}")
 
 
+# The fraction of the feed refresh interval that's randomly added to it
+FEED_REFRESH_JITTER = 0.1
+
+
 def log_service_config(config: ServiceConfig) -> None:
     logging.info(f"Loaded configuration:")
     logging.info(f"  - Data path: {config.data_path}")
@@ -116,6 +324,30 @@ def log_service_config(config: ServiceConfig) -> None:
     logging.info(
         f"  - Append auth parameter to resource links: {config.append_auth_param_to_resource_links}"
     )
+    logging.info(f"  - Download workers: {config.download_workers}")
+    logging.info(f"  - Download wait seconds: {config.download_wait_seconds}")
+    logging.info(f"  - Episodes to prefetch: {config.prefetch_episodes}")
+    logging.info(f"  - Prefetch interval minutes: {config.prefetch_interval_minutes}")
+    logging.info(f"  - Prefetch concurrency: {config.prefetch_concurrency}")
+    logging.info(f"  - Feed max age seconds: {config.feed_max_age_seconds}")
+    logging.info(f"  - Streaming downloads: {config.streaming_downloads}")
+    logging.info(
+        f"  - Segment check interval minutes: {config.segment_check_interval_minutes}"
+    )
+    logging.info(f"  - Segment check days: {config.segment_check_days}")
+    logging.info(f"  - Audio cache max bytes: {config.audio_cache_max_bytes}")
+    logging.info(f"  - Audio cache max age days: {config.audio_cache_max_age_days}")
+    logging.info(f"  - File serving mode: {config.file_serving_mode}")
+    logging.info(f"  - File serving prefix: {config.file_serving_prefix}")
+    logging.info(f"  - Artwork size: {config.artwork_size}")
+    logging.info(
+        f"  - Feed refresh interval minutes: {config.feed_refresh_interval_minutes}"
+    )
+    logging.info(f"  - Feed refresh concurrency: {config.feed_refresh_concurrency}")
+    logging.info(
+        f"  - Slow request threshold seconds: {config.slow_request_threshold_seconds}"
+    )
+    logging.info(f"  - API URLs: {config.api_urls}")
 
 
 def create_app() -> Flask:
@@ -129,8 +361,93 @@ def create_app() -> Flask:
         raise ValueError(
             "Cannot append auth param to resource links when query auth is not allowed"
         )
+    if config.file_serving_mode not in FILE_SERVING_MODES:
+        raise ValueError(
+            f"The file serving mode must be one of {', '.join(FILE_SERVING_MODES)}"
+        )
+    if config.download_workers < 1:
+        raise ValueError("There must be at least one download worker")
+    if config.download_wait_seconds < 0:
+        raise ValueError("The download wait time cannot be negative")
+    if config.prefetch_concurrency < 1:
+        raise ValueError("The prefetch concurrency must be at least one")
+    if config.feed_refresh_concurrency < 1:
+        raise ValueError("The feed refresh concurrency must be at least one")
+    if config.slow_request_threshold_seconds < 0:
+        raise ValueError("The slow request threshold cannot be negative")
+    if "{video_id}" not in config.api_urls.youtube_video_url_template:
+        raise ValueError("The YouTube video URL template must contain {video_id}")
+    if not 1 <= config.artwork_size <= MAX_ARTWORK_SIZE:
+        raise ValueError(
+            f"The artwork size must be between 1 and {MAX_ARTWORK_SIZE} pixels"
+        )
+    for podcast_config in config.podcast_configs.values():
+        if (
+            podcast_config.episode_limit is not None
+            and podcast_config.episode_limit < 1
+        ):
+            raise ValueError(
+                f"The episode limit of {podcast_config.id} must be at least one"
+            )
+        if (
+            podcast_config.episode_window_days is not None
+            and podcast_config.episode_window_days < 1
+        ):
+            raise ValueError(
+                f"The episode window of {podcast_config.id} must be at least one day"
+            )
     log_service_config(config)
     app.config["PODCAST_SERVICE_CONFIG"] = config
+    configure_shared_cache(config.data_path)
+    configure_metrics(config.data_path)
+    configure_api_urls(config.api_urls)
+    download_queue = DownloadQueue(config.data_path, config.download_workers)
+    clean_up_partial_files(config, download_queue.coordinator)
+    # Built up front so the first thumbnail and feed requests don't have to scan the thumbnails directory
+    get_thumbnail_index(config.data_path, config.aliases).refresh()
+    download_queue.start_workers(
+        is_downloaded=lambda video_id: is_download_complete(video_id, config),
+        download=lambda video_id: download_audio(video_id, config),
+    )
+    app.config["PODCAST_DOWNLOAD_QUEUE"] = download_queue
+    app.config["PODCAST_VIDEO_VALIDATOR"] = VideoValidator(
+        config.data_path, config.youtube_api_key
+    )
+    if is_prefetch_enabled(config):
+        start_periodic_task(
+            "prefetch",
+            config.data_path,
+            timedelta(minutes=config.prefetch_interval_minutes).total_seconds(),
+            lambda: prefetch_new_episodes(
+                config,
+                download_queue,
+                is_downloaded=lambda video_id: is_audio_downloaded(video_id, config),
+            ),
+        )
+    if config.segment_check_interval_minutes > 0 and config.segment_check_days > 0:
+        start_periodic_task(
+            "segment-check",
+            config.data_path,
+            timedelta(minutes=config.segment_check_interval_minutes).total_seconds(),
+            lambda: check_sponsor_segments(config, download_queue.coordinator),
+        )
+    # Without limits nothing is evicted, but the cache's index is still kept in line with the files on disk
+    start_periodic_task(
+        "audio-cache-eviction",
+        config.data_path,
+        EVICTION_INTERVAL.total_seconds(),
+        lambda: AudioCache(config.data_path).evict(
+            download_queue.coordinator,
+            max_bytes=config.audio_cache_max_bytes,
+            max_age=(
+                timedelta(days=config.audio_cache_max_age_days)
+                if config.audio_cache_max_age_days is not None
+                else None
+            ),
+        ),
+    )
+    initialize_request_metrics(app)
+    initialize_request_timing(app, config.slow_request_threshold_seconds)
     if config.allow_query_param_auth:
         from . import AuthKeyFilteringLogger
 
@@ -153,6 +470,28 @@ def create_app() -> Flask:
         "/thumbnail/<string:thumbnail_key>",
         view_func=ThumbnailView.as_view("thumbnail_view"),
     )
+    app.add_url_rule(
+        "/status/youtube/<string:video_id>",
+        view_func=DownloadStatusView.as_view("download_status_view"),
+    )
+    app.add_url_rule("/metrics", view_func=MetricsView.as_view("metrics_view"))
+    app.add_url_rule(
+        "/status/cache",
+        view_func=CacheStatusView.as_view("cache_status_view"),
+    )
+    # Started once the routes exist, since rendering feeds builds URLs with them. The first run warms the caches at
+    # startup, and the jitter keeps the runs from lining up with pollers that poll on the same interval
+    if config.feed_refresh_interval_minutes > 0:
+        feed_refresh_interval_seconds = timedelta(
+            minutes=config.feed_refresh_interval_minutes
+        ).total_seconds()
+        start_periodic_task(
+            "feed-refresh",
+            config.data_path,
+            feed_refresh_interval_seconds,
+            lambda: refresh_configured_feeds(config, app),
+            jitter_seconds=feed_refresh_interval_seconds * FEED_REFRESH_JITTER,
+        )
     return app
 
 
@@ -1,5 +1,5 @@
 from datetime import datetime
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from pathlib import Path
 from typing import Optional, Sequence
 
@@ -12,6 +12,22 @@ class PodcastConfig:
     itunes_category: Optional[str]
     explicit: Optional[bool]
     itunes_id: Optional[str]
+    prefetch_episodes: Optional[int]
+    episode_limit: Optional[int]
+    episode_window_days: Optional[int]
+    categories_to_remove: Optional[Sequence[str]]
+
+
+# Where the APIs the service depends on are reached. They're only changed to point the service at stand-ins, like the
+# local fakes the benchmarks run against
+@dataclass(frozen=True)
+class ApiUrls:
+    # None uses the Google API client's own endpoint
+    youtube_api_url: Optional[str] = None
+    sponsorblock_api_url: str = "https://sponsor.ajay.app/api/skipSegments"
+    itunes_lookup_url: str = "https://itunes.apple.com/lookup"
+    # Passed to yt-dlp to download a video's audio
+    youtube_video_url_template: str = "https://www.youtube.com/watch?v={video_id}"
 
 
 @dataclass
@@ -25,6 +41,24 @@ class ServiceConfig:
     categories_to_remove: Sequence[str]
     trusted_hosts: Sequence[str]
     podcast_configs: dict[str, PodcastConfig]
+    download_workers: int
+    download_wait_seconds: float
+    prefetch_episodes: int
+    prefetch_interval_minutes: float
+    prefetch_concurrency: int
+    feed_max_age_seconds: int
+    streaming_downloads: bool
+    segment_check_interval_minutes: float
+    segment_check_days: float
+    audio_cache_max_bytes: Optional[int]
+    audio_cache_max_age_days: Optional[float]
+    file_serving_mode: str
+    file_serving_prefix: str
+    artwork_size: int
+    feed_refresh_interval_minutes: float
+    feed_refresh_concurrency: int
+    slow_request_threshold_seconds: float
+    api_urls: ApiUrls
 
 
 @dataclass
@@ -52,3 +86,92 @@ class ItemDetails:
 @dataclass
 class EpisodeDetails(ItemDetails):
     published_at: datetime
+
+
+@dataclass(frozen=True)
+class EpisodeWindow:
+    limit: Optional[int] = None
+    offset: int = 0
+    published_after: Optional[datetime] = None
+
+
+@dataclass(frozen=True)
+class SponsorSegment:
+    # Seconds from the start of the original video
+    start: float
+    end: float
+
+
+@dataclass(frozen=True)
+class MediaMetadata:
+    # Bytes
+    size: int
+    # Seconds, after the segments were cut out
+    duration: Optional[float]
+    segments: Sequence[SponsorSegment]
+
+
+@dataclass
+class FeedPage:
+    episodes: Sequence[EpisodeDetails]
+    # RFC 5005 paging links (first, previous, next and last) to their URLs
+    links: dict[str, str]
+    # Episode IDs to the metadata of their downloaded audio. Episodes that haven't been downloaded are missing
+    media_metadata: dict[str, MediaMetadata] = field(default_factory=dict)
+
+
+@dataclass
+class FeedValidators:
+    etag: str
+    last_modified: Optional[datetime]
+
+
+@dataclass
+class RenderedFeed:
+    content: bytes
+    validators: FeedValidators
+
+
+@dataclass
+class PlaylistSyncState:
+    playlist_id: str
+    total_results: int
+    first_page_etag: str
+    # page_tokens[i] is the token for page i (page 0 doesn't have one)
+    page_tokens: list[Optional[str]]
+    # Every video in the playlist, including unavailable ones that don't have an episode
+    known_video_ids: set[str]
+    episodes: dict[str, EpisodeDetails]
+    full_synced_at: float
+
+
+@dataclass
+class DownloadJob:
+    video_id: str
+    state: str
+    attempts: int
+    error: Optional[str]
+    created_at: datetime
+    updated_at: datetime
+
+
+@dataclass
+class AudioCacheStatistics:
+    file_count: int
+    total_bytes: int
+    max_bytes: Optional[int]
+    evicted_files: int
+    evicted_bytes: int
+
+
+@dataclass
+class SharedCacheStatistics:
+    namespace: str
+    # Fresh entries served
+    hits: int
+    # Missing (or too stale) entries that callers waited for
+    misses: int
+    # Expired entries served while they were refreshed in the background
+    stale_serves: int
+    refreshes: int
+    refresh_failures: int
@@ -1,3 +1,13 @@
-from .youtuberssview import YoutubeRSSView
-from .youtubemediaview import YoutubeMediaView
+from .youtuberssview import YoutubeRSSView, refresh_configured_feeds
+from .youtubemediaview import (
+    YoutubeMediaView,
+    is_audio_downloaded,
+    download_audio,
+    check_sponsor_segments,
+    is_download_complete,
+    clean_up_partial_files,
+)
+from .cachestatusview import CacheStatusView
+from .metricsview import MetricsView
 from .thumbnailview import ThumbnailView, get_thumbnail_path
+from .downloadstatusview import DownloadStatusView
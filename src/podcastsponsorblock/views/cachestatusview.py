@@ -0,0 +1,24 @@
+from dataclasses import asdict
+
+from flask import current_app
+from flask.typing import ResponseReturnValue
+from flask.views import MethodView
+
+from ..helpers import AudioCache, get_shared_cache_statistics
+from ..models import ServiceConfig
+
+
+class CacheStatusView(MethodView):
+    def get(self) -> ResponseReturnValue:
+        config: ServiceConfig = current_app.config["PODCAST_SERVICE_CONFIG"]
+        return {
+            **asdict(
+                AudioCache(config.data_path).get_statistics(
+                    config.audio_cache_max_bytes
+                )
+            ),
+            # How often feed data (playlists, episodes, logos and iTunes artwork) came from each cache
+            "shared_caches": [
+                asdict(statistics) for statistics in get_shared_cache_statistics()
+            ],
+        }
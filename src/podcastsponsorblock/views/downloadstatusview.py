@@ -0,0 +1,26 @@
+from dataclasses import asdict
+
+from flask import current_app, Response
+from flask.typing import ResponseReturnValue
+from flask.views import MethodView
+
+from ..helpers import leniently_validate_youtube_id, DownloadQueue
+from ..models import ServiceConfig
+from .youtubemediaview import is_audio_downloaded
+
+
+class DownloadStatusView(MethodView):
+    def get(self, video_id: str) -> ResponseReturnValue:
+        video_id = video_id.removesuffix(".m4a")
+        if not leniently_validate_youtube_id(video_id):
+            return Response("Invalid video ID", status=400)
+        config: ServiceConfig = current_app.config["PODCAST_SERVICE_CONFIG"]
+        download_queue: DownloadQueue = current_app.config["PODCAST_DOWNLOAD_QUEUE"]
+        download_job = download_queue.get_job(video_id)
+        if download_job is None:
+            return Response("No download job found", status=404)
+        job_status = asdict(download_job)
+        job_status["created_at"] = download_job.created_at.isoformat()
+        job_status["updated_at"] = download_job.updated_at.isoformat()
+        job_status["audio_available"] = is_audio_downloaded(video_id, config)
+        return job_status
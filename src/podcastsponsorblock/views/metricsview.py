@@ -0,0 +1,80 @@
+from flask import current_app, Response
+from flask.typing import ResponseReturnValue
+from flask.views import MethodView
+
+from ..helpers import (
+    AudioCache,
+    DownloadQueue,
+    JOB_QUEUED,
+    JOB_RUNNING,
+    get_metric_values,
+    get_shared_cache_statistics,
+    render_metrics,
+    format_labels,
+)
+from ..models import ServiceConfig
+
+PROMETHEUS_TEXT_MIMETYPE = "text/plain; version=0.0.4"
+
+
+def get_cache_metric_values() -> dict[tuple[str, str], float]:
+    metric_values = dict()
+    for statistics in get_shared_cache_statistics():
+        for result, count in (
+            ("hit", statistics.hits),
+            ("miss", statistics.misses),
+            ("stale", statistics.stale_serves),
+        ):
+            metric_values[
+                (
+                    "podcast_cache_requests_total",
+                    format_labels({"cache": statistics.namespace, "result": result}),
+                )
+            ] = count
+        for result, count in (
+            ("success", statistics.refreshes),
+            ("failure", statistics.refresh_failures),
+        ):
+            metric_values[
+                (
+                    "podcast_cache_refreshes_total",
+                    format_labels({"cache": statistics.namespace, "result": result}),
+                )
+            ] = count
+    return metric_values
+
+
+def get_gauge_values(
+    config: ServiceConfig, download_queue: DownloadQueue
+) -> dict[tuple[str, str], float]:
+    # Gauges are read from the shared database when they're scraped, so they're the same whichever worker answers
+    gauge_values = {
+        ("podcast_download_jobs", format_labels({"state": state})): (
+            download_queue.count_jobs(state)
+        )
+        for state in (JOB_QUEUED, JOB_RUNNING)
+    }
+    audio_cache_statistics = AudioCache(config.data_path).get_statistics(
+        config.audio_cache_max_bytes
+    )
+    gauge_values[("podcast_audio_cache_bytes", "")] = audio_cache_statistics.total_bytes
+    gauge_values[("podcast_audio_cache_files", "")] = audio_cache_statistics.file_count
+    if audio_cache_statistics.max_bytes is not None:
+        gauge_values[("podcast_audio_cache_max_bytes", "")] = (
+            audio_cache_statistics.max_bytes
+        )
+    return gauge_values
+
+
+class MetricsView(MethodView):
+    def get(self) -> ResponseReturnValue:
+        config: ServiceConfig = current_app.config["PODCAST_SERVICE_CONFIG"]
+        download_queue: DownloadQueue = current_app.config["PODCAST_DOWNLOAD_QUEUE"]
+        metric_values = {
+            **get_metric_values(),
+            **get_cache_metric_values(),
+            **get_gauge_values(config, download_queue),
+        }
+        return Response(
+            render_metrics(metric_values), mimetype=PROMETHEUS_TEXT_MIMETYPE
+        )
@@ -1,50 +1,97 @@
+from datetime import timedelta
 from pathlib import Path
-from typing import Optional, Sequence
+from typing import Optional
 
-from flask import current_app, send_file, Response
+from flask import current_app, Response, request
 from flask.typing import ResponseReturnValue
 from flask.views import MethodView
 
-from ..models import FeedOptions
+from ..helpers import (
+    parse_positive_int_arg,
+    send_cached_file,
+    get_thumbnail_index,
+    get_thumbnail_variant,
+    get_thumbnail_fingerprint,
+    get_thumbnail_size,
+    get_thumbnail_etag,
+    THUMBNAIL_FORMATS,
+    DEFAULT_THUMBNAIL_FORMAT,
+)
+from ..models import FeedOptions, ServiceConfig
 
-
-def compute_potential_thumbnail_stems(
-    thumbnail_key: str, aliases: dict
-) -> Sequence[str]:
-    all_potential_thumbnail_names = [thumbnail_key]
-    for alias, target in aliases.items():
-        if thumbnail_key == alias:
-            all_potential_thumbnail_names.append(target)
-        elif thumbnail_key == target:
-            all_potential_thumbnail_names.append(alias)
-    return tuple(name.casefold() for name in all_potential_thumbnail_names)
+THUMBNAIL_MAX_AGE = timedelta(days=1)
+# Versioned URLs (the ones in feeds) change whenever the thumbnail does
+VERSIONED_THUMBNAIL_MAX_AGE = timedelta(days=365)
 
 
 def get_thumbnail_path(thumbnail_key: str, feed_options: FeedOptions) -> Optional[Path]:
-    thumbnail_directory = feed_options.service_config.data_path / "thumbnails"
-    if not thumbnail_directory.exists() or not thumbnail_directory.is_dir():
-        return None
-    all_potential_thumbnail_stems = compute_potential_thumbnail_stems(
-        thumbnail_key, feed_options.service_config.aliases
-    )
-    for candidate_thumbnail in thumbnail_directory.iterdir():
-        if (
-            not candidate_thumbnail.is_file()
-            or candidate_thumbnail.stem.casefold() not in all_potential_thumbnail_stems
-        ):
-            continue
-        return candidate_thumbnail
-    return None
+    return get_thumbnail_index(
+        feed_options.service_config.data_path, feed_options.service_config.aliases
+    ).get(thumbnail_key)
+
+
+def add_thumbnail_cache_headers(
+    response: Response, etag: str, is_versioned: bool, config: ServiceConfig
+) -> Response:
+    response.set_etag(etag)
+    # send_file marks files as no-cache by default
+    response.cache_control.no_cache = None
+    # Thumbnails behind authentication must not be stored by shared caches
+    if config.auth_key is not None:
+        response.cache_control.private = True
+    else:
+        response.cache_control.public = True
+    if is_versioned:
+        response.cache_control.max_age = int(
+            VERSIONED_THUMBNAIL_MAX_AGE.total_seconds()
+        )
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.max_age = int(THUMBNAIL_MAX_AGE.total_seconds())
+    return response
 
 
 class ThumbnailView(MethodView):
     def get(self, thumbnail_key: str) -> ResponseReturnValue:
+        config: ServiceConfig = current_app.config["PODCAST_SERVICE_CONFIG"]
         thumbnail_path = get_thumbnail_path(
-            thumbnail_key, current_app.config["PODCAST_SERVICE_CONFIG"]
+            thumbnail_key, FeedOptions(config, None, "")
         )
         if thumbnail_path is None:
             return Response("Thumbnail not found", status=404)
-        return send_file(thumbnail_path)
+        try:
+            requested_size = parse_positive_int_arg("size")
+        except ValueError:
+            return Response("Invalid size", status=400)
+        thumbnail_format = request.args.get("format")
+        if thumbnail_format is not None and thumbnail_format not in THUMBNAIL_FORMATS:
+            return Response("Invalid format", status=400)
+        # Without a size or format, the thumbnail is sent as it was provided
+        if requested_size is None and thumbnail_format is None:
+            return send_cached_file(thumbnail_path, config)
+        size = get_thumbnail_size(
+            requested_size or config.artwork_size, config.artwork_size
+        )
+        thumbnail_format = thumbnail_format or DEFAULT_THUMBNAIL_FORMAT
+        try:
+            fingerprint = get_thumbnail_fingerprint(thumbnail_path)
+        except FileNotFoundError:
+            return Response("Thumbnail not found", status=404)
+        etag = get_thumbnail_etag(fingerprint, size, thumbnail_format)
+        is_versioned = request.args.get("v") == fingerprint
+        # Clients that already have this variant are answered without opening it
+        if request.if_none_match.contains(etag):
+            return add_thumbnail_cache_headers(
+                Response(status=304), etag, is_versioned, config
+            )
+        variant_path = get_thumbnail_variant(
+            thumbnail_path, config.data_path, size, thumbnail_format
+        )
+        if variant_path is None:
+            return send_cached_file(thumbnail_path, config)
+        response = send_cached_file(variant_path, config)
+        response.mimetype = THUMBNAIL_FORMATS[thumbnail_format][1]
+        return add_thumbnail_cache_headers(response, etag, is_versioned, config)
 
     def head(self, thumbnail_key: str) -> ResponseReturnValue:
         return self.get(thumbnail_key)
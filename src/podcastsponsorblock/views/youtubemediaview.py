@@ -1,83 +1,701 @@
 import logging
-from collections import defaultdict
+import os
+import subprocess
+import shutil
+import time
+from datetime import timedelta
 from pathlib import Path
-from typing import Sequence, Optional
+from typing import BinaryIO, Iterator, Optional, Sequence
 
-from flask import send_file, current_app, Response
+from flask import current_app, Response, request
 from flask.typing import ResponseReturnValue
 
 from flask.views import MethodView
-from yt_dlp import YoutubeDL as YoutubeDLP, DownloadError
+from yt_dlp import YoutubeDL as YoutubeDLP
 
-from ..helpers import leniently_validate_youtube_id
-from googleapiclient.discovery import build as build_google_api_client
-import threading
+from ..helpers import (
+    leniently_validate_youtube_id,
+    DownloadQueue,
+    JOB_FAILED,
+    FINISHED_JOB_STATES,
+    VideoValidator,
+    DownloadCoordinator,
+    get_sponsor_segments,
+    normalize_categories,
+    get_unknown_categories,
+    AppliedSegmentStore,
+    hash_segments,
+    AudioCache,
+    MediaMetadataStore,
+    send_cached_file,
+    time_histogram,
+    DOWNLOAD_DURATION_BUCKETS,
+    timing_span,
+    time_until_response_headers,
+    get_api_urls,
+)
 
-from ..models import ServiceConfig
+from ..models import ServiceConfig, SponsorSegment, MediaMetadata
 
+RETRY_AFTER_SECONDS = 30
+STREAM_CHUNK_SIZE = 64 * 1024
+STREAM_POLL_INTERVAL_SECONDS = 0.1
+# How far a download's duration can be from the duration YouTube reports before it's considered truncated
+DURATION_TOLERANCE_SECONDS = 2
+# Partial downloads are resumed by the next attempt, unless they were abandoned this long ago
+PARTIAL_DOWNLOAD_MAX_AGE = timedelta(days=1)
+# Files that are only written while a download or cut is running, and are never resumed
+INTERMEDIATE_FILE_MARKERS = (".streaming.", ".cutting.", ".ffconcat")
+PARTIAL_DOWNLOAD_MARKER = ".downloading."
 
-def download_m4a_audio(
-    video_id: str, output_path: Path, categories_to_remove: Sequence[str]
-):
+
+def probe_duration(path: Path) -> Optional[float]:
+    ffprobe_result = subprocess.run(
+        (
+            "ffprobe",
+            "-loglevel",
+            "error",
+            "-show_entries",
+            "format=duration",
+            "-of",
+            "default=noprint_wrappers=1:nokey=1",
+            str(path),
+        ),
+        capture_output=True,
+        text=True,
+    )
+    try:
+        return float(ffprobe_result.stdout.strip())
+    except ValueError:
+        return None
+
+
+def verify_audio(path: Path, expected_duration: Optional[float]) -> float:
+    # Returns the duration of the audio
+    duration = probe_duration(path)
+    if duration is None or duration <= 0:
+        raise ValueError(f"{path.name} is not playable audio")
+    if (
+        expected_duration is not None
+        and abs(duration - expected_duration) > DURATION_TOLERANCE_SECONDS
+    ):
+        raise ValueError(
+            f"{path.name} is {duration:.1f} seconds long instead of {expected_duration:.1f} seconds"
+        )
+    return duration
+
+
+def move_into_place(temporary_path: Path, path: Path) -> None:
+    # The data is flushed to disk before the rename, so a crash can't leave an empty or truncated file at path
+    with open(temporary_path, "rb") as temporary_file:
+        os.fsync(temporary_file.fileno())
+    os.replace(temporary_path, path)
+
+
+def download_m4a_audio(video_id: str, output_path: Path):
+    # yt-dlp writes to <downloading path>.part and resumes it if the download is interrupted and retried. The finished
+    # download is only moved to output_path once it has been verified
+    downloading_path = output_path.with_name(
+        f"{output_path.stem}{PARTIAL_DOWNLOAD_MARKER}m4a"
+    )
     youtube_dlp_options = {
         "quiet": True,
-        "outtmpl": str(output_path.absolute().resolve()),
+        "outtmpl": str(downloading_path.absolute().resolve()),
         "format": "bestaudio[ext=m4a]",
-        "postprocessors": [
-            {"key": "SponsorBlock", "categories": categories_to_remove},
-            {
-                "key": "ModifyChapters",
-                "remove_sponsor_segments": categories_to_remove,
-            },
-        ],
+        "continuedl": True,
     }
     with YoutubeDLP(youtube_dlp_options) as youtube_dlp_client:
-        youtube_dlp_client.download((f"https://www.youtube.com/watch?v={video_id}",))
+        video_info = youtube_dlp_client.extract_info(
+            get_api_urls().youtube_video_url_template.format(video_id=video_id),
+            download=True,
+        )
+    try:
+        verify_audio(downloading_path, video_info.get("duration"))
+    except ValueError:
+        # Resuming a download that's already complete can't fix it
+        downloading_path.unlink(missing_ok=True)
+        raise
+    move_into_place(downloading_path, output_path)
+
+
+def create_concat_list(source_path: Path, segments: Sequence[SponsorSegment]) -> str:
+    # Lists the parts of the source between the segments for ffmpeg's concat demuxer
+    quoted_source_path = str(source_path.absolute()).replace("'", "'\\''")
+    concat_lines = ["ffconcat version 1.0"]
+    part_start = 0.0
+    for segment in (*segments, None):
+        if segment is not None and segment.start <= part_start:
+            part_start = max(part_start, segment.end)
+            continue
+        concat_lines.append(f"file '{quoted_source_path}'")
+        concat_lines.append(f"inpoint {part_start:.3f}")
+        if segment is not None:
+            concat_lines.append(f"outpoint {segment.start:.3f}")
+            part_start = segment.end
+    return "\n".join(concat_lines) + "\n"
+
+
+def cut_sponsor_segments(
+    source_path: Path, output_path: Path, segments: Sequence[SponsorSegment]
+) -> float:
+    # Cuts the segments out of the source without re-encoding it. The cut file is written next to output_path and moved
+    # into place once it's complete, so a file that's being served is never partially overwritten
+    cutting_path = output_path.with_name(f"{output_path.stem}.cutting.m4a")
+    concat_list_path = output_path.with_name(f"{output_path.stem}.ffconcat")
+    try:
+        if len(segments) == 0:
+            shutil.copyfile(source_path, cutting_path)
+        else:
+            concat_list_path.write_text(create_concat_list(source_path, segments))
+            subprocess.run(
+                (
+                    "ffmpeg",
+                    "-loglevel",
+                    "error",
+                    "-nostdin",
+                    "-y",
+                    "-f",
+                    "concat",
+                    "-safe",
+                    "0",
+                    "-i",
+                    str(concat_list_path),
+                    "-map",
+                    "0:a",
+                    "-c",
+                    "copy",
+                    "-movflags",
+                    "+faststart",
+                    str(cutting_path),
+                ),
+                check=True,
+                capture_output=True,
+            )
+        duration = verify_audio(cutting_path, None)
+        move_into_place(cutting_path, output_path)
+        return duration
+    finally:
+        cutting_path.unlink(missing_ok=True)
+        concat_list_path.unlink(missing_ok=True)
+
+
+def get_audio_variant(
+    video_id: str, config: ServiceConfig, categories: Optional[Sequence[str]] = None
+) -> str:
+    # Each set of categories gets its own copy of a video, except the configured categories which keep the plain
+    # <video id>.m4a name
+    if categories is None or categories == config.categories_to_remove:
+        return video_id
+    return f"{video_id}.{'+'.join(categories) or 'none'}"
+
+
+def get_audio_path(
+    video_id: str, config: ServiceConfig, categories: Optional[Sequence[str]] = None
+) -> Path:
+    return (
+        config.data_path
+        / "audio"
+        / f"{get_audio_variant(video_id, config, categories)}.m4a"
+    )
+
+
+def get_source_audio_path(video_id: str, config: ServiceConfig) -> Path:
+    # The audio as it was downloaded from YouTube, before any segments were cut out
+    return config.data_path / "source" / f"{video_id}.m4a"
+
+
+def record_written_audio(
+    video_id: str,
+    config: ServiceConfig,
+    categories: Sequence[str],
+    segments: Sequence[SponsorSegment],
+    duration: float,
+) -> None:
+    # Called once a variant has been moved into place, so feeds can give its real length and duration. The variant and
+    # its source are indexed straight away, so the audio cache's usage includes them before its next scan
+    audio_cache = AudioCache(config.data_path)
+    audio_cache.record_access(get_audio_path(video_id, config, categories))
+    audio_cache.record_access(get_source_audio_path(video_id, config))
+    AppliedSegmentStore(config.data_path).record_applied_segments(
+        video_id, categories, segments
+    )
+    MediaMetadataStore(config.data_path).record_media_metadata(
+        video_id,
+        categories,
+        MediaMetadata(
+            size=get_audio_path(video_id, config, categories).stat().st_size,
+            duration=duration,
+            segments=tuple(segments),
+        ),
+    )
+
+
+def cut_audio(
+    video_id: str,
+    config: ServiceConfig,
+    categories: Sequence[str],
+    segments: Sequence[SponsorSegment],
+) -> None:
+    source_path = get_source_audio_path(video_id, config)
+    AudioCache(config.data_path).record_access(source_path)
+    with time_histogram(
+        "podcast_download_phase_duration_seconds",
+        {"phase": "cut"},
+        DOWNLOAD_DURATION_BUCKETS,
+    ):
+        duration = cut_sponsor_segments(
+            source_path,
+            get_audio_path(video_id, config, categories),
+            segments,
+        )
+    record_written_audio(video_id, config, categories, segments, duration)
+
+
+def is_audio_downloaded(
+    video_id: str, config: ServiceConfig, categories: Optional[Sequence[str]] = None
+) -> bool:
+    audio_path = get_audio_path(video_id, config, categories)
+    return audio_path.exists() and audio_path.is_file()
+
+
+def is_download_complete(video_id: str, config: ServiceConfig) -> bool:
+    # Variants are cut from the source, so a download isn't complete until both exist (either can be evicted from the
+    # audio cache on its own)
+    return get_source_audio_path(video_id, config).exists() and is_audio_downloaded(
+        video_id, config
+    )
+
+
+def get_download_sponsor_segments(
+    video_id: str, categories: Sequence[str]
+) -> Sequence[SponsorSegment]:
+    # Only lookups a download waits on are timed as a download phase, not the segment check's background lookups
+    if len(categories) == 0:
+        return tuple()
+    with time_histogram(
+        "podcast_download_phase_duration_seconds",
+        {"phase": "sponsorblock"},
+        DOWNLOAD_DURATION_BUCKETS,
+    ):
+        return get_sponsor_segments(video_id, categories)
+
+
+def download_audio(video_id: str, config: ServiceConfig) -> None:
+    source_path = get_source_audio_path(video_id, config)
+    categories = config.categories_to_remove
+    segments = None
+    # A source left behind by an earlier attempt (e.g. one where SponsorBlock couldn't be reached) is reused
+    if not source_path.exists() and config.streaming_downloads:
+        # Streaming downloads cut the segments out while they download, so they need them first
+        segments = get_download_sponsor_segments(video_id, categories)
+        logging.info(f"Streaming audio from YouTube video {video_id}")
+        with time_histogram(
+            "podcast_download_phase_duration_seconds",
+            {"phase": "stream"},
+            DOWNLOAD_DURATION_BUCKETS,
+        ):
+            stream_source_audio(
+                video_id,
+                source_path,
+                get_streaming_audio_path(video_id, config, categories),
+                segments,
+            )
+    elif not source_path.exists():
+        logging.info(f"Downloading audio from YouTube video {video_id}")
+        with time_histogram(
+            "podcast_download_phase_duration_seconds",
+            {"phase": "fetch"},
+            DOWNLOAD_DURATION_BUCKETS,
+        ):
+            download_m4a_audio(video_id, source_path)
+    get_audio_path(video_id, config).parent.mkdir(parents=True, exist_ok=True)
+    cut_audio(
+        video_id,
+        config,
+        categories,
+        (
+            segments
+            if segments is not None
+            else get_download_sponsor_segments(video_id, categories)
+        ),
+    )
 
 
-def validate_youtube_video_id(video_id: str, config: ServiceConfig) -> Optional[str]:
-    youtube_client = build_google_api_client(
-        "youtube", "v3", developerKey=config.youtube_api_key, cache_discovery=False
+def prepare_audio_variant(
+    video_id: str,
+    config: ServiceConfig,
+    categories: Sequence[str],
+    coordinator: DownloadCoordinator,
+) -> bool:
+    # Variants are cut from the source audio that every variant shares, so only the first variant of a video needs a
+    # download. Returns False if the source hasn't been downloaded yet
+    if is_audio_downloaded(video_id, config, categories):
+        return True
+    if not get_source_audio_path(video_id, config).exists():
+        return False
+    coordinator.run_once(
+        get_audio_variant(video_id, config, categories),
+        lambda: is_audio_downloaded(video_id, config, categories),
+        lambda: cut_audio(
+            video_id,
+            config,
+            categories,
+            get_download_sponsor_segments(video_id, categories),
+        ),
     )
-    video_request = youtube_client.videos().list(part="id", id=video_id)
-    video_response = video_request.execute()
-    video_objects = video_response["items"]
-    if len(video_objects) == 0:
+    return True
+
+
+def check_variant_segments(
+    video_id: str,
+    categories: Sequence[str],
+    config: ServiceConfig,
+    coordinator: DownloadCoordinator,
+    applied_segment_store: AppliedSegmentStore,
+) -> None:
+    # Variants that were evicted from the audio cache are cut again when they're next requested
+    if not get_source_audio_path(video_id, config).exists() or not is_audio_downloaded(
+        video_id, config, categories
+    ):
+        applied_segment_store.remove(video_id, categories)
+        return
+    segments = get_sponsor_segments(video_id, categories)
+    if hash_segments(segments) == applied_segment_store.get_segments_hash(
+        video_id, categories
+    ):
+        applied_segment_store.mark_checked(video_id, categories)
+        return
+    # A variant that's being downloaded or cut is skipped until the next check
+    with coordinator.lock(
+        get_audio_variant(video_id, config, categories), blocking=False
+    ) as acquired:
+        if acquired:
+            logging.info(
+                f"Re-cutting audio of YouTube video {video_id} for categories {categories}"
+            )
+            cut_audio(video_id, config, categories, segments)
+
+
+def check_sponsor_segments(
+    config: ServiceConfig, coordinator: DownloadCoordinator
+) -> None:
+    # Re-cuts recently downloaded videos whose SponsorBlock segments changed since they were cut, using the source
+    # audio instead of downloading the video again
+    applied_segment_store = AppliedSegmentStore(config.data_path)
+    now = time.time()
+    for video_id, categories in applied_segment_store.get_variants_to_check(
+        downloaded_after=now
+        - timedelta(days=config.segment_check_days).total_seconds(),
+        checked_before=now
+        - timedelta(minutes=config.segment_check_interval_minutes).total_seconds(),
+    ):
+        try:
+            check_variant_segments(
+                video_id, categories, config, coordinator, applied_segment_store
+            )
+        except Exception:
+            # A failing variant is marked as checked so it's retried next interval instead of being first in line (and
+            # failing again) on every pass, and so it doesn't stop the rest from being checked
+            logging.exception(
+                f"Failed to check SponsorBlock segments of YouTube video {video_id} for categories {categories}"
+            )
+            applied_segment_store.mark_checked(video_id, categories)
+
+
+def get_streaming_audio_path(
+    video_id: str, config: ServiceConfig, categories: Sequence[str]
+) -> Path:
+    return (
+        config.data_path
+        / "audio"
+        / f"{get_audio_variant(video_id, config, categories)}.streaming.m4a"
+    )
+
+
+def resolve_audio_stream(video_id: str) -> dict:
+    youtube_dlp_options = {"quiet": True, "format": "bestaudio[ext=m4a]"}
+    with YoutubeDLP(youtube_dlp_options) as youtube_dlp_client:
+        return youtube_dlp_client.extract_info(
+            get_api_urls().youtube_video_url_template.format(video_id=video_id),
+            download=False,
+        )
+
+
+def create_segment_filter(segments: Sequence[SponsorSegment]) -> str:
+    # Drops every sample inside a segment and then closes the gaps in the timestamps
+    removed_ranges = "+".join(
+        f"between(t,{segment.start:.3f},{segment.end:.3f})" for segment in segments
+    )
+    return f"aselect='not({removed_ranges})',asetpts=N/SR/TB"
+
+
+def create_ffmpeg_command(
+    stream_info: dict, segments: Sequence[SponsorSegment], source_path: Path
+) -> Sequence[str]:
+    http_headers = "".join(
+        f"{name}: {value}\r\n"
+        for name, value in stream_info.get("http_headers", dict()).items()
+    )
+    ffmpeg_command = ["ffmpeg", "-loglevel", "error", "-nostdin"]
+    if http_headers != "":
+        ffmpeg_command += ["-headers", http_headers]
+    ffmpeg_command += ["-i", stream_info["url"], "-vn"]
+    # Without segments to remove the audio doesn't need to be re-encoded
+    if len(segments) == 0:
+        ffmpeg_command += ["-c:a", "copy"]
+    else:
+        ffmpeg_command += ["-af", create_segment_filter(segments), "-c:a", "aac"]
+    # A fragmented mp4 can be written (and played) front to back without seeking back to fill in the header
+    ffmpeg_command += [
+        "-f",
+        "mp4",
+        "-movflags",
+        "frag_keyframe+empty_moov+default_base_moof",
+        "pipe:1",
+    ]
+    # The uncut audio is kept as well, so the video can be re-cut if its segments change
+    ffmpeg_command += ["-map", "0:a", "-c:a", "copy", "-f", "mp4", str(source_path)]
+    return ffmpeg_command
+
+
+def stream_source_audio(
+    video_id: str,
+    source_path: Path,
+    streaming_path: Path,
+    segments: Sequence[SponsorSegment],
+) -> None:
+    # Downloads the source audio while writing a cut of it to streaming_path as it goes, so requests can follow along
+    # instead of waiting. That cut has to be re-encoded to remove segments mid-download, so it's only for the requests
+    # following it: the cached variant is cut from the source like every other download's
+    streaming_source_path = source_path.with_name(f"{source_path.stem}.streaming.m4a")
+    source_path.parent.mkdir(parents=True, exist_ok=True)
+    streaming_path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        # Created before the stream is resolved, so requests know to wait for it
+        with open(streaming_path, "wb") as streaming_file:
+            stream_info = resolve_audio_stream(video_id)
+            ffmpeg_process = subprocess.Popen(
+                create_ffmpeg_command(stream_info, segments, streaming_source_path),
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            )
+            with ffmpeg_process:
+                while chunk := ffmpeg_process.stdout.read1(STREAM_CHUNK_SIZE):
+                    streaming_file.write(chunk)
+                    # Followers read the file as it's written, so chunks can't sit in the buffer
+                    streaming_file.flush()
+                ffmpeg_errors = ffmpeg_process.stderr.read().decode(errors="replace")
+            if ffmpeg_process.returncode != 0:
+                raise ValueError(f"ffmpeg failed: {ffmpeg_errors.strip()}")
+        verify_audio(streaming_source_path, stream_info.get("duration"))
+        move_into_place(streaming_source_path, source_path)
+    finally:
+        streaming_path.unlink(missing_ok=True)
+        streaming_source_path.unlink(missing_ok=True)
+
+
+def open_streaming_audio(
+    video_id: str,
+    config: ServiceConfig,
+    download_queue: DownloadQueue,
+    timeout_seconds: float,
+) -> Optional[BinaryIO]:
+    # Waits for the download queue to start streaming the video. Returns None if its job finishes without streaming
+    # (e.g. because the source was already downloaded) or doesn't start in time
+    deadline = time.monotonic() + timeout_seconds
+    streaming_path = get_streaming_audio_path(
+        video_id, config, config.categories_to_remove
+    )
+    while True:
+        try:
+            return open(streaming_path, "rb")
+        except FileNotFoundError:
+            pass
+        download_job = download_queue.get_job(video_id)
+        if (
+            download_job is None
+            or download_job.state in FINISHED_JOB_STATES
+            or time.monotonic() >= deadline
+        ):
+            return None
+        time.sleep(STREAM_POLL_INTERVAL_SECONDS)
+
+
+def follow_streaming_audio(
+    streaming_file: BinaryIO,
+    video_id: str,
+    config: ServiceConfig,
+    coordinator: DownloadCoordinator,
+) -> Iterator[bytes]:
+    # Sends the file as it's written. The download queue's worker holds the video's lock until the download has been
+    # cut (the open file can still be read after it's removed)
+    with streaming_file:
+        while True:
+            chunk = streaming_file.read(STREAM_CHUNK_SIZE)
+            if len(chunk) > 0:
+                yield chunk
+            elif coordinator.is_locked(video_id):
+                time.sleep(STREAM_POLL_INTERVAL_SECONDS)
+            else:
+                while chunk := streaming_file.read(STREAM_CHUNK_SIZE):
+                    yield chunk
+                break
+    # A failed download leaves no variant behind. Raising cuts the response off, so the podcast app sees a failed
+    # download instead of a complete but truncated episode
+    if not is_audio_downloaded(video_id, config):
+        raise ValueError(f"Streaming audio from YouTube video {video_id} failed")
+
+
+def clean_up_partial_files(
+    config: ServiceConfig, coordinator: DownloadCoordinator
+) -> None:
+    # Removes files left behind by downloads and cuts that were interrupted (e.g. by a worker being killed). Partial
+    # yt-dlp downloads are kept so the next attempt can resume them, unless they were abandoned long ago. Files whose
+    # video or variant is locked belong to a download or cut another worker is running right now
+    abandoned_before = time.time() - PARTIAL_DOWNLOAD_MAX_AGE.total_seconds()
+    for directory in (config.data_path / "audio", config.data_path / "source"):
+        if not directory.is_dir():
+            continue
+        for path in directory.iterdir():
+            is_intermediate_file = any(
+                marker in path.name for marker in INTERMEDIATE_FILE_MARKERS
+            )
+            is_abandoned_download = (
+                PARTIAL_DOWNLOAD_MARKER in path.name
+                and path.stat().st_mtime < abandoned_before
+            )
+            if not is_intermediate_file and not is_abandoned_download:
+                continue
+            variant = path.name
+            for marker in (*INTERMEDIATE_FILE_MARKERS, PARTIAL_DOWNLOAD_MARKER):
+                variant = variant.split(marker)[0]
+            if coordinator.is_locked(variant.split(".")[0]) or coordinator.is_locked(
+                variant
+            ):
+                continue
+            logging.info(f"Removing partial file {path.name}")
+            path.unlink(missing_ok=True)
+
+
+def send_cached_audio(path: Path, config: ServiceConfig) -> Optional[Response]:
+    # Returns None if the file was evicted from the audio cache. Otherwise it's kept from being evicted until the
+    # response has been sent
+    serving_file = AudioCache(config.data_path).open_for_serving(path)
+    if serving_file is None:
         return None
-    return video_objects[0]["id"]
+    response = send_cached_file(path, config)
+    # When the file is handed off to the reverse proxy the lock is released straight away, and only the recent access
+    # grace period keeps it from being evicted while it's sent
+    response.call_on_close(serving_file.close)
+    return response
 
 
-class YoutubeMediaView(MethodView):
-    def __init__(self):
-        self.video_download_locks = defaultdict(threading.Lock)
+def send_audio_variant(
+    video_id: str,
+    config: ServiceConfig,
+    categories: Sequence[str],
+    coordinator: DownloadCoordinator,
+) -> Optional[ResponseReturnValue]:
+    try:
+        if not prepare_audio_variant(video_id, config, categories, coordinator):
+            return None
+    except Exception:
+        logging.exception(f"Failed to cut audio of YouTube video {video_id}")
+        return Response("Failed to download audio", status=500)
+    return send_cached_audio(get_audio_path(video_id, config, categories), config)
+
+
+def parse_categories(config: ServiceConfig) -> Sequence[str]:
+    categories = request.args.get("categories")
+    if categories is None:
+        return config.categories_to_remove
+    # Unlike the configuration, a request for categories we don't know is an error rather than a warning
+    split_categories = tuple(
+        filter(None, (category.strip() for category in categories.split(",")))
+    )
+    if len(get_unknown_categories(split_categories)) > 0:
+        raise ValueError(f"Unknown SponsorBlock categories: {categories}")
+    return normalize_categories(split_categories)
+
 
+class YoutubeMediaView(MethodView):
     def get(self, video_id: str) -> ResponseReturnValue:
         # Apple podcasts requires the file extension, but we don't want it and need to remove it if present
         video_id = video_id.removesuffix(".m4a")
         if not leniently_validate_youtube_id(video_id):
             return Response("Invalid video ID", status=400)
         config: ServiceConfig = current_app.config["PODCAST_SERVICE_CONFIG"]
-        validated_video_id = validate_youtube_video_id(video_id, config)
+        try:
+            categories = parse_categories(config)
+        except ValueError:
+            return Response("Invalid categories", status=400)
+        # Sending the audio takes as long as the client takes to download it
+        time_until_response_headers()
+        # Audio is only ever downloaded for validated IDs, so cache hits (including every range request for a file we
+        # already have) can skip asking YouTube
+        with timing_span("audio-cache"):
+            if is_audio_downloaded(video_id, config, categories):
+                response = send_cached_audio(
+                    get_audio_path(video_id, config, categories), config
+                )
+                if response is not None:
+                    return response
+        video_validator: VideoValidator = current_app.config["PODCAST_VIDEO_VALIDATOR"]
+        with timing_span("validate"):
+            validated_video_id = video_validator.validate(video_id)
         if validated_video_id is None:
             return Response("Video ID does not exist", status=400)
-        audio_output_path = config.data_path / "audio" / f"{validated_video_id}.m4a"
-        if audio_output_path.exists() and audio_output_path.is_file():
-            return send_file(audio_output_path)
-        # We need a per-video_id lock here to prevent two requests from causing the same video to download twice
-        with self.video_download_locks[validated_video_id]:
-            if audio_output_path.exists() and audio_output_path.is_file():
-                return send_file(audio_output_path)
-            logging.info(f"Downloading audio from YouTube video {validated_video_id}")
-            try:
-                download_m4a_audio(
+        download_queue: DownloadQueue = current_app.config["PODCAST_DOWNLOAD_QUEUE"]
+        with timing_span("variant"):
+            response = send_audio_variant(
+                validated_video_id, config, categories, download_queue.coordinator
+            )
+        if response is not None:
+            return response
+        # Downloads run on the download queue's workers rather than in the request, so a slow download can't tie up
+        # a request for longer than download_wait_seconds (unless it's followed while it streams). The queue downloads
+        # the source, which the requested variant is then cut from
+        wait_started_at = time.monotonic()
+        streaming_file = None
+        with timing_span("download"):
+            download_queue.enqueue(validated_video_id)
+            # Requests for the configured categories can follow a streaming download as it's written
+            if config.streaming_downloads and categories == config.categories_to_remove:
+                streaming_file = open_streaming_audio(
                     validated_video_id,
-                    audio_output_path,
-                    categories_to_remove=config.categories_to_remove,
+                    config,
+                    download_queue,
+                    config.download_wait_seconds,
                 )
-                return send_file(audio_output_path)
-            except DownloadError as exception:
-                logging.exception(
-                    f"Failed to download audio for YouTube video {validated_video_id}",
-                    exception,
-                )
-                return Response("Failed to download audio", status=500)
+        if streaming_file is not None:
+            # The length isn't known until the download finishes, so range requests get the whole file
+            return Response(
+                follow_streaming_audio(
+                    streaming_file,
+                    validated_video_id,
+                    config,
+                    download_queue.coordinator,
+                ),
+                mimetype="audio/mp4",
+            )
+        with timing_span("download"):
+            download_job = download_queue.wait_for_job(
+                validated_video_id,
+                max(
+                    config.download_wait_seconds - (time.monotonic() - wait_started_at),
+                    0,
+                ),
+            )
+        with timing_span("variant"):
+            response = send_audio_variant(
+                validated_video_id, config, categories, download_queue.coordinator
+            )
+        if response is not None:
+            return response
+        if download_job is not None and download_job.state == JOB_FAILED:
+            return Response("Failed to download audio", status=500)
+        return Response(
+            "Audio is still downloading, please try again later",
+            status=503,
+            headers={"Retry-After": str(RETRY_AFTER_SECONDS)},
+        )
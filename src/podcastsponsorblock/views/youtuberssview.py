@@ -1,29 +1,60 @@
+import hashlib
 import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dataclasses import dataclass
 from urllib.parse import urlparse, urlencode
-from datetime import timedelta
-from typing import TypedDict, Optional
+from datetime import timedelta, datetime, timezone
+from email.utils import format_datetime
+from typing import TypedDict, Optional, Iterator, Iterable, Sequence
 
-from cachetools import cached, TTLCache
 from cachetools.keys import hashkey
 from feedgen.entry import FeedEntry
 from feedgen.feed import FeedGenerator
 from flask.typing import ResponseReturnValue
 from flask import (
+    Flask,
     Response,
     current_app,
     url_for,
     request,
+    stream_with_context,
 )
 from flask.views import MethodView
+from werkzeug.http import is_resource_modified
 
 from ..helpers import (
     YoutubePlaylistEpisodeFeed,
     leniently_validate_youtube_id,
+    parse_positive_int_arg,
     escape_for_xml,
+    escape_xml_text,
+    escape_xml_attribute,
     get_itunes_artwork,
+    VideoValidator,
+    SharedTTLCache,
+    MediaMetadataStore,
+    refresh_playlist,
+    get_configured_playlist_ids,
+    timing_span,
 )
-from ..models import EpisodeDetails, ServiceConfig, FeedOptions
+from ..models import (
+    EpisodeDetails,
+    ItemDetails,
+    PodcastConfig,
+    ServiceConfig,
+    FeedOptions,
+    FeedValidators,
+    RenderedFeed,
+    EpisodeWindow,
+    FeedPage,
+    MediaMetadata,
+)
+
+# Expired validators are kept for a while so that a feed regenerated without changes keeps its Last-Modified time
+_feed_validators = SharedTTLCache(
+    "rss_feed_validators", ttl=timedelta(minutes=60), max_stale=timedelta(days=30)
+)
+_rendered_feeds = SharedTTLCache("rendered_feeds", ttl=timedelta(minutes=60))
 
 
 class Image(TypedDict):
@@ -63,45 +94,157 @@ def add_host(url: str, generator_options: FeedOptions) -> str:
 def is_valid_description(description: Optional[str]) -> bool:
     return description is not None and description != "" and not description.isspace()
 
+
+MEDIA_URL_VIDEO_ID_PLACEHOLDER = "VIDEOIDPLACEHOLDER"
+RSS_NAMESPACES = (
+    ("itunes", "http://www.itunes.com/dtds/podcast-1.0.dtd"),
+    ("atom", "http://www.w3.org/2005/Atom"),
+    ("content", "http://purl.org/rss/1.0/modules/content/"),
+)
+# These match feedgen's defaults so the streamed feed is identical to the one feedgen generates
+RSS_DOCS_URL = "http://www.rssboard.org/rss-specification"
+RSS_GENERATOR = "python-feedgen"
+# The page size of paged feeds (requested with the page query parameter) that don't set a limit
+DEFAULT_PAGE_SIZE = 50
+PAGING_LINK_RELATIONS = ("first", "previous", "next", "last")
+
+
+def get_feed_categories(generator_options: FeedOptions) -> Sequence[str]:
+    # The categories cut out of the episodes the feed links to
+    podcast_config = generator_options.podcast_config
+    if podcast_config is not None and podcast_config.categories_to_remove is not None:
+        return podcast_config.categories_to_remove
+    return generator_options.service_config.categories_to_remove
+
+
+def get_media_url_template(generator_options: FeedOptions) -> str:
+    # url_for is comparatively slow, so it runs once per feed and each episode's video ID is substituted in afterwards
+    service_config = generator_options.service_config
+    url_args = dict()
+    if service_config.append_auth_param_to_resource_links:
+        url_args["key"] = service_config.auth_key
+    # Podcasts that remove their own categories link to the variant of each episode cut for those categories
+    feed_categories = get_feed_categories(generator_options)
+    if feed_categories != service_config.categories_to_remove:
+        url_args["categories"] = ",".join(feed_categories)
+    with timing_span("urls"):
+        media_url = url_for(
+            "youtube_media_view", video_id=MEDIA_URL_VIDEO_ID_PLACEHOLDER, **url_args
+        )
+        return add_host(media_url, generator_options)
+
+
+def load_media_metadata(
+    episodes: Iterable[EpisodeDetails], generator_options: FeedOptions
+) -> dict[str, MediaMetadata]:
+    # One query for the whole feed. Episodes that haven't been downloaded yet are missing
+    with timing_span("media-metadata"):
+        return MediaMetadataStore(
+            generator_options.service_config.data_path
+        ).get_media_metadata(
+            (episode.id for episode in episodes),
+            get_feed_categories(generator_options),
+        )
+
+
+def get_itunes_duration(media_metadata: Optional[MediaMetadata]) -> Optional[str]:
+    if media_metadata is None or media_metadata.duration is None:
+        return None
+    return str(round(media_metadata.duration))
+
+
+def create_enclosure(
+    episode: EpisodeDetails,
+    media_url_template: str,
+    generator_options: FeedOptions,
+    media_metadata: Optional[MediaMetadata],
+) -> Enclosure:
+    return Enclosure(
+        # Apple podcasts requires the file extension
+        url=media_url_template.replace(
+            MEDIA_URL_VIDEO_ID_PLACEHOLDER, f"{episode.id}.m4a"
+        ),
+        type=(
+            "audio/x-m4a"  # Apple podcasts requires this instead of audio/mp4
+            if generator_options.service_config.append_auth_param_to_resource_links
+            else "audio/mp4"
+        ),
+        # Episodes that haven't been downloaded don't have a size yet
+        length="0" if media_metadata is None else str(media_metadata.size),
+    )
+
+
+def get_episode_description(episode: EpisodeDetails) -> str:
+    if is_valid_description(episode.description):
+        return episode.description
+    return "No description available"
+
+
+def get_feed_description(
+    playlist_details: ItemDetails, podcast_config: Optional[PodcastConfig]
+) -> str:
+    if podcast_config is not None and is_valid_description(podcast_config.description):
+        return escape_for_xml(podcast_config.description)
+    elif is_valid_description(playlist_details.description):
+        return escape_for_xml(playlist_details.description)
+    return "No description available"
+
+
+def get_logo_url(
+    playlist_episode_feed: YoutubePlaylistEpisodeFeed, generator_options: FeedOptions
+) -> str:
+    podcast_logo_url = playlist_episode_feed.logo
+    if not is_absolute(podcast_logo_url):
+        podcast_logo_url = add_host(podcast_logo_url, generator_options)
+    return podcast_logo_url
+
+
+def get_itunes_artwork_url(
+    podcast_config: Optional[PodcastConfig], artwork_size: int
+) -> Optional[str]:
+    if podcast_config is None or podcast_config.itunes_id is None:
+        return None
+    try:
+        with timing_span("itunes"):
+            itunes_artwork_url = get_itunes_artwork(
+                podcast_config.itunes_id, artwork_size
+            )
+    except ValueError:
+        logging.exception("Failed to grab iTunes artwork")
+        return None
+    # iTunes only accepts jpg and png artwork (feedgen silently drops anything else)
+    if not itunes_artwork_url.endswith((".jpg", ".png")):
+        return None
+    return itunes_artwork_url
+
+
+def get_youtube_playlist_url(playlist_details: ItemDetails) -> str:
+    return (
+        f"https://www.youtube.com/playlist?{urlencode({'list': playlist_details.id})}"
+    )
+
+
 def generate_episode_entry(
-    episode: EpisodeDetails, generator_options: FeedOptions
+    episode: EpisodeDetails,
+    media_url_template: str,
+    generator_options: FeedOptions,
+    media_metadata: Optional[MediaMetadata],
 ) -> FeedEntry:
     feed_entry = FeedEntry()
     feed_entry.id(episode.id)
     feed_entry.title(episode.title)
-    if is_valid_description(episode.description):
-        feed_entry.description(episode.description)
-    else:
-        feed_entry.description("No description available")
+    feed_entry.description(get_episode_description(episode))
     feed_entry.published(episode.published_at)
-    if generator_options.service_config.append_auth_param_to_resource_links:
-        feed_entry.enclosure(
-            **Enclosure(
-                url=add_host(
-                    url_for(
-                        # Apple podcasts requires the file extension
-                        "youtube_media_view",
-                        video_id=f"{episode.id}.m4a",
-                        key=generator_options.service_config.auth_key,
-                    ),
-                    generator_options,
-                ),
-                type="audio/x-m4a",  # Apple podcasts requires this instead of audio/mp4
-                length="0",
-            )
-        )
-    else:
-        feed_entry.enclosure(
-            **Enclosure(
-                url=add_host(
-                    # Apple podcasts requires the file extension
-                    url_for("youtube_media_view", video_id=f"{episode.id}.m4a"),
-                    generator_options,
-                ),
-                type="audio/mp4",  # Apple podcasts requires this instead of audio/mp4
-                length="0",
-            )
+    feed_entry.enclosure(
+        **create_enclosure(
+            episode, media_url_template, generator_options, media_metadata
         )
+    )
+    itunes_duration = get_itunes_duration(media_metadata)
+    if itunes_duration is not None:
+        feed_entry.load_extension("podcast")
+        # noinspection PyUnresolvedReferences
+        feed_entry.podcast.itunes_duration(itunes_duration)
     return feed_entry
 
 
@@ -111,16 +254,11 @@ def populate_feed_generator(
     playlist_details = playlist_episode_feed.playlist_details
     feed_generator = FeedGenerator()
     feed_generator.title(escape_for_xml(playlist_details.title))
-    youtube_playlist_url = (
-        f"https://www.youtube.com/playlist?{urlencode({'list': playlist_details.id})}"
-    )
-    podcast_logo_url = playlist_episode_feed.logo
-    if not is_absolute(podcast_logo_url):
-        podcast_logo_url = add_host(podcast_logo_url, generator_options)
+    youtube_playlist_url = get_youtube_playlist_url(playlist_details)
     feed_generator.link(Link(href=youtube_playlist_url, rel=None, type=None))
     feed_generator.image(
         **Image(
-            url=podcast_logo_url,
+            url=get_logo_url(playlist_episode_feed, generator_options),
             link=youtube_playlist_url,
         )
     )
@@ -130,13 +268,11 @@ def populate_feed_generator(
     podcast_feed_generator = feed_generator.podcast
     podcast_feed_generator.itunes_author(playlist_details.author.name)
     if podcast_config is not None:
-        if podcast_config.itunes_id is not None:
-            try:
-                itunes_artwork_url = get_itunes_artwork(podcast_config.itunes_id)
-            except ValueError as exception:
-                logging.error("Failed to grab iTunes artwork", exception)
-            else:
-                podcast_feed_generator.itunes_image(itunes_artwork_url)
+        itunes_artwork_url = get_itunes_artwork_url(
+            podcast_config, generator_options.service_config.artwork_size
+        )
+        if itunes_artwork_url is not None:
+            podcast_feed_generator.itunes_image(itunes_artwork_url)
         if podcast_config.language is not None:
             feed_generator.language(escape_for_xml(podcast_config.language))
         if podcast_config.explicit is not None:
@@ -147,32 +283,411 @@ def populate_feed_generator(
             podcast_feed_generator.itunes_category(
                 escape_for_xml(podcast_config.itunes_category)
             )
-    if podcast_config is not None and is_valid_description(podcast_config.description):
-        feed_generator.subtitle(escape_for_xml(podcast_config.description))
-    elif is_valid_description(playlist_details.description):
-        feed_generator.subtitle(escape_for_xml(playlist_details.description))
-    else:
-        feed_generator.subtitle("No description available")
+    feed_generator.subtitle(get_feed_description(playlist_details, podcast_config))
     feed_generator.id(playlist_details.id)
     return feed_generator
 
 
-@cached(
-    TTLCache(maxsize=1024, ttl=timedelta(minutes=60).total_seconds()),
-    key=lambda episode_feed, generator_options: hashkey(
-        episode_feed.playlist_details.id, generator_options.host
-    ),
-)
 def generate_rss_feed(
     episode_feed: YoutubePlaylistEpisodeFeed, generator_options: FeedOptions
+) -> bytes:
+    # Builds the whole feed as an lxml tree with feedgen. The RSS view streams feeds with stream_rss_feed instead, which
+    # produces the same XML; this is kept as the reference implementation for comparing against
+    feed_generator = populate_feed_generator(episode_feed, generator_options)
+    media_url_template = get_media_url_template(generator_options)
+    episodes = tuple(episode_feed)
+    media_metadata = load_media_metadata(episodes, generator_options)
+    with timing_span("entries"):
+        for episode in episodes:
+            feed_generator.add_entry(
+                generate_episode_entry(
+                    episode,
+                    media_url_template,
+                    generator_options,
+                    media_metadata.get(episode.id),
+                )
+            )
+    with timing_span("serialize"):
+        return feed_generator.rss_str()
+
+
+def get_window_args() -> dict[str, int]:
+    # The windowing query parameters that were provided, which are carried over to the paging links
+    window_args = dict()
+    for name in ("limit", "days"):
+        value = parse_positive_int_arg(name)
+        if value is not None:
+            window_args[name] = value
+    return window_args
+
+
+def get_episode_window(
+    window_args: dict[str, int], page: int, podcast_config: Optional[PodcastConfig]
+) -> EpisodeWindow:
+    limit = window_args.get("limit")
+    days = window_args.get("days")
+    if podcast_config is not None:
+        limit = limit if limit is not None else podcast_config.episode_limit
+        days = days if days is not None else podcast_config.episode_window_days
+    if limit is None and page > 1:
+        limit = DEFAULT_PAGE_SIZE
+    published_after = None
+    if days is not None:
+        # Windows start at midnight so that every request on the same day shares one cached feed
+        published_after = datetime.now(timezone.utc).replace(
+            hour=0, minute=0, second=0, microsecond=0
+        ) - timedelta(days=days)
+    return EpisodeWindow(
+        limit=limit,
+        offset=0 if limit is None else (page - 1) * limit,
+        published_after=published_after,
+    )
+
+
+def get_paging_links(
+    playlist_id: str,
+    window_args: dict[str, int],
+    page: int,
+    page_count: int,
+    generator_options: FeedOptions,
+) -> dict[str, str]:
+    if page_count <= 1:
+        return dict()
+    link_pages = {
+        "first": 1,
+        "previous": page - 1 if page > 1 else None,
+        "next": page + 1 if page < page_count else None,
+        "last": page_count,
+    }
+    url_args = dict(window_args)
+    if generator_options.service_config.append_auth_param_to_resource_links:
+        url_args["key"] = generator_options.service_config.auth_key
+    return {
+        relation: add_host(
+            url_for(
+                "youtube_rss_view", playlist_id=playlist_id, page=link_page, **url_args
+            ),
+            generator_options,
+        )
+        for relation, link_page in link_pages.items()
+        if link_page is not None
+    }
+
+
+def load_feed_page(
+    episode_feed: YoutubePlaylistEpisodeFeed,
+    window: EpisodeWindow,
+    window_args: dict[str, int],
+    page: int,
+    generator_options: FeedOptions,
+) -> FeedPage:
+    # Only the episodes in the window are loaded from the episode store, no matter how long the playlist is
+    page_count = 1
+    if window.limit is not None:
+        episode_count = episode_feed.count_episodes(window)
+        page_count = max(1, -(-episode_count // window.limit))
+    episodes = episode_feed.get_episodes(window)
+    with timing_span("urls"):
+        paging_links = get_paging_links(
+            episode_feed.playlist_details.id,
+            window_args,
+            page,
+            page_count,
+            generator_options,
+        )
+    return FeedPage(
+        episodes=episodes,
+        links=paging_links,
+        media_metadata=load_media_metadata(episodes, generator_options),
+    )
+
+
+def text_element(name: str, text: str) -> str:
+    return f"<{name}>{escape_xml_text(text)}</{name}>"
+
+
+def generate_channel_header(
+    episode_feed: YoutubePlaylistEpisodeFeed,
+    generator_options: FeedOptions,
+    build_date: datetime,
+    paging_links: dict[str, str],
+) -> str:
+    playlist_details = episode_feed.playlist_details
+    podcast_config = generator_options.podcast_config
+    title = escape_for_xml(playlist_details.title)
+    youtube_playlist_url = get_youtube_playlist_url(playlist_details)
+    namespaces = " ".join(
+        f'xmlns:{prefix}="{escape_xml_attribute(uri)}"'
+        for prefix, uri in RSS_NAMESPACES
+    )
+    header_parts = [
+        "<?xml version='1.0' encoding='UTF-8'?>\n",
+        f'<rss {namespaces} version="2.0"><channel>',
+        text_element("title", title),
+        text_element("link", youtube_playlist_url),
+        text_element(
+            "description", get_feed_description(playlist_details, podcast_config)
+        ),
+        *(
+            f'<atom:link rel="{relation}" href="{escape_xml_attribute(paging_links[relation])}"/>'
+            for relation in PAGING_LINK_RELATIONS
+            if relation in paging_links
+        ),
+        text_element("docs", RSS_DOCS_URL),
+        text_element("generator", RSS_GENERATOR),
+        "<image>",
+        text_element("url", get_logo_url(episode_feed, generator_options)),
+        text_element("title", title),
+        text_element("link", youtube_playlist_url),
+        "</image>",
+    ]
+    if podcast_config is not None and podcast_config.language is not None:
+        header_parts.append(
+            text_element("language", escape_for_xml(podcast_config.language))
+        )
+    header_parts.append(text_element("lastBuildDate", format_datetime(build_date)))
+    header_parts.append(text_element("itunes:author", playlist_details.author.name))
+    if podcast_config is not None:
+        if podcast_config.itunes_category is not None:
+            itunes_category = escape_for_xml(podcast_config.itunes_category)
+            header_parts.append(
+                f'<itunes:category text="{escape_xml_attribute(itunes_category)}"/>'
+            )
+        itunes_artwork_url = get_itunes_artwork_url(
+            podcast_config, generator_options.service_config.artwork_size
+        )
+        if itunes_artwork_url is not None:
+            header_parts.append(
+                f'<itunes:image href="{escape_xml_attribute(itunes_artwork_url)}"/>'
+            )
+        if podcast_config.explicit is not None:
+            header_parts.append(
+                text_element(
+                    "itunes:explicit", "yes" if podcast_config.explicit else "no"
+                )
+            )
+    return "".join(header_parts)
+
+
+def generate_episode_item(
+    episode: EpisodeDetails,
+    media_url_template: str,
+    generator_options: FeedOptions,
+    media_metadata: Optional[MediaMetadata],
 ) -> str:
-    logging.info(
-        f"Generating RSS feed for YouTube playlist {episode_feed.playlist_details.id}"
+    enclosure = create_enclosure(
+        episode, media_url_template, generator_options, media_metadata
     )
-    feed_generator = populate_feed_generator(episode_feed, generator_options)
-    for episode in episode_feed:
-        feed_generator.add_entry(generate_episode_entry(episode, generator_options))
-    return feed_generator.rss_str()
+    item_parts = [
+        "<item>",
+        text_element("title", episode.title),
+        text_element("description", get_episode_description(episode)),
+        f'<guid isPermaLink="false">{escape_xml_text(episode.id)}</guid>',
+        f'<enclosure url="{escape_xml_attribute(enclosure["url"])}"'
+        f' length="{escape_xml_attribute(enclosure["length"])}"'
+        f' type="{escape_xml_attribute(enclosure["type"])}"/>',
+        text_element("pubDate", format_datetime(episode.published_at)),
+    ]
+    itunes_duration = get_itunes_duration(media_metadata)
+    if itunes_duration is not None:
+        item_parts.append(text_element("itunes:duration", itunes_duration))
+    item_parts.append("</item>")
+    return "".join(item_parts)
+
+
+def stream_rss_feed(
+    episode_feed: YoutubePlaylistEpisodeFeed,
+    generator_options: FeedOptions,
+    feed_page: Optional[FeedPage] = None,
+    build_date: Optional[datetime] = None,
+) -> Iterator[bytes]:
+    # Writes the feed one episode at a time instead of building an lxml tree for the whole playlist. Like feedgen
+    # (which prepends entries), episodes are written newest first. Without a page, the whole playlist is written
+    if feed_page is None:
+        episodes = episode_feed.get_episodes()
+        feed_page = FeedPage(
+            episodes=episodes,
+            links=dict(),
+            media_metadata=load_media_metadata(episodes, generator_options),
+        )
+    if build_date is None:
+        build_date = datetime.now(timezone.utc)
+    media_url_template = get_media_url_template(generator_options)
+    yield generate_channel_header(
+        episode_feed, generator_options, build_date, feed_page.links
+    ).encode()
+    for episode in feed_page.episodes:
+        # Only the time taken to write each item counts, not the time spent waiting for the client to take it
+        with timing_span("serialize"):
+            item = generate_episode_item(
+                episode,
+                media_url_template,
+                generator_options,
+                feed_page.media_metadata.get(episode.id),
+            ).encode()
+        yield item
+    yield b"</channel></rss>"
+
+
+def compute_feed_validators(
+    episode_feed: YoutubePlaylistEpisodeFeed,
+    generator_options: FeedOptions,
+    feed_page: FeedPage,
+    previous_validators: Optional[FeedValidators],
+) -> FeedValidators:
+    # The ETag covers everything that goes into the feed except the build date, so regenerating an unchanged feed
+    # gives it the same ETag. Last-Modified is when the ETag last changed: an episode's publish date would miss edits
+    # and removals, and clients that only send If-Modified-Since would keep their old feed
+    episodes = feed_page.episodes
+    feed_fingerprint = repr(
+        (
+            episode_feed.playlist_details,
+            episode_feed.logo,
+            generator_options.podcast_config,
+            generator_options.host,
+            generator_options.service_config.append_auth_param_to_resource_links,
+            tuple(episodes),
+            feed_page.links,
+            feed_page.media_metadata,
+        )
+    )
+    etag = hashlib.sha256(feed_fingerprint.encode()).hexdigest()
+    if previous_validators is not None and previous_validators.etag == etag:
+        return previous_validators
+    # HTTP dates don't have fractions of a second
+    return FeedValidators(
+        etag=etag, last_modified=datetime.now(timezone.utc).replace(microsecond=0)
+    )
+
+
+def get_feed_cache_key(
+    playlist_id: str, host: str, window: EpisodeWindow, window_args: dict[str, int]
+) -> tuple:
+    # The window args are part of the key as well as the window, since they're carried over to the paging links
+    return hashkey(playlist_id, host, window, tuple(sorted(window_args.items())))
+
+
+def cache_rendered_feed(
+    feed_chunks: Iterable[bytes],
+    feed_cache_key: tuple,
+    feed_validators: FeedValidators,
+) -> Iterator[bytes]:
+    # Passes the feed through to the client and caches it once all of it has been written. A feed that wasn't fully
+    # sent (e.g. because the client disconnected) is not cached
+    written_chunks = []
+    for feed_chunk in feed_chunks:
+        written_chunks.append(feed_chunk)
+        yield feed_chunk
+    _rendered_feeds[feed_cache_key] = RenderedFeed(
+        b"".join(written_chunks), feed_validators
+    )
+
+
+def add_feed_cache_headers(
+    response: Response, feed_validators: FeedValidators, service_config: ServiceConfig
+) -> Response:
+    response.set_etag(feed_validators.etag, weak=True)
+    response.last_modified = feed_validators.last_modified
+    # Feeds behind authentication must not be stored by shared caches
+    if service_config.auth_key is not None:
+        response.cache_control.private = True
+    else:
+        response.cache_control.public = True
+    response.cache_control.max_age = service_config.feed_max_age_seconds
+    return response
+
+
+def render_feed(
+    episode_feed: YoutubePlaylistEpisodeFeed,
+    feed_options: FeedOptions,
+    window: EpisodeWindow,
+    window_args: dict[str, int],
+    page: int,
+    feed_cache_key: tuple,
+) -> tuple[Iterator[bytes], FeedValidators]:
+    # Returns the feed's chunks, which cache the rendered feed once they've all been written, and its validators
+    feed_page = load_feed_page(episode_feed, window, window_args, page, feed_options)
+    with timing_span("validators"):
+        previous_entry = _feed_validators.get_entry(feed_cache_key)
+        feed_validators = compute_feed_validators(
+            episode_feed,
+            feed_options,
+            feed_page,
+            previous_entry[0] if previous_entry is not None else None,
+        )
+    _feed_validators[feed_cache_key] = feed_validators
+    # Podcast apps will request media for the episodes in this feed, so there's no need to ask YouTube about them again
+    video_validator: VideoValidator = current_app.config["PODCAST_VIDEO_VALIDATOR"]
+    video_validator.remember_valid_video_ids(
+        episode.id for episode in feed_page.episodes
+    )
+    feed_chunks = cache_rendered_feed(
+        stream_rss_feed(episode_feed, feed_options, feed_page),
+        feed_cache_key,
+        feed_validators,
+    )
+    return feed_chunks, feed_validators
+
+
+def refresh_rendered_feed(playlist_id: str, service_config: ServiceConfig) -> None:
+    # Renders the feed a poll without query parameters gets into the feed caches. Runs in a request context for one of
+    # the trusted hosts, since feeds are cached per host
+    host = request.host if len(service_config.trusted_hosts) > 0 else ""
+    window_args = dict()
+    podcast_config = service_config.podcast_configs.get(playlist_id)
+    window = get_episode_window(window_args, 1, podcast_config)
+    feed_options = FeedOptions(service_config, podcast_config, host)
+    episode_feed = YoutubePlaylistEpisodeFeed(
+        playlist_id=playlist_id, feed_options=feed_options
+    )
+    feed_chunks, _ = render_feed(
+        episode_feed,
+        feed_options,
+        window,
+        window_args,
+        1,
+        get_feed_cache_key(playlist_id, host, window, window_args),
+    )
+    for _ in feed_chunks:
+        pass
+
+
+def refresh_feed(playlist_id: str, service_config: ServiceConfig, app: Flask) -> None:
+    logging.info(f"Refreshing RSS feed for YouTube playlist {playlist_id}")
+    podcast_config = service_config.podcast_configs.get(playlist_id)
+    base_urls = service_config.trusted_hosts or (None,)
+    with app.test_request_context(base_url=base_urls[0]):
+        refresh_playlist(playlist_id, FeedOptions(service_config, podcast_config, ""))
+    if podcast_config is not None and podcast_config.itunes_id is not None:
+        try:
+            get_itunes_artwork.refresh(
+                podcast_config.itunes_id, service_config.artwork_size
+            )
+        except ValueError:
+            logging.exception("Failed to refresh iTunes artwork")
+    for base_url in base_urls:
+        with app.test_request_context(base_url=base_url):
+            refresh_rendered_feed(playlist_id, service_config)
+
+
+def refresh_configured_feeds(service_config: ServiceConfig, app: Flask) -> None:
+    # Refreshes every configured playlist's data and rendered feeds ahead of demand, a few playlists at a time
+    playlist_ids = get_configured_playlist_ids(service_config)
+    with ThreadPoolExecutor(
+        max_workers=service_config.feed_refresh_concurrency,
+        thread_name_prefix="feed-refresh",
+    ) as executor:
+        refreshes = {
+            executor.submit(refresh_feed, playlist_id, service_config, app): playlist_id
+            for playlist_id in playlist_ids
+        }
+        for refresh in as_completed(refreshes):
+            try:
+                refresh.result()
+            except Exception:
+                logging.exception(
+                    f"Failed to refresh RSS feed for YouTube playlist {refreshes[refresh]}"
+                )
 
 
 class YoutubeRSSView(MethodView):
@@ -181,6 +696,27 @@ class YoutubeRSSView(MethodView):
         playlist_id = service_config.aliases.get(playlist_id.lower(), playlist_id)
         if not leniently_validate_youtube_id(playlist_id):
             return Response("Invalid playlist ID", status=400)
+        host = request.host if len(service_config.trusted_hosts) > 0 else ""
+        try:
+            window_args = get_window_args()
+            page = parse_positive_int_arg("page") or 1
+        except ValueError:
+            return Response("Invalid limit, days or page", status=400)
+        window = get_episode_window(
+            window_args, page, service_config.podcast_configs.get(playlist_id)
+        )
+        feed_cache_key = get_feed_cache_key(playlist_id, host, window, window_args)
+        # Pollers that already have the current feed are answered before any feed or API work happens
+        with timing_span("feed-cache"):
+            feed_validators = _feed_validators.get(feed_cache_key)
+        if feed_validators is not None and not is_resource_modified(
+            request.environ,
+            etag=feed_validators.etag,
+            last_modified=feed_validators.last_modified,
+        ):
+            return add_feed_cache_headers(
+                Response(status=304), feed_validators, service_config
+            )
         feed_options = FeedOptions(service_config, None, request.host)
         try:
             episode_feed = YoutubePlaylistEpisodeFeed(
@@ -192,9 +728,22 @@ class YoutubeRSSView(MethodView):
             episode_feed.playlist_details.id
         )
         feed_options.podcast_config = podcast_config
-        if len(service_config.trusted_hosts) < 1:
-            feed_options.host = ""
-        return Response(
-            generate_rss_feed(episode_feed, feed_options),
-            mimetype="application/rss+xml",
+        feed_options.host = host
+        with timing_span("feed-cache"):
+            rendered_feed = _rendered_feeds.get(feed_cache_key)
+        if rendered_feed is not None:
+            response = Response(rendered_feed.content, mimetype="application/rss+xml")
+            add_feed_cache_headers(response, rendered_feed.validators, service_config)
+            return response.make_conditional(request)
+        logging.info(f"Generating RSS feed for YouTube playlist {playlist_id}")
+        feed_chunks, feed_validators = render_feed(
+            episode_feed, feed_options, window, window_args, page, feed_cache_key
+        )
+        response = Response(
+            stream_with_context(feed_chunks), mimetype="application/rss+xml"
         )
+        # Otherwise make_conditional writes the whole feed into memory to work out its Content-Length
+        response.implicit_sequence_conversion = False
+        add_feed_cache_headers(response, feed_validators, service_config)
+        # A client that already has this version of the feed gets a 304 and the feed is never generated
+        return response.make_conditional(request)
@@ -0,0 +1,101 @@
+import os
+import time
+from datetime import timedelta
+from pathlib import Path
+
+from podcastsponsorblock.helpers.audiocache import AudioCache
+from podcastsponsorblock.helpers.downloadcoordinator import DownloadCoordinator
+
+HOUR_SECONDS = 60 * 60
+
+
+def create_audio_file(
+    data_path: Path, cache_path: str, size: int, hours_ago: float
+) -> Path:
+    path = data_path / cache_path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"x" * size)
+    accessed_at = time.time() - hours_ago * HOUR_SECONDS
+    os.utime(path, (accessed_at, accessed_at))
+    return path
+
+
+def test_files_on_disk_are_counted_without_limits(tmp_path):
+    create_audio_file(tmp_path, "audio/video1.sponsor.m4a", 100, hours_ago=1)
+    create_audio_file(tmp_path, "source/video1.m4a", 300, hours_ago=1)
+    create_audio_file(tmp_path, "audio/video2.sponsor.streaming.m4a", 50, hours_ago=0)
+    audio_cache = AudioCache(tmp_path)
+
+    audio_cache.evict(DownloadCoordinator(tmp_path), max_bytes=None, max_age=None)
+
+    statistics = audio_cache.get_statistics(None)
+    assert (statistics.file_count, statistics.total_bytes) == (2, 400)
+    assert statistics.evicted_files == 0
+
+
+def test_least_recently_used_files_are_evicted_until_within_budget(tmp_path):
+    oldest = create_audio_file(tmp_path, "audio/video1.sponsor.m4a", 100, hours_ago=3)
+    older = create_audio_file(tmp_path, "audio/video2.sponsor.m4a", 100, hours_ago=2)
+    newer = create_audio_file(tmp_path, "audio/video3.sponsor.m4a", 100, hours_ago=1)
+    audio_cache = AudioCache(tmp_path)
+
+    audio_cache.evict(DownloadCoordinator(tmp_path), max_bytes=150, max_age=None)
+
+    assert (oldest.exists(), older.exists(), newer.exists()) == (False, False, True)
+    statistics = audio_cache.get_statistics(150)
+    assert (statistics.total_bytes, statistics.evicted_files) == (100, 2)
+
+
+def test_files_older_than_the_max_age_are_evicted(tmp_path):
+    expired = create_audio_file(tmp_path, "audio/video1.sponsor.m4a", 100, hours_ago=3)
+    kept = create_audio_file(tmp_path, "audio/video2.sponsor.m4a", 100, hours_ago=1)
+
+    AudioCache(tmp_path).evict(
+        DownloadCoordinator(tmp_path), max_bytes=None, max_age=timedelta(hours=2)
+    )
+
+    assert (expired.exists(), kept.exists()) == (False, True)
+
+
+def test_busy_and_recently_accessed_files_are_kept(tmp_path):
+    downloading = create_audio_file(
+        tmp_path, "audio/video1.sponsor.m4a", 100, hours_ago=3
+    )
+    served = create_audio_file(tmp_path, "audio/video2.sponsor.m4a", 100, hours_ago=3)
+    recent = create_audio_file(tmp_path, "audio/video3.sponsor.m4a", 100, hours_ago=0)
+    coordinator = DownloadCoordinator(tmp_path)
+    audio_cache = AudioCache(tmp_path)
+    # Opening a file for serving marks it as accessed, so it's made old again to leave only the lock protecting it
+    serving_file = audio_cache.open_for_serving(served)
+    audio_cache._connection().execute(
+        "UPDATE audio_cache_entries SET last_accessed_at = ?",
+        (time.time() - 3 * HOUR_SECONDS,),
+    )
+
+    with serving_file, coordinator.lock("video1"):
+        audio_cache.evict(coordinator, max_bytes=0, max_age=None)
+
+    assert downloading.exists() and served.exists() and recent.exists()
+
+
+def test_old_lock_files_are_removed_unless_held(tmp_path):
+    coordinator = DownloadCoordinator(tmp_path)
+    with coordinator.lock("video1"):
+        pass
+    with coordinator.lock("video2"):
+        pass
+    with coordinator.lock("video3"):
+        pass
+    (tmp_path / "locks" / "video1.failed").write_text("Download failed")
+    for key in ("video1", "video2"):
+        old_at = time.time() - 2 * HOUR_SECONDS
+        os.utime(tmp_path / "locks" / f"{key}.lock", (old_at, old_at))
+    os.utime(tmp_path / "locks" / "video1.failed", (old_at, old_at))
+
+    with coordinator.lock("video2"):
+        AudioCache(tmp_path).evict(coordinator, max_bytes=None, max_age=None)
+
+    assert sorted(path.name for path in (tmp_path / "locks").iterdir()) == [
+        "video2.lock",
+        "video3.lock",
+    ]
@@ -0,0 +1,25 @@
+import threading
+import time
+
+from podcastsponsorblock.helpers.downloadcoordinator import DownloadCoordinator
+
+
+def test_a_lock_is_retaken_when_its_file_is_removed_while_waiting(tmp_path):
+    coordinator = DownloadCoordinator(tmp_path)
+    waiter_holds_lock = threading.Event()
+
+    def wait_for_lock():
+        with coordinator.lock("video1"):
+            waiter_holds_lock.set()
+            time.sleep(0.2)
+
+    with coordinator.lock("video1"):
+        waiter = threading.Thread(target=wait_for_lock)
+        waiter.start()
+        time.sleep(0.1)
+        (tmp_path / "locks" / "video1.lock").unlink()
+    waiter_holds_lock.wait(5)
+
+    # The waiter's lock is on the file that replaced the removed one, so it's visible to everyone else
+    assert coordinator.is_locked("video1")
+    waiter.join()
@@ -0,0 +1,72 @@
+import time
+
+from podcastsponsorblock.helpers.database import get_database_connection
+from podcastsponsorblock.helpers.downloadqueue import (
+    JOB_QUEUED,
+    JOB_RUNNING,
+    PRIORITY_BACKGROUND,
+    PRIORITY_LISTENER,
+    STALE_RUNNING_JOB_AGE,
+    DownloadQueue,
+)
+
+
+def make_job_stale(download_queue: DownloadQueue, video_id: str) -> None:
+    stale_at = time.time() - STALE_RUNNING_JOB_AGE.total_seconds() - 1
+    get_database_connection(download_queue.data_path).execute(
+        "UPDATE download_jobs SET updated_at = ? WHERE video_id = ?",
+        (stale_at, video_id),
+    )
+
+
+def test_nothing_is_claimed_from_an_empty_queue(tmp_path):
+    assert DownloadQueue(tmp_path, 1).claim_next_job() is None
+
+
+def test_jobs_are_claimed_by_priority_then_age(tmp_path):
+    download_queue = DownloadQueue(tmp_path, 3)
+    download_queue.enqueue("background", PRIORITY_BACKGROUND)
+    download_queue.enqueue("listener1", PRIORITY_LISTENER)
+    download_queue.enqueue("listener2", PRIORITY_LISTENER)
+
+    claimed = [download_queue.claim_next_job() for _ in range(3)]
+
+    assert claimed == ["listener1", "listener2", "background"]
+    assert download_queue.get_job("listener1").state == JOB_RUNNING
+    assert download_queue.get_job("listener1").attempts == 1
+
+
+def test_jobs_are_not_claimed_beyond_the_concurrency_limit(tmp_path):
+    download_queue = DownloadQueue(tmp_path, 1)
+    download_queue.enqueue("video1")
+    download_queue.enqueue("video2")
+
+    assert download_queue.claim_next_job() == "video1"
+    assert download_queue.claim_next_job() is None
+
+    download_queue.finish_job("video1")
+    assert download_queue.claim_next_job() == "video2"
+
+
+def test_stale_jobs_without_a_lock_are_requeued(tmp_path):
+    download_queue = DownloadQueue(tmp_path, 1)
+    download_queue.enqueue("video1")
+    download_queue.claim_next_job()
+    make_job_stale(download_queue, "video1")
+
+    download_queue.requeue_stale_jobs()
+
+    assert download_queue.get_job("video1").state == JOB_QUEUED
+    assert download_queue.claim_next_job() == "video1"
+
+
+def test_stale_jobs_still_locked_by_a_worker_are_kept_running(tmp_path):
+    download_queue = DownloadQueue(tmp_path, 1)
+    download_queue.enqueue("video1")
+    download_queue.claim_next_job()
+    make_job_stale(download_queue, "video1")
+
+    with download_queue.coordinator.lock("video1"):
+        download_queue.requeue_stale_jobs()
+
+    assert download_queue.get_job("video1").state == JOB_RUNNING
@@ -0,0 +1,25 @@
+from podcastsponsorblock.helpers import AudioCache, DownloadQueue
+from podcastsponsorblock.main import populate_service_config
+from podcastsponsorblock.views.metricsview import get_gauge_values
+
+
+def test_audio_cache_gauges_count_files_written_outside_this_process(tmp_path):
+    config = populate_service_config(
+        {"PODCAST_YOUTUBE_API_KEY": "test-key", "PODCAST_DATA_PATH": str(tmp_path)}
+    )
+    download_queue = DownloadQueue(tmp_path, 1)
+    # e.g. by another worker, or before the service was restarted
+    for cache_path, size in (
+        ("audio/video1.sponsor.m4a", 100),
+        ("source/video1.m4a", 300),
+    ):
+        path = tmp_path / cache_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"x" * size)
+
+    AudioCache(tmp_path).evict(download_queue.coordinator, max_bytes=None, max_age=None)
+
+    gauge_values = get_gauge_values(config, download_queue)
+    assert gauge_values[("podcast_audio_cache_bytes", "")] == 400
+    assert gauge_values[("podcast_audio_cache_files", "")] == 2
+    assert ("podcast_audio_cache_max_bytes", "") not in gauge_values
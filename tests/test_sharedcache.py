@@ -0,0 +1,100 @@
+import threading
+import time
+from datetime import timedelta
+from typing import Callable
+
+import pytest
+
+from podcastsponsorblock.helpers import sharedcache
+from podcastsponsorblock.helpers.sharedcache import SharedTTLCache, shared_cached
+
+
+@pytest.fixture(autouse=True)
+def shared_cache(tmp_path, monkeypatch):
+    # configure_shared_cache sets module state, which is put back after each test
+    monkeypatch.setattr(sharedcache, "_shared_cache_data_path", None)
+    sharedcache.configure_shared_cache(tmp_path)
+
+
+def create_counting_loader(
+    cache: SharedTTLCache, load_seconds: float = 0
+) -> tuple[list[str], Callable[[str], int]]:
+    loaded_keys = []
+
+    @shared_cached(cache)
+    def load(key: str) -> int:
+        time.sleep(load_seconds)
+        loaded_keys.append(key)
+        return len(loaded_keys)
+
+    return loaded_keys, load
+
+
+def wait_until(condition, timeout_seconds: float = 5) -> None:
+    deadline = time.monotonic() + timeout_seconds
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_concurrent_misses_load_the_entry_once():
+    loaded_keys, load = create_counting_loader(
+        SharedTTLCache("test", timedelta(minutes=1)), load_seconds=0.2
+    )
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(load("feed"))) for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert loaded_keys == ["feed"]
+    assert results == [1] * 8
+
+
+def test_expired_entries_are_served_while_refreshed_in_the_background():
+    cache = SharedTTLCache(
+        "test", timedelta(seconds=0.1), max_stale=timedelta(minutes=1)
+    )
+    loaded_keys, load = create_counting_loader(cache)
+    assert load("feed") == 1
+    time.sleep(0.15)
+
+    assert load("feed") == 1
+    wait_until(lambda: len(loaded_keys) == 2)
+    assert load("feed") == 2
+
+
+def test_entries_past_max_stale_are_loaded_again_before_returning():
+    cache = SharedTTLCache(
+        "test", timedelta(seconds=0.05), max_stale=timedelta(seconds=0.05)
+    )
+    loaded_keys, load = create_counting_loader(cache)
+    assert load("feed") == 1
+    time.sleep(0.15)
+
+    assert load("feed") == 2
+    assert loaded_keys == ["feed", "feed"]
+
+
+def test_failed_refreshes_keep_serving_the_stale_entry():
+    cache = SharedTTLCache(
+        "test", timedelta(seconds=0.1), max_stale=timedelta(minutes=1)
+    )
+    load_attempts = []
+
+    @shared_cached(cache)
+    def load(key: str) -> int:
+        load_attempts.append(key)
+        if len(load_attempts) > 1:
+            raise ConnectionError("YouTube is down")
+        return 1
+
+    assert load("feed") == 1
+    time.sleep(0.15)
+
+    assert load("feed") == 1
+    wait_until(lambda: len(load_attempts) == 2)
+    wait_until(lambda: len(sharedcache._refreshing_keys) == 0)
+    assert load("feed") == 1
@@ -0,0 +1,17 @@
+from podcastsponsorblock.helpers.sponsorblock import (
+    SPONSORBLOCK_CATEGORIES,
+    normalize_categories,
+)
+
+
+def test_categories_are_normalized():
+    assert normalize_categories([" sponsor", "intro", "", "sponsor "]) == (
+        "intro",
+        "sponsor",
+    )
+    assert normalize_categories(["all"]) == tuple(sorted(SPONSORBLOCK_CATEGORIES))
+
+
+def test_unknown_categories_are_dropped_with_a_warning(caplog):
+    assert normalize_categories(["sponsor", "sponser"]) == ("sponsor",)
+    assert "Ignoring unknown SponsorBlock category: sponser" in caplog.text
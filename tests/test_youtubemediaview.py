@@ -0,0 +1,41 @@
+from podcastsponsorblock.helpers import DownloadCoordinator
+from podcastsponsorblock.helpers.appliedsegmentstore import AppliedSegmentStore
+from podcastsponsorblock.helpers.database import get_database_connection
+from podcastsponsorblock.main import populate_service_config
+from podcastsponsorblock.views import youtubemediaview
+
+
+def test_a_failing_variant_does_not_stop_the_segment_check(tmp_path, monkeypatch):
+    config = populate_service_config(
+        {"PODCAST_YOUTUBE_API_KEY": "test-key", "PODCAST_DATA_PATH": str(tmp_path)}
+    )
+    applied_segment_store = AppliedSegmentStore(tmp_path)
+    categories = config.categories_to_remove
+    for video_id in ("video1", "video2"):
+        for path in (
+            youtubemediaview.get_source_audio_path(video_id, config),
+            youtubemediaview.get_audio_path(video_id, config, categories),
+        ):
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(b"x")
+        applied_segment_store.record_applied_segments(video_id, categories, ())
+    get_database_connection(tmp_path).execute(
+        "UPDATE applied_segments SET checked_at = 0"
+    )
+
+    def get_sponsor_segments(video_id, categories):
+        if video_id == "video1":
+            raise ConnectionError("SponsorBlock is down")
+        return ()
+
+    monkeypatch.setattr(youtubemediaview, "get_sponsor_segments", get_sponsor_segments)
+
+    youtubemediaview.check_sponsor_segments(config, DownloadCoordinator(tmp_path))
+
+    checked_at = dict(
+        get_database_connection(tmp_path)
+        .execute("SELECT video_id, checked_at FROM applied_segments")
+        .fetchall()
+    )
+    assert checked_at["video1"] > 0
+    assert checked_at["video2"] > 0
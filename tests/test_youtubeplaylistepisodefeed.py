@@ -0,0 +1,202 @@
+import threading
+from datetime import timedelta
+from typing import Iterable, Optional
+
+import httplib2
+from cachetools.keys import hashkey
+from googleapiclient.errors import HttpError
+
+from podcastsponsorblock.helpers import youtubeplaylistepisodefeed
+from podcastsponsorblock.helpers.episodestore import EpisodeStore
+from podcastsponsorblock.helpers.youtubeclientpool import get_youtube_client
+from podcastsponsorblock.helpers.youtubeplaylistepisodefeed import (
+    FULL_SYNC_INTERVAL,
+    PLAYLIST_PAGE_SIZE,
+    sync_playlist,
+    sync_playlist_fully,
+    sync_playlist_incrementally,
+)
+from podcastsponsorblock.models import Author, ItemDetails, PlaylistSyncState
+
+YOUTUBE_API_KEY = "test-key"
+
+
+def create_playlist_details(playlist_id: str) -> ItemDetails:
+    return ItemDetails(
+        playlist_id,
+        "Test Podcast",
+        None,
+        Author("Test Channel", "UCtest"),
+        "https://example.com/logo.jpg",
+    )
+
+
+def create_sync_state(playlist_id: str) -> PlaylistSyncState:
+    return PlaylistSyncState(
+        playlist_id=playlist_id,
+        total_results=0,
+        first_page_etag="etag",
+        page_tokens=[None],
+        known_video_ids=set(),
+        episodes=dict(),
+        full_synced_at=0,
+    )
+
+
+def test_stale_episode_sync_is_refreshed_with_its_own_client(tmp_path, monkeypatch):
+    playlist_details = create_playlist_details("PLstale")
+    refreshed = threading.Event()
+    # The client the loader was given, and the client belonging to the thread it ran on
+    refresh_clients = []
+
+    def sync_playlist(youtube_client, playlist_id):
+        refresh_clients.append((youtube_client, get_youtube_client(YOUTUBE_API_KEY)))
+        refreshed.set()
+        return create_sync_state(playlist_id)
+
+    monkeypatch.setattr(youtubeplaylistepisodefeed, "sync_playlist", sync_playlist)
+    sync_episodes_cached = youtubeplaylistepisodefeed.sync_episodes_cached
+    # Entries stored with a negative TTL are stale as soon as they're stored
+    monkeypatch.setattr(sync_episodes_cached.cache, "ttl", timedelta(seconds=-1))
+    sync_episodes_cached.cache[hashkey(playlist_details.id)] = 5
+    caller_client = get_youtube_client(YOUTUBE_API_KEY)
+
+    episode_count = sync_episodes_cached(
+        YOUTUBE_API_KEY, EpisodeStore(tmp_path), playlist_details
+    )
+
+    assert episode_count == 5
+    assert refreshed.wait(timeout=10)
+    # httplib2 isn't thread-safe, so the refresh must use its own thread's client
+    refresh_client, refresh_thread_client = refresh_clients[0]
+    assert refresh_client is refresh_thread_client
+    assert refresh_client is not caller_client
+
+
+class StubPlaylistItemsRequest:
+    def __init__(self, playlist: "StubPlaylist", page_token: Optional[str]):
+        self.playlist = playlist
+        self.page_token = page_token
+        self.headers = dict()
+
+    def execute(self) -> dict:
+        self.playlist.requested_page_tokens.append(self.page_token)
+        page = self.playlist.get_page(self.page_token)
+        if self.headers.get("If-None-Match") == page["etag"]:
+            raise HttpError(httplib2.Response({"status": 304}), b"")
+        return page
+
+
+# Stands in for a YouTube client serving one playlist, whose video IDs are listed newest first. Like YouTube's, a
+# page's ETag changes whenever the page or the playlist's item count does
+class StubPlaylist:
+    def __init__(self, video_ids: Iterable[str]):
+        self.video_ids = list(video_ids)
+        self.titles: dict[str, str] = dict()
+        self.requested_page_tokens: list[Optional[str]] = []
+
+    def playlistItems(self) -> "StubPlaylist":
+        return self
+
+    def list(
+        self, part: str, playlistId: str, maxResults: int, pageToken: Optional[str]
+    ) -> StubPlaylistItemsRequest:
+        return StubPlaylistItemsRequest(self, pageToken)
+
+    def create_playlist_item(self, video_id: str) -> dict:
+        return {
+            "snippet": {
+                "resourceId": {"videoId": video_id},
+                "title": self.titles.get(video_id, f"Episode {video_id}"),
+                "description": "",
+                "channelTitle": "Test Channel",
+                "channelId": "UCtest",
+                "thumbnails": {"default": {"url": "https://example.com/thumbnail.jpg"}},
+                "publishedAt": "2020-01-01T00:00:00Z",
+            },
+            "status": {"privacyStatus": "public"},
+        }
+
+    def get_page(self, page_token: Optional[str]) -> dict:
+        page_index = 0 if page_token is None else int(page_token)
+        first_index = page_index * PLAYLIST_PAGE_SIZE
+        items = [
+            self.create_playlist_item(video_id)
+            for video_id in self.video_ids[
+                first_index : first_index + PLAYLIST_PAGE_SIZE
+            ]
+        ]
+        page = {
+            "etag": repr((len(self.video_ids), items)),
+            "pageInfo": {"totalResults": len(self.video_ids)},
+            "items": items,
+        }
+        if first_index + PLAYLIST_PAGE_SIZE < len(self.video_ids):
+            page["nextPageToken"] = str(page_index + 1)
+        return page
+
+
+def create_video_ids(count: int) -> list[str]:
+    return [f"video{index:03d}" for index in range(count)]
+
+
+def sync_fully(playlist: StubPlaylist, playlist_id: str) -> PlaylistSyncState:
+    sync_state = sync_playlist_fully(playlist, playlist_id)
+    playlist.requested_page_tokens.clear()
+    return sync_state
+
+
+def test_unchanged_playlist_is_answered_by_its_first_page_etag():
+    playlist = StubPlaylist(create_video_ids(120))
+    sync_state = sync_fully(playlist, "PLunchanged")
+
+    assert sync_playlist_incrementally(playlist, sync_state)
+    assert playlist.requested_page_tokens == [None]
+    assert set(sync_state.episodes) == set(playlist.video_ids)
+
+
+def test_items_added_to_the_front_are_merged_from_the_first_page():
+    playlist = StubPlaylist(create_video_ids(120))
+    sync_state = sync_fully(playlist, "PLfrontadd")
+    playlist.video_ids[:0] = ["new000", "new001"]
+
+    assert sync_playlist_incrementally(playlist, sync_state)
+    assert playlist.requested_page_tokens == [None]
+    assert set(sync_state.episodes) == set(playlist.video_ids)
+    assert sync_state.total_results == 122
+    assert sync_state.first_page_etag == playlist.get_page(None)["etag"]
+
+
+def test_changed_first_page_without_new_items_is_merged():
+    playlist = StubPlaylist(create_video_ids(120))
+    sync_state = sync_fully(playlist, "PLedited")
+    playlist.titles["video001"] = "Edited title"
+
+    assert sync_playlist_incrementally(playlist, sync_state)
+    assert playlist.requested_page_tokens == [None]
+    assert sync_state.episodes["video001"].title == "Edited title"
+
+
+def test_removal_and_front_add_needs_a_full_sync():
+    playlist = StubPlaylist(create_video_ids(120))
+    sync_state = sync_fully(playlist, "PLreplaced")
+    playlist.video_ids.remove("video060")
+    playlist.video_ids.insert(0, "new000")
+
+    assert not sync_playlist_incrementally(playlist, sync_state)
+
+
+def test_removal_and_end_append_is_missed_until_the_next_full_sync():
+    playlist = StubPlaylist(create_video_ids(120))
+    sync_playlist(playlist, "PLgap")
+    playlist.video_ids.remove("video060")
+    playlist.video_ids.append("new000")
+
+    # The item count and first page are unchanged, so the first page's ETag still matches
+    sync_state = sync_playlist(playlist, "PLgap")
+    assert "video060" in sync_state.episodes
+    assert "new000" not in sync_state.episodes
+
+    sync_state.full_synced_at -= FULL_SYNC_INTERVAL.total_seconds()
+    sync_state = sync_playlist(playlist, "PLgap")
+    assert set(sync_state.episodes) == set(playlist.video_ids)
@@ -0,0 +1,179 @@
+import re
+from datetime import datetime, timedelta, timezone
+from typing import Iterator, Sequence
+
+import pytest
+from flask import Flask
+
+from podcastsponsorblock.helpers import sharedcache
+from podcastsponsorblock.main import populate_service_config
+from podcastsponsorblock.models import (
+    Author,
+    EpisodeDetails,
+    EpisodeWindow,
+    FeedOptions,
+    FeedPage,
+    FeedValidators,
+    ItemDetails,
+    PodcastConfig,
+)
+from podcastsponsorblock.views import youtuberssview
+
+PLAYLIST_ID = "PLtest"
+LAST_BUILD_DATE_PATTERN = re.compile(rb"<lastBuildDate>[^<]*</lastBuildDate>")
+
+
+@pytest.fixture
+def service_config(tmp_path, monkeypatch):
+    monkeypatch.setattr(sharedcache, "_shared_cache_data_path", None)
+    sharedcache.configure_shared_cache(tmp_path)
+    return populate_service_config(
+        {"PODCAST_YOUTUBE_API_KEY": "test-key", "PODCAST_DATA_PATH": str(tmp_path)}
+    )
+
+
+class StubEpisodeFeed:
+    def __init__(self, episode_count: int):
+        author = Author("Test Channel", "UCtest")
+        first_published_at = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        self.playlist_details = ItemDetails(
+            PLAYLIST_ID,
+            "Test Podcast",
+            "A test playlist",
+            author,
+            "https://example.com/logo.jpg",
+        )
+        self.logo = "https://example.com/logo.jpg"
+        self.episodes = tuple(
+            EpisodeDetails(
+                f"video{index}",
+                f"Episode {index}: <markup> & entities",
+                "An episode",
+                author,
+                "https://example.com/thumbnail.jpg",
+                first_published_at + timedelta(days=index),
+            )
+            for index in range(episode_count)
+        )
+
+    def get_episodes(
+        self, window: EpisodeWindow = EpisodeWindow()
+    ) -> Sequence[EpisodeDetails]:
+        newest_episodes = tuple(reversed(self.episodes))[window.offset :]
+        return (
+            newest_episodes if window.limit is None else newest_episodes[: window.limit]
+        )
+
+    def __iter__(self) -> Iterator[EpisodeDetails]:
+        return iter(self.episodes)
+
+
+def compute_validators(service_config, episode_feed, previous_validators=None):
+    return youtuberssview.compute_feed_validators(
+        episode_feed,
+        FeedOptions(service_config, None, ""),
+        FeedPage(episodes=episode_feed.episodes, links=dict()),
+        previous_validators,
+    )
+
+
+def test_unchanged_feeds_keep_their_validators(service_config):
+    validators = compute_validators(service_config, StubEpisodeFeed(2))
+
+    recomputed_validators = compute_validators(
+        service_config, StubEpisodeFeed(2), validators
+    )
+
+    assert recomputed_validators == validators
+
+
+def test_changed_feeds_get_a_new_etag_and_last_modified(service_config):
+    validators = compute_validators(service_config, StubEpisodeFeed(2))
+    previous_validators = FeedValidators(
+        validators.etag, datetime(2020, 1, 1, tzinfo=timezone.utc)
+    )
+
+    changed_validators = compute_validators(
+        service_config, StubEpisodeFeed(3), previous_validators
+    )
+
+    assert changed_validators.etag != validators.etag
+    assert changed_validators.last_modified > previous_validators.last_modified
+    assert changed_validators.last_modified.microsecond == 0
+
+
+@pytest.mark.parametrize(
+    "headers",
+    (
+        {"If-None-Match": 'W/"feed-etag"'},
+        {"If-Modified-Since": "Wed, 01 Jan 2020 00:00:00 GMT"},
+    ),
+)
+def test_conditional_requests_for_the_current_feed_are_answered_before_any_feed_work(
+    service_config, monkeypatch, headers
+):
+    def create_episode_feed(**kwargs):
+        raise AssertionError("The feed was loaded for a 304")
+
+    monkeypatch.setattr(
+        youtuberssview, "YoutubePlaylistEpisodeFeed", create_episode_feed
+    )
+    window = youtuberssview.get_episode_window(dict(), 1, None)
+    youtuberssview._feed_validators[
+        youtuberssview.get_feed_cache_key(PLAYLIST_ID, "", window, dict())
+    ] = FeedValidators("feed-etag", datetime(2020, 1, 1, tzinfo=timezone.utc))
+    app = Flask(__name__)
+    app.config["PODCAST_SERVICE_CONFIG"] = service_config
+    app.add_url_rule(
+        "/rss/youtube/<string:playlist_id>",
+        view_func=youtuberssview.YoutubeRSSView.as_view("youtube_rss_view"),
+    )
+
+    response = app.test_client().get(f"/rss/youtube/{PLAYLIST_ID}", headers=headers)
+
+    assert response.status_code == 304
+    assert response.headers["ETag"] == 'W/"feed-etag"'
+
+
+@pytest.mark.parametrize(
+    "podcast_config",
+    (
+        None,
+        PodcastConfig(
+            id=PLAYLIST_ID,
+            language="en",
+            description="A <test> podcast",
+            itunes_category="Technology",
+            explicit=False,
+            itunes_id=None,
+            prefetch_episodes=None,
+            episode_limit=None,
+            episode_window_days=None,
+            categories_to_remove=None,
+        ),
+    ),
+)
+def test_streamed_feeds_match_feedgen(service_config, podcast_config):
+    episode_feed = StubEpisodeFeed(3)
+    feed_options = FeedOptions(service_config, podcast_config, "podcasts.example.com")
+    app = Flask(__name__)
+    app.add_url_rule("/media/youtube/<string:video_id>", endpoint="youtube_media_view")
+    build_date = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+    with app.test_request_context(base_url="https://podcasts.example.com"):
+        feedgen_output = youtuberssview.generate_rss_feed(episode_feed, feed_options)
+        streamed_chunks = tuple(
+            youtuberssview.stream_rss_feed(
+                episode_feed, feed_options, build_date=build_date
+            )
+        )
+
+    # feedgen stamps the feed with the time it was rendered
+    assert LAST_BUILD_DATE_PATTERN.sub(b"", feedgen_output) == (
+        LAST_BUILD_DATE_PATTERN.sub(b"", b"".join(streamed_chunks))
+    )
+    assert b"<lastBuildDate>Mon, 01 Jan 2024 00:00:00 +0000</lastBuildDate>" in (
+        streamed_chunks[0]
+    )
+    # The channel header, one chunk per episode and the closing tags
+    assert len(streamed_chunks) == 5